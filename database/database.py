@@ -8,14 +8,14 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 
-from config import Environ
 from database.models import Base, User
 from database.repo.subscription import SubscriptionRepo
 from database.repo.transactions import TransactionRepo
 from database.repo.user import UserRepo
 from database.repo.currency_repo import CurrencyRepo
 from database.repo.regional_pricing_repo import RegionalPricingRepo
-from database.repo.analysis_history import AnalysisHistoryRepo
+from database.session import ScopedSessionmaker, TimedQueuePool, install_pool_metrics, warm_up_pool
+from settings import get_settings
 
 # Настраиваем логирование
 logger = logging.getLogger(__name__)
@@ -34,14 +34,15 @@ class ORM:
 
     def __init__(self):
         """Initialize ORM with environment settings and setup engine."""
-        self.settings = Environ()
+        self.settings = get_settings()
         self.user_repo: Optional[UserRepo] = None
         self.subscription_repo: Optional[SubscriptionRepo] = None
         self.transactions: Optional[TransactionRepo] = None
         self.currency_repo: Optional[CurrencyRepo] = None
         self.regional_pricing_repo: Optional[RegionalPricingRepo] = None
-        self.analysis_history_repo: Optional[AnalysisHistoryRepo] = None
         self.async_sessionmaker: Optional[async_sessionmaker] = None
+        # Сессии для обработчиков и сервисов: общая сессия обновления, если она открыта
+        self.scoped_sessionmaker: Optional[ScopedSessionmaker] = None
         self.engine = None
         self.session_maker = None
 
@@ -52,13 +53,30 @@ class ORM:
         # Унифицируем создание движка, чтобы везде был асинхронный
         # Это решает проблему с NullPool, который приводил к утечке соединений
         db_url = self.settings.asyncpg_url()
-        self.engine = create_async_engine(db_url, echo=False)
+        # Пул соединений: по умолчанию - значения SQLAlchemy, кеш подготовленных запросов asyncpg - 100
+        settings = get_settings()
+        self.engine = create_async_engine(
+            db_url,
+            echo=False,
+            poolclass=TimedQueuePool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_recycle=settings.db_pool_recycle,
+            connect_args={"prepared_statement_cache_size": settings.db_statement_cache_size},
+        )
+        install_pool_metrics(self.engine)
         self.async_sessionmaker = async_sessionmaker(
             self.engine,
             expire_on_commit=False,
             autoflush=False
         )
 
+    async def warm_up(self):
+        """Заранее открывает pool_size соединений (отключается DB_POOL_WARMUP=0)."""
+        if get_settings().db_pool_warmup:
+            await warm_up_pool(self.engine, self.engine.pool.size())
+
     async def get_async_engine(self, echo=False):
         """Get async engine with optional echo parameter."""
         # Создаем новый движок если нужен другой echo
@@ -77,7 +95,7 @@ class ORM:
 
     def create_tables(self, with_drop=False, echo: bool = False):
         """Create database tables with optional drop and user backup."""
-        env = Environ()
+        env = self.settings
         engine = create_engine(
             f"postgresql://{env.user}:{env.password}@"
             f"{env.host}:{env.port}/{env.dbname}",
@@ -164,16 +182,15 @@ class ORM:
             self._setup_engine()
 
         if self.async_sessionmaker:
-            # Создаем репозитории
-            self.user_repo = UserRepo(self.async_sessionmaker)
-            self.subscription_repo = SubscriptionRepo(self.async_sessionmaker)
-            self.transactions = TransactionRepo(self.async_sessionmaker)
-            self.currency_repo = CurrencyRepo(self.async_sessionmaker)
+            # Репозитории берут общую сессию обновления, если она открыта (DbSessionMiddleware)
+            scoped_sessionmaker = ScopedSessionmaker(self.async_sessionmaker)
+            self.scoped_sessionmaker = scoped_sessionmaker
+            self.user_repo = UserRepo(scoped_sessionmaker)
+            self.subscription_repo = SubscriptionRepo(scoped_sessionmaker)
+            self.transactions = TransactionRepo(scoped_sessionmaker)
+            self.currency_repo = CurrencyRepo(scoped_sessionmaker)
             self.regional_pricing_repo = RegionalPricingRepo(
-                self.async_sessionmaker
-            )
-            self.analysis_history_repo = AnalysisHistoryRepo(
-                self.async_sessionmaker
+                scoped_sessionmaker
             )
         else:
             logger.error(
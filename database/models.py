@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Annotated, Optional
 from decimal import Decimal
-from sqlalchemy import Column, text, BigInteger, ForeignKey, DateTime, func, Boolean, String, Numeric, Index, Text
+from sqlalchemy import Column, text, BigInteger, ForeignKey, DateTime, func, Boolean, String, Numeric, Index, Text, DDL, event
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 intpk = Annotated[int, mapped_column(BigInteger, primary_key=True, autoincrement=True)]
@@ -23,7 +23,12 @@ class User(Base):
         Index('ix_users_role', 'role'),
         Index('ix_users_lang', 'lang'),
         Index('ix_user_id', 'user_id', postgresql_using='hash'),
-        Index('ix_users_token_balance', 'token_balance')
+        Index('ix_users_token_balance', 'token_balance'),
+        # Поиск пользователей админом по подстроке и похожести (pg_trgm)
+        Index('ix_users_username_trgm', 'username', postgresql_using='gin',
+              postgresql_ops={'username': 'gin_trgm_ops'}),
+        Index('ix_users_fullname_trgm', 'fullname', postgresql_using='gin',
+              postgresql_ops={'fullname': 'gin_trgm_ops'}),
     )
     id: Mapped[intpk]
     user_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
@@ -69,7 +74,10 @@ class Subscription(Base):
         Index('ix_subscriptions_user_id', 'user_id'),
         Index('ix_subscriptions_date_end', 'date_end'),
         Index('ix_subscriptions_product', 'product'),
-        Index('uq_user_crash_reporter', 'user_id', 'crash_reporter_key', unique=True)
+        Index('uq_user_crash_reporter', 'user_id', 'crash_reporter_key', unique=True),
+        # Поиск по префиксу ключа (LIKE 'prefix%') не зависит от правил сортировки базы
+        Index('ix_subscriptions_user_crash_key_pattern', 'user_id', 'crash_reporter_key',
+              postgresql_ops={'crash_reporter_key': 'varchar_pattern_ops'}),
     )
 
     id: Mapped[intpk]
@@ -127,11 +135,14 @@ class RegionalPricing(Base):
 class AnalysisHistory(Base):
     __tablename__ = "analysis_history"
     __table_args__ = (
-        Index('ix_analysis_history_user_id', 'user_id'),
+        # Пагинация истории по ключу (user_id, created_at, id); заменяет отдельный индекс по user_id
+        Index('ix_analysis_history_user_created_id', 'user_id', 'created_at', 'id'),
         Index('ix_analysis_history_created_at', 'created_at'),
         Index('ix_analysis_history_device_model', 'device_model'),
         Index('ix_analysis_history_file_type', 'file_type'),
         Index('ix_analysis_history_success', 'is_solution_found'),
+        # Помесячные партиции по created_at (см. database/partitions.py)
+        {'postgresql_partition_by': 'RANGE (created_at)'},
     )
 
     id: Mapped[intpk]
@@ -156,7 +167,9 @@ class AnalysisHistory(Base):
     
     # Метаданные
     tokens_used: Mapped[int] = mapped_column(default=0, nullable=False)  # количество потраченных токенов
-    created_at: Mapped[created_at_pk]
+    prompt_version: Mapped[Optional[str]] = mapped_column(String(32))  # версия промпта/базы кодов, если анализ шел через ИИ
+    # Ключ секционирования входит в первичный ключ (требование Postgres к секционированным таблицам)
+    created_at: Mapped[datetime] = mapped_column(primary_key=True, server_default=text("TIMEZONE('utc', now())"))
     
     # Повторные круги анализа
     repeat_attempts: Mapped[int] = mapped_column(default=0, nullable=False)  # количество кругов повторного анализа
@@ -167,5 +180,38 @@ class AnalysisHistory(Base):
     user: Mapped["User"] = relationship("User", back_populates="analysis_history")
 
 
+class UserAnalysisStats(Base):
+    """Счетчики истории анализов пользователя по типам файлов (обновляются вместе с историей)"""
+    __tablename__ = "user_analysis_stats"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    file_type: Mapped[str] = mapped_column(String(20), primary_key=True)
+    total_analyses: Mapped[int] = mapped_column(default=0, nullable=False)
+    successful_analyses: Mapped[int] = mapped_column(default=0, nullable=False)
+    tokens_used: Mapped[int] = mapped_column(default=0, nullable=False)
+
+
+class FileAttempt(Base):
+    """Круги анализа одного и того же файла (по SHA256) у пользователя"""
+    __tablename__ = "file_attempts"
+
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('users.user_id', ondelete='CASCADE'), primary_key=True)
+    file_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    attempts: Mapped[int] = mapped_column(default=0, nullable=False)  # неудачных кругов подряд
+    last_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    blocked_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+
+
+# Индексы ix_users_*_trgm требуют расширения pg_trgm
+event.listen(User.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
+# Партиция по умолчанию, чтобы вставка не падала, пока не созданы помесячные партиции
+event.listen(
+    AnalysisHistory.__table__,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS analysis_history_default PARTITION OF analysis_history DEFAULT")
+)
+
+
 # Добавляем связь к модели User
 User.analysis_history = relationship("AnalysisHistory", back_populates="user", cascade="all, delete-orphan")
\ No newline at end of file
@@ -0,0 +1,160 @@
+"""
+Помесячные партиции таблицы analysis_history.
+
+analysis_history секционирована по диапазону created_at (PARTITION BY RANGE):
+по партиции на календарный месяц (analysis_history_yYYYYmMM) и партиция
+analysis_history_default для строк вне созданных диапазонов. Партиции на
+текущий и HISTORY_PARTITION_MONTHS_AHEAD следующих месяцев создаются заранее (при
+старте и по расписанию), а очистка истории отсоединяет и удаляет целые
+партиции вместо построчного DELETE.
+
+Если таблица еще не секционирована (база до scripts/partition_analysis_history.py),
+функции ничего не делают, а очистка идет построчно.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TABLE = "analysis_history"
+DEFAULT_PARTITION = f"{HISTORY_TABLE}_default"
+
+_PARTITION_NAME_RE = re.compile(rf"^{HISTORY_TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    month_index = value.year * 12 + value.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f"{HISTORY_TABLE}_y{month:%Y}m{month:%m}"
+
+
+def partition_ddl(month: datetime, parent: str = HISTORY_TABLE) -> str:
+    """CREATE TABLE для партиции месяца month (имя всегда от analysis_history)."""
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {parent} "
+        f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+    )
+
+
+async def is_history_partitioned(conn: AsyncConnection, table: str = HISTORY_TABLE) -> bool:
+    return bool(await conn.scalar(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid "
+        "WHERE c.relname = :table AND pg_table_is_visible(c.oid))"
+    ), {"table": table}))
+
+
+async def list_history_partitions(conn: AsyncConnection) -> List[Tuple[str, datetime]]:
+    """Помесячные партиции analysis_history: (имя, начало месяца), по возрастанию."""
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relname = :table AND pg_table_is_visible(parent.oid)"
+    ), {"table": HISTORY_TABLE})
+    partitions = []
+    for (name,) in result:
+        match = _PARTITION_NAME_RE.match(name)
+        if match:
+            partitions.append((name, datetime(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+async def ensure_history_partitions(
+        engine: AsyncEngine,
+        months_ahead: Optional[int] = None,
+        now: Optional[datetime] = None
+) -> List[str]:
+    """Создает недостающие партиции на текущий и months_ahead следующих месяцев."""
+    if months_ahead is None:
+        months_ahead = get_settings().history_partition_months_ahead
+    created = []
+    async with engine.connect() as conn:
+        if not await is_history_partitioned(conn):
+            return created
+        existing = {name for name, _ in await list_history_partitions(conn)}
+
+    current = month_start(now or datetime.utcnow())
+    for offset in range(max(0, months_ahead) + 1):
+        month = add_months(current, offset)
+        if partition_name(month) in existing:
+            continue
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(partition_ddl(month)))
+            created.append(partition_name(month))
+        except Exception as e:
+            # Обычно значит, что строки этого месяца уже попали в партицию по умолчанию
+            logger.error(f"Не удалось создать партицию {partition_name(month)}: {e}")
+    if created:
+        logger.info(f"Созданы партиции истории анализов: {', '.join(created)}")
+    return created
+
+
+async def list_expired_partitions(conn: AsyncConnection, cutoff: datetime) -> List[str]:
+    """Помесячные партиции, целиком лежащие до cutoff (партиция по умолчанию не входит)."""
+    return [
+        name for name, month in await list_history_partitions(conn)
+        if add_months(month, 1) <= cutoff
+    ]
+
+
+async def drop_history_partitions(
+        engine: AsyncEngine,
+        cutoff: datetime,
+        dry_run: bool = False,
+        partitions: Optional[List[str]] = None
+) -> int:
+    """
+    Отсоединяет и удаляет партиции, целиком лежащие до cutoff (или заранее выбранные
+    partitions), и вычитает их строки из user_analysis_stats. Месяц, в который
+    попадает cutoff, остается до следующего запуска. Возвращает число удаленных
+    (при dry_run - подлежащих удалению) строк.
+    """
+    async with engine.connect() as conn:
+        if not await is_history_partitioned(conn):
+            return 0
+        if partitions is None:
+            partitions = await list_expired_partitions(conn, cutoff)
+
+    removed_total = 0
+    for name in partitions:
+        # Одна транзакция на партицию: счетчики и удаление партиции согласованы
+        async with engine.begin() as conn:
+            rows = await conn.scalar(text(f"SELECT COUNT(*) FROM {name}")) or 0
+            removed_total += rows
+            if dry_run:
+                logger.info(f"Партиция {name} (dry run): {rows} записей к удалению")
+                continue
+            await conn.execute(text(f"""
+                UPDATE user_analysis_stats s SET
+                    total_analyses = GREATEST(s.total_analyses - d.total, 0),
+                    successful_analyses = GREATEST(s.successful_analyses - d.successful, 0),
+                    tokens_used = GREATEST(s.tokens_used - d.tokens, 0)
+                FROM (
+                    SELECT user_id, file_type, COUNT(*) AS total,
+                           COUNT(*) FILTER (WHERE is_solution_found) AS successful,
+                           COALESCE(SUM(tokens_used), 0) AS tokens
+                    FROM {name}
+                    GROUP BY user_id, file_type
+                ) d
+                WHERE s.user_id = d.user_id AND s.file_type = d.file_type
+            """))
+            await conn.execute(text(f"ALTER TABLE {HISTORY_TABLE} DETACH PARTITION {name}"))
+            await conn.execute(text(f"DROP TABLE {name}"))
+        logger.info(f"Партиция {name} удалена: {rows} записей")
+    return removed_total
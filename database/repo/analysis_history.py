@@ -1,14 +1,69 @@
+import logging
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
-from sqlalchemy import desc, func, and_, or_, select
+from sqlalchemy import desc, func, and_, or_, select, tuple_, literal, delete, update, case
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import aliased
 
-from database.models import AnalysisHistory, User
+from database.models import AnalysisHistory, User, UserAnalysisStats, FileAttempt
+
+logger = logging.getLogger(__name__)
+
+# Лимит неудачных кругов анализа одного файла и длительность блокировки после него
+MAX_FILE_ATTEMPTS = 2
+FILE_BLOCK_PERIOD = timedelta(hours=3)
 
 
 class AnalysisHistoryRepo:
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, autocommit: bool = True):
+        """
+        autocommit=False - репозиторий работает внутри чужой транзакции
+        (например, в complete_analysis) и только отправляет изменения через flush.
+        """
         self.session = session
+        self.autocommit = autocommit
+
+    async def _commit(self):
+        if self.autocommit:
+            await self.session.commit()
+        else:
+            await self.session.flush()
+
+    async def _add_stats(self, user_id: int, file_type: str, total: int, successful: int, tokens: int):
+        """Прибавить к счетчикам user_analysis_stats (в той же транзакции, что и история)."""
+        stmt = insert(UserAnalysisStats).values(
+            user_id=user_id,
+            file_type=file_type,
+            total_analyses=total,
+            successful_analyses=successful,
+            tokens_used=tokens
+        )
+        await self.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[UserAnalysisStats.user_id, UserAnalysisStats.file_type],
+                set_=dict(
+                    total_analyses=UserAnalysisStats.total_analyses + stmt.excluded.total_analyses,
+                    successful_analyses=UserAnalysisStats.successful_analyses + stmt.excluded.successful_analyses,
+                    tokens_used=UserAnalysisStats.tokens_used + stmt.excluded.tokens_used
+                )
+            )
+        )
+
+    async def _subtract_stats(self, user_id: int, file_type: str, total: int, successful: int, tokens: int):
+        """Вычесть из счетчиков user_analysis_stats удаленные записи истории."""
+        await self.session.execute(
+            update(UserAnalysisStats)
+            .where(
+                UserAnalysisStats.user_id == user_id,
+                UserAnalysisStats.file_type == file_type
+            )
+            .values(
+                total_analyses=func.greatest(UserAnalysisStats.total_analyses - total, 0),
+                successful_analyses=func.greatest(UserAnalysisStats.successful_analyses - successful, 0),
+                tokens_used=func.greatest(UserAnalysisStats.tokens_used - tokens, 0)
+            )
+        )
 
     async def create_analysis_record(
         self,
@@ -24,7 +79,8 @@ class AnalysisHistoryRepo:
         error_description: Optional[str] = None,
         solution_text: Optional[str] = None,
         is_solution_found: bool = False,
-        tokens_used: int = 0
+        tokens_used: int = 0,
+        prompt_version: Optional[str] = None
     ) -> AnalysisHistory:
         """Создать новую запись анализа"""
         analysis = AnalysisHistory(
@@ -40,25 +96,36 @@ class AnalysisHistoryRepo:
             error_description=error_description,
             solution_text=solution_text,
             is_solution_found=is_solution_found,
-            tokens_used=tokens_used
+            tokens_used=tokens_used,
+            prompt_version=prompt_version
         )
         
         self.session.add(analysis)
-        await self.session.commit()
+        await self._add_stats(user_id, file_type, 1, int(is_solution_found), tokens_used or 0)
+        await self._commit()
         await self.session.refresh(analysis)
         return analysis
 
     async def get_user_history(
         self,
         user_id: int,
-        page: int = 0,
         page_size: int = 10,
+        cursor: Optional[int] = None,
+        backward: bool = False,
         file_type_filter: Optional[str] = None,
         success_filter: Optional[bool] = None,
         date_from: Optional[datetime] = None,
         date_to: Optional[datetime] = None
     ) -> Dict[str, Any]:
-        """Получить историю анализов пользователя с пагинацией и фильтрами"""
+        """
+        Страница истории анализов пользователя (новые сверху) с фильтрами.
+
+        Пагинация по ключу (created_at, id) вместо OFFSET и COUNT(*): cursor -
+        id последней записи предыдущей страницы (или первой, если backward=True
+        и листаем назад). Запрос идет по индексу ix_analysis_history_user_created_id
+        и читает только page_size + 1 строк, лишняя строка показывает, есть ли
+        еще страница в этом направлении.
+        """
         query = select(AnalysisHistory).filter(
             AnalysisHistory.user_id == user_id
         )
@@ -75,36 +142,35 @@ class AnalysisHistoryRepo:
         
         if date_to:
             query = query.filter(AnalysisHistory.created_at <= date_to)
-        
-        # Подсчет общего количества
-        count_query = select(func.count(AnalysisHistory.id)).filter(
-            AnalysisHistory.user_id == user_id
-        )
-        if file_type_filter:
-            count_query = count_query.filter(AnalysisHistory.file_type == file_type_filter)
-        if success_filter is not None:
-            count_query = count_query.filter(AnalysisHistory.is_solution_found == success_filter)
-        if date_from:
-            count_query = count_query.filter(AnalysisHistory.created_at >= date_from)
-        if date_to:
-            count_query = count_query.filter(AnalysisHistory.created_at <= date_to)
-            
-        total_count = await self.session.scalar(count_query)
-        
-        # Получаем записи с пагинацией
-        analyses_result = await self.session.execute(
-            query.order_by(desc(AnalysisHistory.created_at))
-            .offset(page * page_size)
-            .limit(page_size)
-        )
-        analyses = analyses_result.scalars().all()
-        
+
+        sort_key = tuple_(AnalysisHistory.created_at, AnalysisHistory.id)
+        if cursor is not None:
+            anchor = aliased(AnalysisHistory)
+            anchor_created_at = select(anchor.created_at).where(anchor.id == cursor).scalar_subquery()
+            anchor_key = tuple_(anchor_created_at, literal(cursor))
+            query = query.filter(sort_key > anchor_key if backward else sort_key < anchor_key)
+
+        if backward:
+            query = query.order_by(AnalysisHistory.created_at, AnalysisHistory.id)
+        else:
+            query = query.order_by(desc(AnalysisHistory.created_at), desc(AnalysisHistory.id))
+
+        analyses_result = await self.session.execute(query.limit(page_size + 1))
+        analyses = list(analyses_result.scalars().all())
+        has_more = len(analyses) > page_size
+        analyses = analyses[:page_size]
+
+        if backward:
+            analyses.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, cursor is not None
+
         return {
             "analyses": analyses,
-            "total_count": total_count or 0,
-            "page": page,
             "page_size": page_size,
-            "total_pages": ((total_count or 0) + page_size - 1) // page_size
+            "has_next": has_next,
+            "has_prev": has_prev
         }
 
     async def get_analysis_by_id(self, analysis_id: int, user_id: int) -> Optional[AnalysisHistory]:
@@ -124,74 +190,114 @@ class AnalysisHistoryRepo:
         analysis = await self.get_analysis_by_id(analysis_id, user_id)
         if analysis:
             await self.session.delete(analysis)
-            await self.session.commit()
+            await self._subtract_stats(
+                user_id, analysis.file_type, 1, int(analysis.is_solution_found), analysis.tokens_used or 0
+            )
+            await self._commit()
             return True
         return False
 
     async def get_user_statistics(self, user_id: int) -> Dict[str, Any]:
-        """Получить статистику анализов пользователя"""
-        # Общее количество анализов
-        total_analyses = await self.session.scalar(
-            select(func.count(AnalysisHistory.id))
-            .filter(AnalysisHistory.user_id == user_id)
-        )
-        
-        # Успешные анализы
-        successful_analyses = await self.session.scalar(
-            select(func.count(AnalysisHistory.id))
-            .filter(
-                and_(
-                    AnalysisHistory.user_id == user_id,
-                    AnalysisHistory.is_solution_found == True
-                )
-            )
-        )
-        
-        # Потраченные токены
-        total_tokens = await self.session.scalar(
-            select(func.sum(AnalysisHistory.tokens_used))
-            .filter(AnalysisHistory.user_id == user_id)
-        ) or 0
-        
-        # Анализы по типам файлов
-        file_types_result = await self.session.execute(
-            select(
-                AnalysisHistory.file_type,
-                func.count(AnalysisHistory.id).label('count')
-            )
-            .filter(AnalysisHistory.user_id == user_id)
-            .group_by(AnalysisHistory.file_type)
+        """
+        Получить статистику анализов пользователя.
+
+        Читает готовые счетчики из user_analysis_stats (по строке на тип файла)
+        вместо агрегатов по всей истории.
+        """
+        result = await self.session.execute(
+            select(UserAnalysisStats).filter(UserAnalysisStats.user_id == user_id)
         )
-        file_types = {row[0]: row[1] for row in file_types_result}
+        rows = result.scalars().all()
         
-        total_analyses_value = total_analyses or 0
-        successful_analyses_value = successful_analyses or 0
+        total_analyses_value = sum(row.total_analyses for row in rows)
+        successful_analyses_value = sum(row.successful_analyses for row in rows)
         
         return {
             "total_analyses": total_analyses_value,
             "successful_analyses": successful_analyses_value,
             "failed_analyses": total_analyses_value - successful_analyses_value,
             "success_rate": (successful_analyses_value / total_analyses_value * 100) if total_analyses_value else 0,
-            "total_tokens_used": total_tokens,
-            "file_types": file_types
+            "total_tokens_used": sum(row.tokens_used for row in rows),
+            "file_types": {row.file_type: row.total_analyses for row in rows if row.total_analyses}
         }
 
-    async def cleanup_old_analyses(self, days_to_keep: int = 30) -> int:
-        """Удалить старые анализы (автоматическая очистка)"""
+    async def cleanup_old_analyses(
+        self,
+        days_to_keep: int = 30,
+        batch_size: int = 5000,
+        dry_run: bool = False
+    ) -> int:
+        """
+        Удалить старые анализы (автоматическая очистка) пачками по batch_size.
+        При dry_run=True ничего не удаляет и возвращает, сколько строк было бы удалено.
+        """
         cutoff_date = datetime.utcnow() - timedelta(days=days_to_keep)
+        condition = AnalysisHistory.created_at < cutoff_date
         
-        result = await self.session.execute(
-            select(AnalysisHistory)
-            .filter(AnalysisHistory.created_at < cutoff_date)
-        )
-        old_analyses = result.scalars().all()
-        
-        deleted_count = len(old_analyses)
-        for analysis in old_analyses:
-            await self.session.delete(analysis)
+        if dry_run:
+            count = await self.session.scalar(select(func.count(AnalysisHistory.id)).where(condition))
+            logger.info(f"Очистка истории (dry run): старше {cutoff_date:%Y-%m-%d} - {count or 0} записей")
+            return count or 0
         
-        await self.session.commit()
-        return deleted_count
+        return await self._delete_in_batches(condition, batch_size, f"старше {cutoff_date:%Y-%m-%d}")
+
+    async def delete_archived_analyses(self, cutoff: datetime, max_id: int, batch_size: int = 5000) -> int:
+        """Удалить записи, выгруженные в архив: старше cutoff и с id не больше max_id."""
+        condition = and_(AnalysisHistory.created_at < cutoff, AnalysisHistory.id <= max_id)
+        return await self._delete_in_batches(condition, batch_size, f"архив до {cutoff:%Y-%m-%d}")
+
+    async def _delete_in_batches(self, condition, batch_size: int, description: str) -> int:
+        """
+        Удаляет записи истории по условию пачками по диапазонам id: граница пачки
+        находится по индексу, затем один DELETE по диапазону и коммит на пачку,
+        поэтому ни память, ни длина транзакции не зависят от объема удаления.
+        """
+        batch_size = max(1, batch_size)
+        deleted_total = 0
+        last_id = 0
+        while True:
+            upper_id = await self.session.scalar(
+                select(AnalysisHistory.id)
+                .where(condition, AnalysisHistory.id > last_id)
+                .order_by(AnalysisHistory.id)
+                .offset(batch_size - 1)
+                .limit(1)
+            )
+            range_condition = AnalysisHistory.id > last_id
+            if upper_id is not None:
+                range_condition = and_(range_condition, AnalysisHistory.id <= upper_id)
+            
+            result = await self.session.execute(
+                delete(AnalysisHistory)
+                .where(condition, range_condition)
+                .returning(
+                    AnalysisHistory.user_id,
+                    AnalysisHistory.file_type,
+                    AnalysisHistory.is_solution_found,
+                    AnalysisHistory.tokens_used
+                )
+            )
+            deleted_rows = result.all()
+            await self._subtract_deleted_stats(deleted_rows)
+            await self._commit()
+            
+            deleted_total += len(deleted_rows)
+            if deleted_rows:
+                logger.info(f"Удаление истории ({description}): удалено {deleted_total}, последний id {upper_id or 'конец'}")
+            if upper_id is None:
+                return deleted_total
+            last_id = upper_id
+
+    async def _subtract_deleted_stats(self, deleted_rows):
+        """Свести удаленные строки (user_id, file_type, is_solution_found, tokens_used) в счетчики."""
+        deltas: Dict[tuple, List[int]] = {}
+        for user_id, file_type, is_solution_found, tokens_used in deleted_rows:
+            delta = deltas.setdefault((user_id, file_type), [0, 0, 0])
+            delta[0] += 1
+            delta[1] += int(is_solution_found)
+            delta[2] += tokens_used or 0
+        for (user_id, file_type), (total, successful, tokens) in deltas.items():
+            await self._subtract_stats(user_id, file_type, total, successful, tokens)
 
     async def get_recent_analyses_summary(self, user_id: int, limit: int = 3) -> List[AnalysisHistory]:
         """Получить краткую сводку последних анализов для отображения в профиле"""
@@ -203,22 +309,16 @@ class AnalysisHistoryRepo:
         )
         return list(result.scalars().all())
 
-    async def clear_user_history(self, user_id: int) -> int:
+    async def clear_user_history(self, user_id: int, batch_size: int = 5000) -> int:
         """Очистить всю историю анализов пользователя"""
-        # Получаем все анализы пользователя
-        result = await self.session.execute(
-            select(AnalysisHistory)
-            .filter(AnalysisHistory.user_id == user_id)
+        deleted_count = await self._delete_in_batches(
+            AnalysisHistory.user_id == user_id, batch_size, f"пользователь {user_id}"
+        )
+        await self.session.execute(
+            delete(UserAnalysisStats).where(UserAnalysisStats.user_id == user_id)
         )
-        analyses = result.scalars().all()
-        
-        deleted_count = len(analyses)
-        
-        # Удаляем все анализы
-        for analysis in analyses:
-            await self.session.delete(analysis)
         
-        await self.session.commit()
+        await self._commit()
         return deleted_count
 
     async def can_repeat_analysis(self, analysis_id: int, user_id: int) -> tuple[bool, Optional[str]]:
@@ -253,7 +353,7 @@ class AnalysisHistoryRepo:
                     # Сбрасываем счетчик
                     analysis.repeat_attempts = 0
                     analysis.blocked_until = None
-                    await self.session.commit()
+                    await self._commit()
                     return True, None
             
             return False, "Достигнут лимит попыток (2). Попробуйте снова через 3 часа"
@@ -276,7 +376,7 @@ class AnalysisHistoryRepo:
         if analysis.repeat_attempts >= 2:
             analysis.blocked_until = datetime.utcnow() + timedelta(hours=3)
         
-        await self.session.commit()
+        await self._commit()
         return True
 
     async def reset_repeat_attempts(self, analysis_id: int, user_id: int) -> bool:
@@ -291,124 +391,119 @@ class AnalysisHistoryRepo:
         analysis.last_repeat_attempt = None
         analysis.blocked_until = None
         
-        await self.session.commit()
+        await self._commit()
         return True 
 
-    async def can_analyze_file_by_hash(self, user_id: int, file_hash: str) -> tuple[bool, Optional[str], Optional[int]]:
+    @staticmethod
+    def _attempt_limit_message(attempt: Optional[FileAttempt], now: datetime) -> str:
+        if attempt and attempt.blocked_until and now < attempt.blocked_until:
+            remaining = attempt.blocked_until - now
+            hours = int(remaining.total_seconds() // 3600)
+            minutes = int((remaining.total_seconds() % 3600) // 60)
+            if hours > 0:
+                time_left = f"{hours} ч {minutes} мин"
+            else:
+                time_left = f"{minutes} мин"
+            return f"Этот файл заблокирован для повторного анализа. Попробуйте снова через {time_left}"
+        return f"Достигнут лимит кругов анализа для этого файла ({MAX_FILE_ATTEMPTS}). Попробуйте снова через 3 часа"
+
+    async def reserve_attempt_by_hash(self, user_id: int, file_hash: str) -> tuple[bool, Optional[str]]:
         """
-        Проверить, можно ли анализировать файл по его хешу.
-        Возвращает (можно_ли, сообщение_об_ошибке, analysis_id_последней_записи)
+        Занять круг анализа файла до начала анализа, одним INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+        Круг засчитывается сразу (как неудачный): успешный анализ снимает его через
+        reset_attempts_by_hash, а несостоявшийся (нет средств, ошибка) - через cancel_attempt_by_hash.
+        Параллельные загрузки одного файла ждут блокировку строки, поэтому лимит не обойти.
+        Возвращает (можно_ли, сообщение_об_ошибке).
         """
         if not file_hash:
-            return True, None, None
+            return True, None
         
-        # Ищем последнюю запись этого файла у пользователя
+        now = datetime.utcnow()
+        window_start = now - FILE_BLOCK_PERIOD
+        stmt = insert(FileAttempt).values(
+            user_id=user_id,
+            file_hash=file_hash,
+            attempts=1,
+            last_attempt_at=now,
+            blocked_until=now + FILE_BLOCK_PERIOD if MAX_FILE_ATTEMPTS <= 1 else None
+        )
+        # Если с последнего круга прошло больше 3 часов, счет начинается заново
+        attempts = case(
+            (FileAttempt.last_attempt_at < window_start, 1),
+            else_=FileAttempt.attempts + 1
+        )
         result = await self.session.execute(
-            select(AnalysisHistory)
-            .filter(
-                and_(
-                    AnalysisHistory.user_id == user_id,
-                    AnalysisHistory.file_hash == file_hash
+            stmt.on_conflict_do_update(
+                index_elements=[FileAttempt.user_id, FileAttempt.file_hash],
+                set_=dict(
+                    attempts=attempts,
+                    last_attempt_at=now,
+                    # Последний разрешенный круг сразу блокирует файл на 3 часа
+                    blocked_until=case(
+                        (attempts >= MAX_FILE_ATTEMPTS, now + FILE_BLOCK_PERIOD),
+                        else_=None
+                    )
+                ),
+                # Лимит не исчерпан или истек: иначе строка не меняется и RETURNING пуст
+                where=or_(
+                    FileAttempt.attempts < MAX_FILE_ATTEMPTS,
+                    and_(
+                        FileAttempt.last_attempt_at < window_start,
+                        or_(FileAttempt.blocked_until.is_(None), FileAttempt.blocked_until <= now)
+                    )
                 )
-            )
-            .order_by(desc(AnalysisHistory.created_at))
-            .limit(1)
+            ).returning(FileAttempt.attempts)
         )
-        analysis = result.scalars().first()
-        
-        if not analysis:
-            return True, None, None
-        
-        # Если файл уже успешно проанализирован, не ограничиваем
-        if analysis.is_solution_found:
-            return True, None, analysis.id
-        
-        # Проверяем блокировку
-        if analysis.blocked_until:
-            now = datetime.utcnow()
-            if now < analysis.blocked_until:
-                remaining = analysis.blocked_until - now
-                hours = int(remaining.total_seconds() // 3600)
-                minutes = int((remaining.total_seconds() % 3600) // 60)
-                if hours > 0:
-                    time_left = f"{hours} ч {minutes} мин"
-                else:
-                    time_left = f"{minutes} мин"
-                return False, f"Этот файл заблокирован для повторного анализа. Попробуйте снова через {time_left}", analysis.id
+        reserved = result.scalar_one_or_none() is not None
         
-        # Проверяем количество попыток
-        if analysis.repeat_attempts >= 2:
-            # Если прошло больше 3 часов с последнего круга, сбрасываем счетчик
-            if analysis.last_repeat_attempt:
-                time_since_last = datetime.utcnow() - analysis.last_repeat_attempt
-                if time_since_last >= timedelta(hours=3):
-                    # Сбрасываем счетчик
-                    analysis.repeat_attempts = 0
-                    analysis.blocked_until = None
-                    await self.session.commit()
-                    return True, None, analysis.id
-            
-            return False, f"Достигнут лимит кругов анализа для этого файла (2). Попробуйте снова через 3 часа", analysis.id
+        await self._commit()
+        if reserved:
+            return True, None
         
-        return True, None, analysis.id
+        attempt = await self.session.get(FileAttempt, (user_id, file_hash), populate_existing=True)
+        return False, self._attempt_limit_message(attempt, now)
 
-    async def increment_attempts_by_hash(self, user_id: int, file_hash: str) -> bool:
+    async def cancel_attempt_by_hash(self, user_id: int, file_hash: str) -> bool:
         """
-        Увеличить счетчик попыток для файла по хешу.
+        Вернуть круг, занятый reserve_attempt_by_hash, если анализ не состоялся
+        (не хватило средств, ошибка анализа, очередь переполнена).
         """
         if not file_hash:
             return False
         
-        # Ищем последнюю запись этого файла у пользователя
+        remaining = FileAttempt.attempts - 1
         result = await self.session.execute(
-            select(AnalysisHistory)
-            .filter(
-                and_(
-                    AnalysisHistory.user_id == user_id,
-                    AnalysisHistory.file_hash == file_hash
+            update(FileAttempt)
+            .where(
+                FileAttempt.user_id == user_id,
+                FileAttempt.file_hash == file_hash,
+                FileAttempt.attempts > 0
+            )
+            .values(
+                attempts=remaining,
+                blocked_until=case(
+                    (remaining >= MAX_FILE_ATTEMPTS, FileAttempt.blocked_until),
+                    else_=None
                 )
             )
-            .order_by(desc(AnalysisHistory.created_at))
-            .limit(1)
         )
-        analysis = result.scalars().first()
-        
-        if not analysis:
-            return False
-        
-        analysis.repeat_attempts += 1
-        analysis.last_repeat_attempt = datetime.utcnow()
-        
-        # Если достигли лимита попыток, блокируем на 3 часа
-        if analysis.repeat_attempts >= 2:
-            analysis.blocked_until = datetime.utcnow() + timedelta(hours=3)
         
-        await self.session.commit()
-        return True
+        await self._commit()
+        return bool(result.rowcount)
 
     async def reset_attempts_by_hash(self, user_id: int, file_hash: str) -> bool:
         """
-        Сбросить счетчик попыток для файла по хешу (при успешном анализе).
+        Сбросить счетчик попыток для файла по хешу (при успешном анализе), в том числе занятый круг.
         """
         if not file_hash:
             return False
         
-        # Ищем все записи этого файла у пользователя и сбрасываем счетчики
         result = await self.session.execute(
-            select(AnalysisHistory)
-            .filter(
-                and_(
-                    AnalysisHistory.user_id == user_id,
-                    AnalysisHistory.file_hash == file_hash
-                )
+            delete(FileAttempt).where(
+                FileAttempt.user_id == user_id,
+                FileAttempt.file_hash == file_hash
             )
         )
-        analyses = result.scalars().all()
-        
-        for analysis in analyses:
-            analysis.repeat_attempts = 0
-            analysis.last_repeat_attempt = None
-            analysis.blocked_until = None
         
-        await self.session.commit()
-        return len(analyses) > 0
\ No newline at end of file
+        await self._commit()
+        return bool(result.rowcount)
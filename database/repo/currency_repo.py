@@ -1,81 +1,74 @@
-from sqlalchemy import select, update
+from sqlalchemy import Numeric, String, column, update, values
 from sqlalchemy.ext.asyncio import async_sessionmaker
-from sqlalchemy.dialects.postgresql import insert
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 import logging
 
 from database.models import CurrencyRate, RegionalPricing # Импортируем обе модели
+from database.repo import pricing_cache
 from database.repo.repo import Repo
 
 logger = logging.getLogger(__name__)
 
+RATE_PRECISION = Decimal("0.0001")
+
 class CurrencyRepo(Repo):
     def __init__(self, sessionmaker: async_sessionmaker):
         self.sessionmaker = sessionmaker
 
-    async def update_rates(self, rates: dict):
-        """Обновляет курсы валют в таблицах CurrencyRate и RegionalPricing."""
+    async def update_rates(self, rates: dict) -> list[dict]:
+        """
+        Обновляет курсы валют в RegionalPricing одним UPDATE ... FROM (VALUES ...).
+        Курс обновляется у всех стран с этой валютой; строки с тем же курсом не трогаются
+        (сравнение идет с самой таблицей, поэтому учитываются и записи загрузки цен и других реплик).
+        Возвращает измененные строки (country_code, currency, exchange_rate).
+        """
+        normalized = {}
+        for currency_code, rate in rates.items():
+            try:
+                # Курс хранится как Numeric(10, 4): сравниваем и пишем с той же точностью
+                normalized[currency_code] = Decimal(str(rate)).quantize(RATE_PRECISION)
+            except (InvalidOperation, ValueError) as e:
+                logger.error(f"Invalid rate for {currency_code}: {rate} ({e})")
+
+        if not normalized:
+            return []
+
+        # Значения подставляются литералами: у параметров VALUES asyncpg не может вывести тип
+        new_rates = values(
+            column("currency", String(3)),
+            column("rate", Numeric(10, 4)),
+            name="new_rates",
+            literal_binds=True,
+        ).data(list(normalized.items()))
+
         async with self.sessionmaker() as session:
             async with session.begin():
-                updated_currencies = set()
-                for currency_code, rate in rates.items():
-                    try:
-                        # Пытаемся обновить курс в RegionalPricing по коду валюты
-                        # Это обновит exchange_rate для всех стран, использующих эту валюту
-                        stmt_regional = (
-                            update(RegionalPricing)
-                            .where(RegionalPricing.currency == currency_code)
-                            .values(exchange_rate=Decimal(str(rate)))
-                        )
-                        result_regional = await session.execute(stmt_regional)
-                        if result_regional.rowcount > 0:
-                            logger.info(f"Updated exchange_rate for {currency_code} in RegionalPricing ({result_regional.rowcount} rows)")
-
-                        # Обновляем или вставляем курс в CurrencyRate (если он там нужен)
-                        # Используем INSERT ... ON CONFLICT DO UPDATE (UPSERT)
-                        # Ключ конфликта - currency (код валюты), т.к. он уникальный (или должен быть)
-                        # Нужно будет создать UNIQUE constraint на колонку `currency` в модели CurrencyRate!
-                        # stmt_currency = (
-                        #     insert(CurrencyRate)
-                        #     .values(currency=currency_code, target_price_per_usd=Decimal(str(rate)))
-                        #     .on_conflict_do_update(
-                        #         index_elements=['currency'], # Укажите имя вашего уникального индекса/констрейнта
-                        #         set_=dict(target_price_per_usd=Decimal(str(rate)))
-                        #     )
-                        # )
-                        # await session.execute(stmt_currency)
-                        # logger.debug(f"Upserted rate for {currency_code} in CurrencyRate")
-                        # updated_currencies.add(currency_code)
+                result = await session.execute(
+                    update(RegionalPricing)
+                    .where(
+                        RegionalPricing.currency == new_rates.c.currency,
+                        RegionalPricing.exchange_rate.is_distinct_from(new_rates.c.rate),
+                    )
+                    .values(exchange_rate=new_rates.c.rate)
+                    .returning(RegionalPricing.country_code, RegionalPricing.currency, RegionalPricing.exchange_rate)
+                )
+                changed = [dict(row._mapping) for row in result]
 
-                    except Exception as e:
-                        logger.error(f"Error updating rate for {currency_code}: {e}", exc_info=True)
-                        # Не прерываем цикл, пытаемся обновить другие
-            
-            logger.info(f"Finished updating rates. Processed {len(rates)} currencies.")
+        if changed:
+            await pricing_cache.reload(self.sessionmaker)
+        for row in changed:
+            logger.info(f"Updated exchange_rate for {row['country_code']} ({row['currency']}): {row['exchange_rate']}")
+        logger.info(f"Finished updating rates. Processed {len(normalized)} currencies, {len(changed)} rows changed.")
+        return changed
 
     async def get_price_in_user_currency(self, amount_usd: Decimal, country_code: str) -> tuple[Decimal, str]:
         """Возвращает цену в валюте пользователя и символ валюты."""
-        async with self.sessionmaker() as session:
-            # Сначала получаем региональные настройки
-            regional_info = await session.scalar(
-                select(RegionalPricing)
-                .where(RegionalPricing.country_code == country_code.upper())
-            )
-            
-            if not regional_info:
-                # Если для страны нет, берем дефолт (например, US)
-                 regional_info = await session.scalar(
-                    select(RegionalPricing)
-                    .where(RegionalPricing.country_code == "US") # TODO: Сделать дефолт настраиваемым
-                 )
-                 if not regional_info:
-                      logger.error(f"Default regional pricing (US) not found!")
-                      return Decimal("0"), "USD" # Возвращаем 0 и USD в крайнем случае
+        table = await pricing_cache.get_or_load(self.sessionmaker)
+        # Если для страны нет настроек, берем дефолт (US)
+        regional_info = table.get(country_code) or table.default
+        if not regional_info:
+            logger.error(f"Default regional pricing (US) not found!")
+            return Decimal("0"), "USD" # Возвращаем 0 и USD в крайнем случае
 
-            # Теперь используем данные из regional_info
-            exchange_rate = regional_info.exchange_rate # Берем актуальный курс из regional_pricing
-            coefficient = regional_info.coefficient
-            currency_symbol = regional_info.symbol
-            
-            final_price = amount_usd * coefficient * exchange_rate
-            return final_price, currency_symbol 
\ No newline at end of file
+        final_price = amount_usd * regional_info["coefficient"] * regional_info["exchange_rate"]
+        return final_price, regional_info["symbol"]
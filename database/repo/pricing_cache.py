@@ -0,0 +1,80 @@
+"""
+Таблица региональных цен в памяти процесса.
+
+Цены показываются на каждое "Пополнить баланс", пополнение админом и т.д., а
+меняются редко: курсы обновляются раз в сутки (update_database_rates), коэффициенты -
+при загрузке regional_prices.xlsx. Поэтому regional_pricing читается целиком в
+неизменяемую таблицу по коду страны с заранее выбранной ценой по умолчанию (US).
+
+Таблица пересобирается после update_rates / update_pricing_from_list и подменяется
+одной операцией присваивания, обработчики читают ее без блокировок. TTL ограничивает
+устаревание, если цены изменила другая реплика бота.
+"""
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+from sqlalchemy import select
+
+from database.models import RegionalPricing
+from settings import get_settings
+
+DEFAULT_COUNTRY_CODE = "US"  # TODO: Сделать код дефолтной страны настраиваемым
+
+
+@dataclass(frozen=True)
+class PricingTable:
+    by_country: Mapping[str, Mapping[str, Any]]
+    default: Optional[Mapping[str, Any]]
+    expires_at: float
+
+    def get(self, country_code: Optional[str]) -> Optional[Mapping[str, Any]]:
+        if not country_code:
+            return None
+        return self.by_country.get(country_code.upper())
+
+
+_table: Optional[PricingTable] = None
+
+
+def _row_to_mapping(row: RegionalPricing) -> Mapping[str, Any]:
+    return MappingProxyType({
+        "country_code": row.country_code,
+        "currency": row.currency,
+        "symbol": row.symbol,
+        "coefficient": row.coefficient,
+        "exchange_rate": row.exchange_rate
+    })
+
+
+def get_table() -> Optional[PricingTable]:
+    """Текущая таблица или None, если она не загружена или устарела."""
+    table = _table
+    if table is None or table.expires_at <= time.monotonic():
+        return None
+    return table
+
+
+async def reload(sessionmaker) -> PricingTable:
+    """Читает regional_pricing и подменяет таблицу."""
+    global _table
+    async with sessionmaker() as session:
+        rows = (await session.execute(select(RegionalPricing))).scalars().all()
+    by_country = {row.country_code.upper(): _row_to_mapping(row) for row in rows}
+    table = PricingTable(
+        by_country=MappingProxyType(by_country),
+        default=by_country.get(DEFAULT_COUNTRY_CODE),
+        expires_at=time.monotonic() + get_settings().pricing_cache_ttl
+    )
+    _table = table
+    return table
+
+
+async def get_or_load(sessionmaker) -> PricingTable:
+    return get_table() or await reload(sessionmaker)
+
+
+def invalidate():
+    global _table
+    _table = None
@@ -1,11 +1,14 @@
-from sqlalchemy import select, delete
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.dialects.postgresql import insert
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from typing import Any, Mapping
 import logging
 
 from database.models import RegionalPricing
+from database.repo import pricing_cache
 from database.repo.repo import Repo
+from settings import get_settings
 
 logger = logging.getLogger(__name__)
 
@@ -19,44 +22,82 @@ class RegionalPricingRepo(Repo):
             async with session.begin():
                 await session.execute(delete(RegionalPricing))
                 logger.info("Cleared all regional pricing data.")
+        await self.reload_cache()
 
-    async def update_pricing_from_list(self, pricing_data: list):
-        """Обновляет/вставляет данные о ценах из списка словарей."""
+    async def update_pricing_from_list(self, pricing_data: list) -> dict:
+        """
+        Обновляет/вставляет данные о ценах из списка словарей многострочным
+        INSERT ... ON CONFLICT DO UPDATE (пачками по PRICING_UPSERT_CHUNK_SIZE строк).
+        Возвращает отчет: {"added": [коды], "changed": {код: {поле: (было, стало)}}, "unchanged": N}.
+        """
+        # Дубликаты страны в одном INSERT недопустимы: как и раньше, побеждает последняя строка
+        records = {record["country_code"]: record for record in pricing_data}
         async with self.sessionmaker() as session:
             async with session.begin():
-                for record in pricing_data:
-                    # Используем INSERT ... ON CONFLICT DO UPDATE (UPSERT)
+                existing = {
+                    row.country_code: row
+                    for row in (await session.execute(select(RegionalPricing))).scalars()
+                }
+                diff = {"added": [], "changed": {}, "unchanged": 0}
+                to_write = []
+                for country_code, record in records.items():
+                    row = existing.get(country_code)
+                    if row is None:
+                        diff["added"].append(country_code)
+                        to_write.append(record)
+                        continue
+                    changes = {
+                        field: (getattr(row, field), value)
+                        for field, value in record.items()
+                        if field != "country_code" and not self._same_value(getattr(row, field), value)
+                    }
+                    if changes:
+                        diff["changed"][country_code] = changes
+                        to_write.append(record)
+                    else:
+                        diff["unchanged"] += 1
+
+                chunk_size = get_settings().pricing_upsert_chunk_size
+                for chunk_start in range(0, len(to_write), chunk_size):
+                    chunk = to_write[chunk_start:chunk_start + chunk_size]
                     # Ключ конфликта - country_code, т.к. он уникальный
-                    stmt = (
-                        insert(RegionalPricing)
-                        .values(**record) # Передаем весь словарь
-                        .on_conflict_do_update(
-                            index_elements=['country_code'], 
-                            set_=record # Обновляем все поля из словаря при конфликте
-                        )
+                    stmt = insert(RegionalPricing).values(chunk)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=['country_code'],
+                        set_={
+                            field: stmt.excluded[field]
+                            for field in chunk[0] if field != "country_code"
+                        }
                     )
                     await session.execute(stmt)
-                logger.info(f"Upserted {len(pricing_data)} regional pricing records.")
+                logger.info(
+                    f"Upserted {len(to_write)} regional pricing records "
+                    f"({len(diff['added'])} added, {len(diff['changed'])} changed, {diff['unchanged']} unchanged)."
+                )
+        if to_write:
+            await self.reload_cache()
+        return diff
 
-    async def get_pricing_by_country(self, country_code: str) -> dict | None:
-        """Возвращает словарь с данными о ценах для указанной страны."""
-        async with self.sessionmaker() as session:
-            result = await session.execute(
-                select(RegionalPricing).where(RegionalPricing.country_code == country_code.upper())
-            )
-            row = result.scalar_one_or_none()
-            if row:
-                # Преобразуем объект SQLAlchemy в словарь для удобства
-                return {
-                    "country_code": row.country_code,
-                    "currency": row.currency,
-                    "symbol": row.symbol,
-                    "coefficient": row.coefficient,
-                    "exchange_rate": row.exchange_rate
-                }
-            return None
-            
-    async def get_default_pricing(self) -> dict | None:
-         """Возвращает дефолтные настройки цен (например, для US)."""
-         # TODO: Сделать код дефолтной страны настраиваемым
-         return await self.get_pricing_by_country("US") 
\ No newline at end of file
+    @staticmethod
+    def _same_value(current, new) -> bool:
+        if isinstance(current, Decimal):
+            try:
+                return current == Decimal(str(new)).quantize(current)
+            except (InvalidOperation, ValueError):
+                return False
+        return current == new
+
+    async def get_pricing_by_country(self, country_code: str) -> Mapping[str, Any] | None:
+        """Возвращает данные о ценах для указанной страны (из таблицы в памяти)."""
+        table = await pricing_cache.get_or_load(self.sessionmaker)
+        return table.get(country_code)
+
+    async def get_default_pricing(self) -> Mapping[str, Any] | None:
+        """Возвращает дефолтные настройки цен (для US)."""
+        table = await pricing_cache.get_or_load(self.sessionmaker)
+        return table.default
+
+    async def reload_cache(self):
+        """Пересобирает таблицу цен в памяти после изменения regional_pricing."""
+        table = await pricing_cache.reload(self.sessionmaker)
+        logger.info(f"Regional pricing cache rebuilt: {len(table.by_country)} countries.")
@@ -15,12 +15,35 @@ from sqlalchemy import String
 from database.models import User, Subscription, Transaction
 from database.repo.repo import Repo
 from database.repo.exceptions import InsufficientFundsError, UserNotFoundError
+from database.repo import user_cache
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 bot = Bot(token=os.getenv("BOT_TOKEN"))
 
 
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def select_subscription_by_key_prefix(user_id: int, crash_key_prefix: str, now: datetime):
+    """
+    Запрос активной подписки по префиксу crash_reporter_key (ключ, распознанный со
+    скриншота, бывает обрезан). Префикс сравнивается в SQL (LIKE 'prefix%') по индексу
+    ix_subscriptions_user_crash_key_pattern; из нескольких берется самая долгая.
+    """
+    return (
+        select(Subscription).where(
+            Subscription.user_id == user_id,
+            Subscription.crash_reporter_key.like(f"{_escape_like(crash_key_prefix)}%"),
+            Subscription.date_end > now,
+            Subscription.analysis_count > 0
+        )
+        .order_by(Subscription.date_end.desc())
+        .limit(1)
+    )
+
+
 class UserRepo(Repo):
     def __init__(self, sessionmaker: async_sessionmaker):
         self.sessionmaker = sessionmaker
@@ -42,6 +65,7 @@ class UserRepo(Repo):
             logger.warning(f"Attempted to add non-positive tokens ({tokens_to_add}) for user {user_id}")
             return False
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 # Обновляем баланс пользователя
                 result = await session.execute(
@@ -94,6 +118,7 @@ class UserRepo(Repo):
     async def deduct_token(self, user_id: int) -> bool:
         """Списывает 1 токен с баланса пользователя. Возвращает True если успешно, False если недостаточно токенов или ошибка."""
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 current_balance = await session.scalar(
                     select(User.token_balance).where(User.user_id == user_id)
@@ -122,6 +147,15 @@ class UserRepo(Repo):
             result = await session.execute(query)
             return result.scalar_one_or_none()
 
+    async def get_user_cached(self, user_id: int) -> Optional[User]:
+        """Пользователь из короткоживущего кеша (для middleware и фильтра ролей)."""
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await self.find_user_by_user_id(user_id)
+            if user is not None:
+                user_cache.put(user)
+        return user
+
     async def find_user_by_username(self, username) -> User:
         async with self.sessionmaker() as session:
             query = select(User).filter_by(username=username)
@@ -149,6 +183,7 @@ class UserRepo(Repo):
         Создает нового пользователя. Используется для первоначального создания "гостя".
         """
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 # Проверяем, существует ли пользователь, чтобы избежать дублирования
                 existing_user = await session.scalar(select(User).filter_by(user_id=user_id))
@@ -175,6 +210,7 @@ class UserRepo(Repo):
 
     async def upsert_user(self, user_id: int = None, **user_data):
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id or user_data.get("user_id"))
             async with session.begin():  # Используем session.begin() для атомарности
                 if user_id is not None:
                     user = await session.scalar(select(User).filter_by(user_id=user_id))
@@ -216,6 +252,7 @@ class UserRepo(Repo):
 
     async def delete_user(self, user_id: int) -> bool:
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             # Correctly fetch the user by the 'user_id' (Telegram ID) column
             result = await session.execute(select(User).where(User.user_id == user_id))
             user_to_delete = result.scalar_one_or_none()
@@ -265,6 +302,7 @@ class UserRepo(Repo):
             # balance: Decimal = Decimal("0.00") # Оставим возможность передавать, но установим дефолт ниже
     ) -> Tuple[User, bool]:
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             created = False
             # Преобразуем user_id к int, если это строка (на всякий случай)
             user_id_int = int(user_id)
@@ -354,6 +392,7 @@ class UserRepo(Repo):
         Возвращает True если успешно, False если ошибка
         """
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 # Проверяем что администратор существует и имеет права
                 admin = await session.get(User, admin_id)
@@ -379,6 +418,7 @@ class UserRepo(Repo):
         Без проверок прав, только базовые проверки
         """
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             try:
                 await session.execute(
                     update(User)
@@ -402,6 +442,7 @@ class UserRepo(Repo):
         Обновление баланса с проверкой прав и созданием транзакции
         """
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 # Проверка прав администратора
                 if admin_id:
@@ -452,6 +493,7 @@ class UserRepo(Repo):
         Списание средств с баланса
         """
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 user = await session.get(User, user_id, with_for_update=True)
 
@@ -481,6 +523,7 @@ class UserRepo(Repo):
         Пополнение баланса
         """
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 user = await session.get(User, user_id, with_for_update=True)
                 user.balance += amount
@@ -521,6 +564,7 @@ class UserRepo(Repo):
             return False
 
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 # Блокируем строку пользователя
                 user_result = await session.execute(
@@ -575,6 +619,7 @@ class UserRepo(Repo):
     async def update_balance(self, user_id: int, amount: Decimal) -> bool:
         """Обновляет баланс пользователя."""
         async with self.sessionmaker() as session:
+            user_cache.invalidate_on_commit(session, user_id)
             async with session.begin():
                 stmt = update(
                     User
@@ -608,33 +653,54 @@ class UserRepo(Repo):
             
             return users, total_pages
 
-    async def search_users(self, query: str, page: int = 0, limit: int = 10) -> Tuple[List[User], int]:
+    async def search_users(self, query: str, offset: int = 0, limit: int = 10) -> Tuple[List[User], bool]:
         """
         Ищет пользователей по ID, имени пользователя или полному имени.
-        Поддерживает пагинацию.
-        Возвращает список пользователей и общее количество страниц.
+        Число или @username сначала ищутся точным совпадением, иначе - по подстроке
+        в username/fullname (GIN-индексы pg_trgm) с сортировкой по похожести.
+        Возвращает страницу пользователей и признак, что есть следующая.
         """
-        async with self.sessionmaker() as session:
-            # Строим запрос на поиск
-            search_query = select(User).where(
-                or_(
-                    User.user_id.cast(String).ilike(f"%{query}%"),
-                    User.username.ilike(f"%{query}%"),
-                    User.fullname.ilike(f"%{query}%")
-                )
-            ).order_by(User.id)
-
-            # Получаем общее количество совпадающих пользователей для пагинации
-            count_query = select(func.count()).select_from(search_query.alias())
-            total_items = await session.scalar(count_query)
-            total_pages = (total_items + limit - 1) // limit if total_items else 0
+        query = query.strip()
+        if not query:
+            return [], False
+
+        cache_key = (query.lower(), offset, limit)
+        cached = user_cache.get_search(cache_key)
+        if cached is not None:
+            return cached
+
+        async with self.sessionmaker() as session:
+            exact = None
+            # isdigit() пропускает "²" и арабские цифры, а длинный номер не влезет в BIGINT
+            if query.isascii() and query.isdecimal() and int(query) <= 2 ** 63 - 1:
+                exact = select(User).where(User.user_id == int(query))
+            elif query.startswith("@") and len(query) > 1:
+                exact = select(User).where(User.username.ilike(_escape_like(query[1:])))
+            if exact is not None and offset == 0:
+                users = list((await session.scalars(exact.limit(limit))).all())
+                if users:
+                    user_cache.put_search(cache_key, users, False)
+                    return users, False
+
+            text_query = query.lstrip("@")
+            pattern = f"%{_escape_like(text_query)}%"
+            similarity = func.greatest(
+                func.similarity(User.username, text_query),
+                func.similarity(User.fullname, text_query)
+            )
+            search_query = (
+                select(User)
+                .where(or_(User.username.ilike(pattern), User.fullname.ilike(pattern)))
+                .order_by(similarity.desc().nulls_last(), User.id)
+                .offset(offset)
+                .limit(limit + 1)
+            )
+            users = list((await session.scalars(search_query)).all())
 
-            # Применяем пагинацию
-            paginated_query = search_query.offset(page * limit).limit(limit)
-            result = await session.scalars(paginated_query)
-            users = result.all()
-            
-            return users, total_pages
+        has_more = len(users) > limit
+        users = users[:limit]
+        user_cache.put_search(cache_key, users, has_more)
+        return users, has_more
 
     async def get_all_user_ids(self) -> Optional[List[int]]:
         async with self.sessionmaker() as session:
@@ -658,32 +724,6 @@ class UserRepo(Repo):
             )
             return result.scalar_one_or_none()
 
-    async def find_subscription_fuzzy(
-            self, user_id: int, crash_key_prefix: str
-    ) -> Optional[Subscription]:
-        """
-        Ищет активную подписку по префиксу crash_reporter_key.
-        """
-        async with self.sessionmaker() as session:
-            now = datetime.now()
-            # 1. Получаем все активные подписки пользователя
-            active_subs_result = await session.execute(
-                select(Subscription).where(
-                    Subscription.user_id == user_id,
-                    Subscription.date_end > now,
-                    Subscription.analysis_count > 0
-                )
-            )
-            active_subs = active_subs_result.scalars().all()
-
-            # 2. Ищем совпадение по префиксу в Python
-            for sub in active_subs:
-                if sub.crash_reporter_key and sub.crash_reporter_key.startswith(crash_key_prefix):
-                    logger.info(f"Fuzzy match found for user {user_id}: prefix {crash_key_prefix} matched sub key {sub.crash_reporter_key}")
-                    return sub
-            
-            return None
-
     async def create_or_update_subscription(
         self,
         user_id: int,
@@ -0,0 +1,101 @@
+"""
+Короткоживущий кеш пользователей по user_id.
+
+Пользователь (и его роль) нужен на каждом обновлении: DataMiddleware кладет его
+в данные обработчика, RoleFilter проверяет роль. Кеш снимает повторные запросы
+на серию обновлений одного пользователя; изменения пользователя через UserRepo
+сбрасывают запись, а TTL ограничивает устаревание между репликами бота.
+
+Изменения сбрасывают запись и сразу, и после коммита транзакции
+(invalidate_on_commit): пока транзакция не закоммичена, параллельное обновление
+может прочитать из базы старую строку и снова положить ее в кеш.
+
+В кеше лежат значения колонок, а не ORM-объекты: каждый get() отдает свою
+отсоединенную копию User, и параллельные обновления не делят один экземпляр.
+
+Рядом лежит кеш результатов админского поиска пользователей: inline-поиск
+запрашивает его на каждое нажатие клавиши, а одинаковые запросы повторяются.
+Любое изменение пользователя сбрасывает весь кеш поиска.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from database.models import User
+from settings import get_settings
+
+USER_CACHE_MAX_ITEMS = 10000
+USER_SEARCH_CACHE_MAX_ITEMS = 500
+
+UserValues = Dict[str, Any]
+
+_users: Dict[int, Tuple[float, UserValues]] = {}
+_searches: Dict[Tuple[str, int, int], Tuple[float, List[UserValues], bool]] = {}
+
+
+def _to_values(user: User) -> UserValues:
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+
+def _to_user(values: UserValues) -> User:
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
+
+
+def get(user_id: int) -> Optional[User]:
+    item = _users.get(user_id)
+    if item is None:
+        return None
+    expires_at, values = item
+    if expires_at <= time.monotonic():
+        _users.pop(user_id, None)
+        return None
+    return _to_user(values)
+
+
+def put(user: User):
+    if len(_users) >= USER_CACHE_MAX_ITEMS:
+        now = time.monotonic()
+        for user_id in [key for key, (expires_at, _) in _users.items() if expires_at <= now]:
+            del _users[user_id]
+        if len(_users) >= USER_CACHE_MAX_ITEMS:
+            _users.clear()
+    _users[user.user_id] = (time.monotonic() + get_settings().user_cache_ttl, _to_values(user))
+
+
+def invalidate(user_id: Optional[int] = None):
+    """Сбрасывает запись пользователя (или весь кеш, если user_id не указан) и кеш поиска."""
+    if user_id is None:
+        _users.clear()
+    else:
+        _users.pop(user_id, None)
+    _searches.clear()
+
+
+def invalidate_on_commit(session, user_id: Optional[int] = None):
+    """
+    Сбрасывает запись сейчас и еще раз после коммита транзакции session
+    (для общей сессии обновления коммит может быть гораздо позже записи).
+    """
+    invalidate(user_id)
+    event.listen(session.sync_session, "after_commit", lambda _session: invalidate(user_id), once=True)
+
+
+def get_search(key: Tuple[str, int, int]) -> Optional[Tuple[List[User], bool]]:
+    item = _searches.get(key)
+    if item is None:
+        return None
+    expires_at, users, has_more = item
+    if expires_at <= time.monotonic():
+        _searches.pop(key, None)
+        return None
+    return [_to_user(values) for values in users], has_more
+
+
+def put_search(key: Tuple[str, int, int], users: List[User], has_more: bool):
+    if len(_searches) >= USER_SEARCH_CACHE_MAX_ITEMS:
+        _searches.clear()
+    _searches[key] = (time.monotonic() + get_settings().user_search_cache_ttl, [_to_values(user) for user in users], has_more)
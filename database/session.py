@@ -0,0 +1,253 @@
+"""
+Сессия БД на одно обновление Telegram (unit of work).
+
+Методы репозиториев открывают сессию через `async with self.sessionmaker()`.
+Если обновление обрабатывается внутри request_session(), вместо новой сессии
+(и нового checkout из пула) они получают общую сессию обновления, и все чтения
+и записи одного апдейта идут через одно соединение с одним коммитом в конце.
+Вне request_session() (фоновые задачи, воркеры анализа, скрипты) поведение
+прежнее: сессия на вызов.
+
+Сессия обновления создается при первом обращении к БД, а соединение держит только
+пока идет работа с базой: release_request_session() коммитит накопленное и
+возвращает соединение в пул (следующий запрос возьмет новое). Это делается перед
+каждым вызовом Telegram API (DbReleaseRequestMiddleware) и перед анализом файла,
+чтобы соединение не простаивало на сетевых ожиданиях.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+_request_session: ContextVar[Optional["RequestSession"]] = ContextVar("request_session", default=None)
+# Время открытия новых соединений внутри текущей выдачи из пула (см. TimedQueuePool)
+_connect_time: ContextVar[float] = ContextVar("pool_connect_time", default=0.0)
+
+
+class RequestSession:
+    """
+    Обертка над общей сессией обновления для кода репозиториев:
+    - begin() открывает SAVEPOINT, поэтому блок `async with session.begin()`
+      остается атомарным и откатывается сам по себе;
+    - commit() только сбрасывает изменения (flush), коммит делает request_session();
+    - rollback() откатывает текущий SAVEPOINT, а вне его - всю сессию обновления.
+    """
+
+    def __init__(self, sessionmaker: async_sessionmaker):
+        self._sessionmaker = sessionmaker
+        self._session: Optional[AsyncSession] = None
+        self._savepoints = []
+
+    @property
+    def session(self) -> AsyncSession:
+        # Сессия (и соединение) создается при первом обращении к БД
+        if self._session is None:
+            self._session = self._sessionmaker()
+        return self._session
+
+    @property
+    def is_started(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    @asynccontextmanager
+    async def begin(self):
+        savepoint = await self.session.begin_nested()
+        self._savepoints.append(savepoint)
+        try:
+            yield savepoint
+            if savepoint.is_active:
+                await savepoint.commit()
+        except BaseException:
+            if savepoint.is_active:
+                await savepoint.rollback()
+            raise
+        finally:
+            self._savepoints.pop()
+
+    async def commit(self):
+        await self.session.flush()
+
+    async def rollback(self):
+        if self._savepoints and self._savepoints[-1].is_active:
+            await self._savepoints[-1].rollback()
+        else:
+            await self.session.rollback()
+
+    async def release(self):
+        """Коммитит накопленное и возвращает соединение в пул (внутри begin() ничего не делает)."""
+        if self._session is None or self._savepoints:
+            return
+        if self._session.in_transaction():
+            await self._session.commit()
+
+    async def finish(self, error: bool = False):
+        if self._session is None:
+            return
+        try:
+            if error:
+                await self._session.rollback()
+            else:
+                await self._session.commit()
+        finally:
+            await self._session.close()
+
+
+class ScopedSessionmaker:
+    """Фабрика сессий для репозиториев: общая сессия обновления, если она есть."""
+
+    def __init__(self, sessionmaker: async_sessionmaker):
+        self.sessionmaker = sessionmaker
+
+    @asynccontextmanager
+    async def _shared(self, request_session: RequestSession):
+        yield request_session
+
+    def __call__(self):
+        request_session = _request_session.get()
+        if request_session is not None:
+            return self._shared(request_session)
+        return self.sessionmaker()
+
+
+@asynccontextmanager
+async def request_session(sessionmaker: async_sessionmaker):
+    """
+    Общая сессия на время обработки обновления: создается при первом обращении к БД,
+    коммитится в конце (и при release_request_session()).
+    """
+    session = RequestSession(sessionmaker)
+    token = _request_session.set(session)
+    try:
+        yield session
+    except BaseException:
+        _request_session.reset(token)
+        await session.finish(error=True)
+        raise
+    _request_session.reset(token)
+    await session.finish()
+
+
+async def release_request_session():
+    """Отпускает соединение сессии текущего обновления перед долгим ожиданием."""
+    session = _request_session.get()
+    if session is not None:
+        await session.release()
+
+
+# --- Метрики пула ---
+# checkouts/updates - сколько раз соединение берется из пула на одно обновление
+# (считаются только выдачи внутри request_session, фоновые задачи не учитываются);
+# waits/wait_time/max_wait - ожидание свободного соединения при выдаче из пула;
+# connects/connect_time/max_connect - открытие новых соединений (в ожидание не входит).
+pool_stats = {
+    "checkouts": 0, "updates": 0,
+    "waits": 0, "wait_time": 0.0, "max_wait": 0.0,
+    "connects": 0, "connect_time": 0.0, "max_connect": 0.0,
+}
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который отдельно замеряет ожидание свободного соединения и открытие новых."""
+
+    def _do_get(self):
+        token = _connect_time.set(0.0)
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = max(0.0, time.perf_counter() - started - _connect_time.get())
+            _connect_time.reset(token)
+            pool_stats["waits"] += 1
+            pool_stats["wait_time"] += waited
+            pool_stats["max_wait"] = max(pool_stats["max_wait"], waited)
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            elapsed = time.perf_counter() - started
+            _connect_time.set(_connect_time.get() + elapsed)
+            pool_stats["connects"] += 1
+            pool_stats["connect_time"] += elapsed
+            pool_stats["max_connect"] = max(pool_stats["max_connect"], elapsed)
+
+
+def install_pool_metrics(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        # SQLAlchemy переносит contextvars в greenlet драйвера, поэтому сессия обновления видна здесь
+        if _request_session.get() is not None:
+            pool_stats["checkouts"] += 1
+
+
+def checkouts_per_update() -> float:
+    return pool_stats["checkouts"] / pool_stats["updates"] if pool_stats["updates"] else 0.0
+
+
+def pool_status(engine: AsyncEngine) -> dict:
+    """Текущая загрузка пула, накопленное время ожидания соединения и открытия новых."""
+    pool = engine.sync_engine.pool
+    waits = pool_stats["waits"]
+    connects = pool_stats["connects"]
+    status = {
+        "avg_wait_ms": pool_stats["wait_time"] / waits * 1000 if waits else 0.0,
+        "max_wait_ms": pool_stats["max_wait"] * 1000,
+        "connects": connects,
+        "avg_connect_ms": pool_stats["connect_time"] / connects * 1000 if connects else 0.0,
+        "max_connect_ms": pool_stats["max_connect"] * 1000,
+        "checkouts_per_update": checkouts_per_update(),
+    }
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        status.update(
+            size=pool.size(),
+            in_use=pool.checkedout(),
+            idle=pool.checkedin(),
+            # overflow() отрицателен, пока пул не открыл все pool_size соединений
+            overflow=max(0, pool.overflow()),
+        )
+    return status
+
+
+async def warm_up_pool(engine: AsyncEngine, connections: int):
+    """Открывает соединения заранее, чтобы первые обновления не ждали подключения к БД."""
+    if connections <= 0:
+        return
+
+    settled = asyncio.Semaphore(0)
+    release = asyncio.Event()
+
+    async def _open():
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+                settled.release()
+                # Держим соединение, пока не откроются остальные, иначе пул выдаст то же самое
+                await release.wait()
+        except Exception:
+            settled.release()
+            raise
+
+    tasks = [asyncio.create_task(_open()) for _ in range(connections)]
+    try:
+        for _ in range(connections):
+            await settled.acquire()
+    finally:
+        release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        logger.warning(f"Прогрев пула БД: не удалось открыть {len(errors)} из {connections} соединений: {errors[0]}")
+    else:
+        logger.info(f"Прогрев пула БД: открыто {connections} соединений")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Скрипт для создания таблицы file_attempts (круги анализа файла по хешу)
+и переноса в нее счетчиков repeat_attempts из analysis_history
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate_database():
+    """Создает таблицу file_attempts с ключом (user_id, file_hash) и переносит старые счетчики"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        async with engine.begin() as conn:  # type: ignore
+            await conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS file_attempts (
+                    user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+                    file_hash VARCHAR(64) NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_attempt_at TIMESTAMP WITHOUT TIME ZONE,
+                    blocked_until TIMESTAMP WITHOUT TIME ZONE,
+                    PRIMARY KEY (user_id, file_hash)
+                )
+            """))
+            logger.info("Таблица file_attempts создана")
+
+            # Раньше счетчик хранился в последней записи истории файла: переносим его,
+            # чтобы действующие блокировки не снялись после обновления
+            result = await conn.execute(text("""
+                INSERT INTO file_attempts (user_id, file_hash, attempts, last_attempt_at, blocked_until)
+                SELECT DISTINCT ON (user_id, file_hash)
+                    user_id, file_hash, repeat_attempts,
+                    COALESCE(last_repeat_attempt, created_at), blocked_until
+                FROM analysis_history
+                WHERE file_hash IS NOT NULL
+                  AND repeat_attempts > 0
+                  AND NOT is_solution_found
+                ORDER BY user_id, file_hash, created_at DESC
+                ON CONFLICT (user_id, file_hash) DO NOTHING
+            """))
+            logger.info(f"Перенесено счетчиков из analysis_history.repeat_attempts: {result.rowcount}")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    asyncio.run(migrate_database())
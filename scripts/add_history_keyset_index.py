@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Скрипт для добавления составного индекса (user_id, created_at, id) в таблицу
+analysis_history для пагинации истории по курсору. Индекс по одному user_id
+после этого не нужен и удаляется.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate_database():
+    """Создает индекс ix_analysis_history_user_created_id без блокировки записи"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        async with engine.connect() as conn:  # type: ignore
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analysis_history_user_created_id
+                ON analysis_history (user_id, created_at, id)
+            """))
+            logger.info("Индекс ix_analysis_history_user_created_id создан")
+
+            await conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_analysis_history_user_id"))
+            logger.info("Индекс ix_analysis_history_user_id удален")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    asyncio.run(migrate_database())
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Скрипт для добавления поля prompt_version в таблицу analysis_history
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate_database():
+    """Добавляет поле prompt_version в таблицу analysis_history"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        async with engine.begin() as conn:  # type: ignore
+            await conn.execute(text("""
+                ALTER TABLE analysis_history
+                ADD COLUMN IF NOT EXISTS prompt_version VARCHAR(32)
+            """))
+            logger.info("Поле prompt_version добавлено в таблицу analysis_history")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    asyncio.run(migrate_database())
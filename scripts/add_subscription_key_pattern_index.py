@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Скрипт для добавления индекса (user_id, crash_reporter_key varchar_pattern_ops)
+в таблицу subscriptions для поиска подписки по префиксу ключа
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate_database():
+    """Создает индекс ix_subscriptions_user_crash_key_pattern"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        async with engine.connect() as conn:  # type: ignore
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_subscriptions_user_crash_key_pattern
+                ON subscriptions (user_id, crash_reporter_key varchar_pattern_ops)
+            """))
+            logger.info("Индекс ix_subscriptions_user_crash_key_pattern создан")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    asyncio.run(migrate_database())
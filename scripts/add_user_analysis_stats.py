@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Скрипт для создания таблицы user_analysis_stats и заполнения ее счетчиками
+из существующей истории анализов
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate_database():
+    """Создает user_analysis_stats и пересчитывает счетчики по analysis_history"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        async with engine.begin() as conn:  # type: ignore
+            await conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS user_analysis_stats (
+                    user_id BIGINT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+                    file_type VARCHAR(20) NOT NULL,
+                    total_analyses INTEGER NOT NULL DEFAULT 0,
+                    successful_analyses INTEGER NOT NULL DEFAULT 0,
+                    tokens_used INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, file_type)
+                )
+            """))
+            logger.info("Таблица user_analysis_stats создана")
+
+            result = await conn.execute(text("""
+                INSERT INTO user_analysis_stats (user_id, file_type, total_analyses, successful_analyses, tokens_used)
+                SELECT user_id, file_type, COUNT(*),
+                       COUNT(*) FILTER (WHERE is_solution_found),
+                       COALESCE(SUM(tokens_used), 0)
+                FROM analysis_history
+                GROUP BY user_id, file_type
+                ON CONFLICT (user_id, file_type) DO UPDATE SET
+                    total_analyses = EXCLUDED.total_analyses,
+                    successful_analyses = EXCLUDED.successful_analyses,
+                    tokens_used = EXCLUDED.tokens_used
+            """))
+            logger.info(f"Счетчики пересчитаны: {result.rowcount} строк")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    asyncio.run(migrate_database())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Скрипт для добавления расширения pg_trgm и GIN-индексов по username/fullname
+в таблицу users (поиск пользователей админом)
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def migrate_database():
+    """Создает pg_trgm и индексы ix_users_username_trgm, ix_users_fullname_trgm"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        async with engine.connect() as conn:  # type: ignore
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            for column in ("username", "fullname"):
+                await conn.execute(text(f"""
+                    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_{column}_trgm
+                    ON users USING gin ({column} gin_trgm_ops)
+                """))
+                logger.info(f"Индекс ix_users_{column}_trgm создан")
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    asyncio.run(migrate_database())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Архив истории анализов.
+
+    python scripts/archive_analysis_history.py archive --days 180 [--keep-rows]
+    python scripts/archive_analysis_history.py query data/archive/<файл>.jsonl.gz [--user-id N] [--error-code CODE]
+
+archive выгружает записи старше --days дней в data/archive/ и удаляет их из базы
+после сверки; query выводит записи архива (JSON по строке) без подключения к базе.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def archive(days: int, keep_rows: bool):
+    """Выгружает старые записи в архив"""
+    from database.database import ORM
+    from services.history_archive import archive_old_analyses
+
+    orm = ORM()
+    try:
+        result = await archive_old_analyses(
+            orm, datetime.utcnow() - timedelta(days=days), delete=not keep_rows
+        )
+        logger.info(f"Архив: {result.path}, выгружено {result.archived}, удалено {result.deleted}")
+    finally:
+        await orm.engine.dispose()
+
+
+def query(path: str, user_id, error_code):
+    """Выводит записи архива с фильтрами"""
+    from services.history_archive import iter_archive
+
+    for record in iter_archive(path):
+        if user_id is not None and record.get("user_id") != user_id:
+            continue
+        if error_code and record.get("error_code") != error_code:
+            continue
+        print(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = commands.add_parser("archive", help="Move old history rows to data/archive")
+    archive_parser.add_argument("--days", type=int, required=True, help="Archive rows older than this many days")
+    archive_parser.add_argument("--keep-rows", action="store_true", help="Write the archive but keep the rows")
+
+    query_parser = commands.add_parser("query", help="Print records from an archive file")
+    query_parser.add_argument("path", help="Archive file (.jsonl.gz)")
+    query_parser.add_argument("--user-id", type=int, help="Only records of this user")
+    query_parser.add_argument("--error-code", help="Only records with this error code")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        asyncio.run(archive(args.days, args.keep_rows))
+    else:
+        query(args.path, args.user_id, args.error_code)
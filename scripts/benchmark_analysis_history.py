@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк истории анализов: обычная таблица против помесячных партиций.
+
+В отдельной схеме history_bench создаются две таблицы с одинаковыми данными
+(по умолчанию 10 млн строк за 24 месяца), после чего замеряются:
+- первая и следующая страница истории пользователя (пагинация по курсору);
+- подсчет строк старше срока хранения;
+- очистка: построчный DELETE против DETACH + DROP партиций.
+
+Схема удаляется в конце (кроме запуска с --keep). Запускать на тестовой базе:
+генерация 10 млн строк занимает несколько минут и несколько ГБ места.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from database.partitions import add_months, month_start
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SCHEMA = "history_bench"
+COLUMNS = """
+    id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    file_type VARCHAR(20) NOT NULL,
+    device_model VARCHAR(100),
+    solution_text TEXT,
+    is_solution_found BOOLEAN NOT NULL,
+    tokens_used INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL
+"""
+
+
+async def timed(conn, label: str, sql: str, params: dict = None):
+    started = time.perf_counter()
+    await conn.execute(text(sql), params or {})
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info(f"{label}: {elapsed:.1f} мс")
+    return elapsed
+
+
+async def prepare(engine, rows: int, months: int, users: int):
+    first_month = add_months(month_start(datetime.utcnow()), -months + 1)
+    async with engine.begin() as conn:  # type: ignore
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.execute(text(f"CREATE TABLE {SCHEMA}.plain ({COLUMNS}, PRIMARY KEY (id))"))
+        await conn.execute(text(
+            f"CREATE TABLE {SCHEMA}.parted ({COLUMNS}, PRIMARY KEY (id, created_at)) PARTITION BY RANGE (created_at)"
+        ))
+        for offset in range(months + 1):
+            month = add_months(first_month, offset)
+            await conn.execute(text(
+                f"CREATE TABLE {SCHEMA}.parted_y{month:%Y}m{month:%m} PARTITION OF {SCHEMA}.parted "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+            ))
+
+        logger.info(f"Генерация {rows} строк...")
+        # Каждому десятому пользователю достается половина анализов: есть "тяжелые" пользователи
+        await conn.execute(text(f"""
+            INSERT INTO {SCHEMA}.plain
+            SELECT g,
+                   CASE WHEN g % 2 = 0 THEN (g % (:users / 10 + 1)) * 10 ELSE g % :users END,
+                   (ARRAY['ips', 'txt', 'photo', 'json'])[g % 4 + 1],
+                   'iPhone ' || (g % 12 + 8),
+                   repeat('x', 200),
+                   g % 3 <> 0,
+                   g % 2,
+                   CAST(:first_month AS timestamp) + (g::float / :rows) * (now()::timestamp - CAST(:first_month AS timestamp))
+            FROM generate_series(1, :rows) AS g
+        """), {"rows": rows, "users": users, "first_month": first_month})
+        await conn.execute(text(f"INSERT INTO {SCHEMA}.parted SELECT * FROM {SCHEMA}.plain"))
+
+        for table in ("plain", "parted"):
+            await conn.execute(text(f"CREATE INDEX ON {SCHEMA}.{table} (user_id, created_at, id)"))
+            await conn.execute(text(f"CREATE INDEX ON {SCHEMA}.{table} (created_at)"))
+    async with engine.connect() as conn:  # type: ignore
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.plain"))
+        await conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.parted"))
+
+
+async def run_queries(engine, retention_months: int):
+    cutoff = add_months(month_start(datetime.utcnow()), -retention_months)
+    results = {}
+    async with engine.connect() as conn:  # type: ignore
+        heavy_user = await conn.scalar(text(
+            f"SELECT user_id FROM {SCHEMA}.plain GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ))
+        for table in ("plain", "parted"):
+            page = (
+                f"SELECT * FROM {SCHEMA}.{table} WHERE user_id = :user_id "
+                f"ORDER BY created_at DESC, id DESC LIMIT 6"
+            )
+            results[(table, "первая страница")] = await timed(conn, f"{table}: первая страница", page, {"user_id": heavy_user})
+            cursor = (await conn.execute(text(page), {"user_id": heavy_user})).all()[-1]
+            results[(table, "следующая страница")] = await timed(
+                conn, f"{table}: следующая страница",
+                f"SELECT * FROM {SCHEMA}.{table} WHERE user_id = :user_id "
+                f"AND (created_at, id) < (:created_at, :id) ORDER BY created_at DESC, id DESC LIMIT 6",
+                {"user_id": heavy_user, "created_at": cursor.created_at, "id": cursor.id}
+            )
+            results[(table, "подсчет старых")] = await timed(
+                conn, f"{table}: подсчет старых",
+                f"SELECT COUNT(*) FROM {SCHEMA}.{table} WHERE created_at < :cutoff", {"cutoff": cutoff}
+            )
+
+    async with engine.begin() as conn:  # type: ignore
+        results[("plain", "очистка")] = await timed(
+            conn, "plain: очистка DELETE",
+            f"DELETE FROM {SCHEMA}.plain WHERE created_at < :cutoff", {"cutoff": cutoff}
+        )
+    async with engine.begin() as conn:  # type: ignore
+        started = time.perf_counter()
+        partitions = (await conn.execute(text(
+            "SELECT child.relname FROM pg_inherits i "
+            "JOIN pg_class parent ON parent.oid = i.inhparent "
+            "JOIN pg_class child ON child.oid = i.inhrelid "
+            "JOIN pg_namespace ns ON ns.oid = parent.relnamespace "
+            "WHERE ns.nspname = :schema AND parent.relname = 'parted'"
+        ), {"schema": SCHEMA})).scalars().all()
+        for name in partitions:
+            month = datetime.strptime(name[-8:], "y%Ym%m")
+            if add_months(month, 1) <= cutoff:
+                await conn.execute(text(f"ALTER TABLE {SCHEMA}.parted DETACH PARTITION {SCHEMA}.{name}"))
+                await conn.execute(text(f"DROP TABLE {SCHEMA}.{name}"))
+        results[("parted", "очистка")] = (time.perf_counter() - started) * 1000
+        logger.info(f"parted: очистка DETACH + DROP: {results[('parted', 'очистка')]:.1f} мс")
+    return results
+
+
+async def main(rows: int, months: int, users: int, retention_months: int, keep: bool):
+    orm = ORM()
+    engine = await orm.get_async_engine()
+    try:
+        await prepare(engine, rows, months, users)
+        results = await run_queries(engine, retention_months)
+        print(f"\n{'операция':<22}{'обычная, мс':>14}{'партиции, мс':>16}")
+        for operation in ("первая страница", "следующая страница", "подсчет старых", "очистка"):
+            print(f"{operation:<22}{results[('plain', operation)]:>14.1f}{results[('parted', operation)]:>16.1f}")
+    finally:
+        if not keep:
+            async with engine.begin() as conn:  # type: ignore
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Number of generated history rows")
+    parser.add_argument("--months", type=int, default=24, help="Months of history to spread rows over")
+    parser.add_argument("--users", type=int, default=100_000, help="Number of distinct users")
+    parser.add_argument("--retention-months", type=int, default=12, help="Months kept by the cleanup")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark schema")
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.months, args.users, args.retention_months, args.keep))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Онлайн-перевод analysis_history на помесячные партиции по created_at.
+
+Бот может работать во время миграции:
+1. создается секционированная таблица analysis_history_new с теми же колонками
+   и индексами, партициями на все месяцы с данными и партицией по умолчанию;
+2. триггер на старой таблице зеркалирует в новую все INSERT/UPDATE/DELETE;
+3. существующие строки копируются пачками по id (отдельная транзакция на пачку);
+4. из новой таблицы убираются строки, удаленные из старой во время копирования;
+5. число строк сверяется без блокировки по снимку до контрольного id, а в
+   короткой транзакции под блокировкой - только строки новее него, и таблицы
+   меняются местами. Старая таблица остается как analysis_history_old, ее можно
+   удалить вручную после проверки.
+"""
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Добавляем корневую директорию в путь
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.database import ORM
+from database.models import AnalysisHistory
+from database.partitions import (
+    DEFAULT_PARTITION, add_months, is_history_partitioned, month_start, partition_ddl
+)
+from settings import get_settings
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NEW_TABLE = "analysis_history_new"
+OLD_TABLE = "analysis_history_old"
+
+
+async def create_partitioned_table(engine):
+    """Шаги 1-2: новая таблица, партиции, индексы и триггер синхронизации"""
+    async with engine.begin() as conn:  # type: ignore
+        # Имена индексов и первичного ключа глобальны в схеме: старые получают суффикс _old
+        for index in AnalysisHistory.__table__.indexes:
+            await conn.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {index.name}_old"))
+        await conn.execute(text("ALTER INDEX IF EXISTS ix_analysis_history_user_id RENAME TO ix_analysis_history_user_id_old"))
+        await conn.execute(text("ALTER TABLE analysis_history RENAME CONSTRAINT analysis_history_pkey TO analysis_history_old_pkey"))
+
+        await conn.execute(text(f"""
+            CREATE TABLE {NEW_TABLE} (
+                LIKE analysis_history INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                CONSTRAINT analysis_history_pkey PRIMARY KEY (id, created_at),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            ) PARTITION BY RANGE (created_at)
+        """))
+
+        first_created_at = await conn.scalar(text("SELECT MIN(created_at) FROM analysis_history"))
+        month = month_start(first_created_at or datetime.utcnow())
+        last_month = add_months(month_start(datetime.utcnow()), get_settings().history_partition_months_ahead)
+        while month <= last_month:
+            await conn.execute(text(partition_ddl(month, parent=NEW_TABLE)))
+            month = add_months(month, 1)
+        await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {NEW_TABLE} DEFAULT"))
+
+        # Индексы на пустой таблице создаются мгновенно и наследуются партициями
+        for index in AnalysisHistory.__table__.indexes:
+            columns = ", ".join(column.name for column in index.columns)
+            await conn.execute(text(f"CREATE INDEX {index.name} ON {NEW_TABLE} ({columns})"))
+
+        # Триггер вставляет с ON CONFLICT DO UPDATE: если строку уже вставила открытая
+        # пачка copy_rows, он дождется ее коммита и перезапишет скопированную версию, а не упадет
+        columns = [column.name for column in AnalysisHistory.__table__.columns]
+        column_list = ", ".join(columns)
+        new_values = ", ".join(f"NEW.{name}" for name in columns)
+        assignments = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns)
+        await conn.execute(text(f"""
+            CREATE OR REPLACE FUNCTION analysis_history_sync() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM {NEW_TABLE} WHERE id = OLD.id AND created_at = OLD.created_at;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    INSERT INTO {NEW_TABLE} ({column_list}) VALUES ({new_values})
+                    ON CONFLICT (id, created_at) DO UPDATE SET {assignments};
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """))
+        await conn.execute(text("""
+            CREATE TRIGGER analysis_history_sync
+            AFTER INSERT OR UPDATE OR DELETE ON analysis_history
+            FOR EACH ROW EXECUTE FUNCTION analysis_history_sync()
+        """))
+    logger.info(f"Таблица {NEW_TABLE} создана, синхронизация включена")
+
+
+async def copy_rows(engine, batch_size: int):
+    """Шаг 3: копирование существующих строк пачками по id"""
+    async with engine.connect() as conn:  # type: ignore
+        max_id = await conn.scalar(text("SELECT MAX(id) FROM analysis_history")) or 0
+
+    last_id = 0
+    copied = 0
+    while last_id < max_id:
+        async with engine.begin() as conn:  # type: ignore
+            result = await conn.execute(text(f"""
+                INSERT INTO {NEW_TABLE}
+                SELECT * FROM analysis_history
+                WHERE id > :last_id AND id <= :upper_id
+                ON CONFLICT (id, created_at) DO NOTHING
+            """), {"last_id": last_id, "upper_id": last_id + batch_size})
+        copied += result.rowcount or 0
+        last_id += batch_size
+        logger.info(f"Скопировано {copied} строк (id до {min(last_id, max_id)} из {max_id})")
+
+
+async def remove_stale_rows(engine):
+    """Шаг 4: строки, удаленные из старой таблицы, пока шло копирование"""
+    async with engine.begin() as conn:  # type: ignore
+        result = await conn.execute(text(f"""
+            DELETE FROM {NEW_TABLE} n
+            WHERE NOT EXISTS (SELECT 1 FROM analysis_history o WHERE o.id = n.id AND o.created_at = n.created_at)
+        """))
+    logger.info(f"Удалено устаревших строк: {result.rowcount or 0}")
+
+
+async def count_rows_before_swap(engine) -> tuple[int, int]:
+    """
+    Шаг 5а: сверка без блокировки. Обе таблицы считаются в одном снимке (REPEATABLE READ)
+    до контрольного id; дальнейшие изменения этих строк триггер повторяет в новой таблице.
+    Возвращает (контрольный id, число строк до него).
+    """
+    async with engine.execution_options(isolation_level="REPEATABLE READ").begin() as conn:  # type: ignore
+        checkpoint = await conn.scalar(text("SELECT MAX(id) FROM analysis_history")) or 0
+        old_count = await conn.scalar(
+            text("SELECT COUNT(*) FROM analysis_history WHERE id <= :checkpoint"), {"checkpoint": checkpoint}
+        )
+        new_count = await conn.scalar(
+            text(f"SELECT COUNT(*) FROM {NEW_TABLE} WHERE id <= :checkpoint"), {"checkpoint": checkpoint}
+        )
+    if old_count != new_count:
+        raise RuntimeError(f"Число строк не совпадает: {old_count} в старой таблице, {new_count} в новой")
+    logger.info(f"Сверено {old_count} строк до id {checkpoint}")
+    return checkpoint, old_count
+
+
+async def swap_tables(engine, checkpoint: int, checked_count: int):
+    """Шаг 5б: сверка строк новее контрольного id и замена таблиц под блокировкой"""
+    async with engine.begin() as conn:  # type: ignore
+        await conn.execute(text("LOCK TABLE analysis_history IN ACCESS EXCLUSIVE MODE"))
+        old_count = await conn.scalar(
+            text("SELECT COUNT(*) FROM analysis_history WHERE id > :checkpoint"), {"checkpoint": checkpoint}
+        )
+        new_count = await conn.scalar(
+            text(f"SELECT COUNT(*) FROM {NEW_TABLE} WHERE id > :checkpoint"), {"checkpoint": checkpoint}
+        )
+        if old_count != new_count:
+            raise RuntimeError(
+                f"Число строк после id {checkpoint} не совпадает: {old_count} в старой таблице, {new_count} в новой"
+            )
+
+        await conn.execute(text("DROP TRIGGER analysis_history_sync ON analysis_history"))
+        await conn.execute(text("DROP FUNCTION analysis_history_sync()"))
+        await conn.execute(text(f"ALTER TABLE analysis_history RENAME TO {OLD_TABLE}"))
+        await conn.execute(text(f"ALTER TABLE {NEW_TABLE} RENAME TO analysis_history"))
+        # Последовательность id должна пережить удаление старой таблицы
+        await conn.execute(text("ALTER SEQUENCE analysis_history_id_seq OWNED BY analysis_history.id"))
+    logger.info(f"Таблицы заменены (~{checked_count + old_count} строк), старая таблица: {OLD_TABLE}")
+
+
+async def migrate_database(batch_size: int):
+    """Переводит analysis_history на помесячные партиции"""
+
+    orm = ORM()
+    engine = await orm.get_async_engine()
+
+    try:
+        async with engine.connect() as conn:  # type: ignore
+            if await is_history_partitioned(conn):
+                logger.info("analysis_history уже секционирована")
+                return
+            new_table_exists = await conn.scalar(text(f"SELECT to_regclass('{NEW_TABLE}') IS NOT NULL"))
+
+        if new_table_exists:
+            logger.info(f"{NEW_TABLE} уже существует, продолжаем копирование")
+        else:
+            await create_partitioned_table(engine)
+        await copy_rows(engine, batch_size)
+        await remove_stale_rows(engine)
+        checkpoint, checked_count = await count_rows_before_swap(engine)
+        await swap_tables(engine, checkpoint, checked_count)
+
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении миграции: {e}")
+        raise
+    finally:
+        if engine:
+            await engine.dispose()  # type: ignore
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=10000, help="Rows copied per transaction")
+    args = parser.parse_args()
+    asyncio.run(migrate_database(args.batch_size))
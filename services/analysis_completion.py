@@ -0,0 +1,169 @@
+"""
+Завершение анализа одной транзакцией.
+
+После анализа нужно проверить средства, списать анализ по подписке или токен
+(и открыть 30-дневную подписку на отчет), записать анализ в историю и обновить
+счетчики повторных кругов по хешу файла. Раньше это были отдельные сессии и
+коммиты на каждый шаг (до ~8 обращений к БД), и сбой посередине оставлял,
+например, списанный токен без записи в истории. Здесь все делается на одном
+соединении в одной транзакции.
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from aiogram.utils.i18n import I18n
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from config import SUBSCRIPTION_ANALYSIS_LIMIT
+from database.database import ORM
+from database.models import User, Subscription
+from database.repo import user_cache
+from database.repo.analysis_history import AnalysisHistoryRepo
+from database.repo.user import select_subscription_by_key_prefix
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_DURATION_DAYS = 30
+# Обрезанный ключ со скриншота сопоставляется с подпиской по префиксу не короче этого
+MIN_CRASH_KEY_PREFIX = 16
+
+
+@dataclass
+class AnalysisCompletion:
+    has_funds: bool
+    token_message_parts: List[str] = field(default_factory=list)
+    tokens_used: int = 0
+    analysis_id: Optional[int] = None
+
+
+async def complete_analysis(
+        orm: ORM,
+        user_id: int,
+        lang: str,
+        i18n: I18n,
+        crash_reporter_key: Optional[str],
+        product: Optional[str],
+        solution_found: bool,
+        history_fields: Dict[str, Any],
+        file_hash: Optional[str] = None,
+        crash_key_may_be_truncated: bool = False,
+) -> AnalysisCompletion:
+    """
+    Проверяет средства и, если они есть, списывает анализ (только при найденном
+    решении), сохраняет историю и счетчики попыток. Строки пользователя и
+    подписки блокируются до конца транзакции, поэтому параллельные анализы
+    одного пользователя не спишут один и тот же токен дважды.
+    crash_key_may_be_truncated - ключ распознан со скриншота: если точной подписки
+    нет, она ищется по префиксу ключа.
+    """
+    now = datetime.now()
+    async with orm.scoped_sessionmaker() as session:
+        user_cache.invalidate_on_commit(session, user_id)
+        async with session.begin():
+            token_balance = await session.scalar(
+                select(User.token_balance).where(User.user_id == user_id).with_for_update()
+            ) or 0
+
+            subscription = None
+            if crash_reporter_key:
+                subscription = await session.scalar(
+                    select(Subscription).where(
+                        Subscription.user_id == user_id,
+                        Subscription.crash_reporter_key == crash_reporter_key,
+                        Subscription.date_end > now,
+                        Subscription.analysis_count > 0
+                    ).with_for_update()
+                )
+                if (subscription is None and crash_key_may_be_truncated
+                        and len(crash_reporter_key) >= MIN_CRASH_KEY_PREFIX):
+                    subscription = await session.scalar(
+                        select_subscription_by_key_prefix(user_id, crash_reporter_key, now).with_for_update()
+                    )
+                    if subscription is not None:
+                        logger.info(
+                            f"Subscription matched by key prefix for user {user_id}: "
+                            f"{crash_reporter_key} -> {subscription.crash_reporter_key}"
+                        )
+
+            if token_balance <= 0 and subscription is None:
+                return AnalysisCompletion(has_funds=False)
+
+            token_message_parts = []
+            tokens_used = 0
+            if solution_found:
+                if subscription is not None:
+                    subscription.analysis_count -= 1
+                    token_message_parts.append(
+                        i18n.gettext(
+                            "Анализ по подписке (осталось {count} бесплатных для этого устройства).",
+                            locale=lang
+                        ).format(count=subscription.analysis_count)
+                    )
+                else:
+                    new_balance = token_balance - 1
+                    await session.execute(
+                        update(User).where(User.user_id == user_id).values(token_balance=new_balance)
+                    )
+                    tokens_used = 1
+
+                    if crash_reporter_key and product:
+                        analyses_for_new_sub = SUBSCRIPTION_ANALYSIS_LIMIT - 1
+                        await session.execute(
+                            insert(Subscription)
+                            .values(
+                                user_id=user_id,
+                                crash_reporter_key=crash_reporter_key,
+                                product=product,
+                                analysis_count=analyses_for_new_sub,
+                                date_start=now,
+                                date_end=now + timedelta(days=SUBSCRIPTION_DURATION_DAYS),
+                                is_warn=False
+                            )
+                            .on_conflict_do_update(
+                                index_elements=[Subscription.user_id, Subscription.crash_reporter_key],
+                                set_=dict(
+                                    product=product,
+                                    analysis_count=analyses_for_new_sub,
+                                    date_start=now,
+                                    date_end=now + timedelta(days=SUBSCRIPTION_DURATION_DAYS),
+                                    is_warn=False
+                                )
+                            )
+                        )
+                        token_message_parts.append(
+                            i18n.gettext(
+                                "Списан 1 токен (остаток: {balance}).\nНачался 30-дневный период: "
+                                "следующие {count} анализов для этого отчета будут бесплатными.",
+                                locale=lang
+                            ).format(balance=new_balance, count=analyses_for_new_sub)
+                        )
+                    else:
+                        token_message_parts.append(
+                            i18n.gettext("Списан 1 токен (остаток: {balance}).", locale=lang)
+                            .format(balance=new_balance)
+                        )
+
+            history_repo = AnalysisHistoryRepo(session, autocommit=False)
+            analysis = await history_repo.create_analysis_record(
+                user_id=user_id,
+                file_hash=file_hash,
+                is_solution_found=solution_found,
+                tokens_used=tokens_used,
+                **history_fields
+            )
+
+            # Круг анализа занят до анализа (reserve_attempt_by_hash) и при неудаче остается засчитанным
+            if file_hash and solution_found:
+                # При успешном анализе сбрасываем счетчик
+                await history_repo.reset_attempts_by_hash(user_id, file_hash)
+
+    logger.info(f"Analysis completed for user {user_id}: tokens_used={tokens_used}, analysis_id={analysis.id}")
+    return AnalysisCompletion(
+        has_funds=True,
+        token_message_parts=token_message_parts,
+        tokens_used=tokens_used,
+        analysis_id=analysis.id
+    )
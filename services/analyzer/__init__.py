@@ -5,7 +5,7 @@ from .txt_analyzer import TxtAnalyzer
 from .photo_analyzer import PhotoAnalyzer
 
 # Вспомогательные функции
-from .utils import load_error_codes_from_excel, reload_known_error_codes, KNOWN_ERROR_CODES
+from .utils import load_error_codes_from_excel, reload_known_error_codes, get_known_error_codes
 
 # Для обратной совместимости - экспортируем все классы как было раньше
 __all__ = [
@@ -15,5 +15,5 @@ __all__ = [
     'PhotoAnalyzer',
     'load_error_codes_from_excel',
     'reload_known_error_codes',
-    'KNOWN_ERROR_CODES'
+    'get_known_error_codes'
 ] 
\ No newline at end of file
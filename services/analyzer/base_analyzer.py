@@ -16,7 +16,8 @@ from datetime import datetime
 from config import PANIC_CODES_EXCEL_PATH
 from services.telegram.schemas.analyzer import ModelPhone, SolutionAboutError
 from services.telegram.ai.ai import get_ai_error_code_suggestion
-from .utils import filter_cell, KNOWN_ERROR_CODES
+from services.telegram.ai.prompt_cache import prompt_version_tag
+from .utils import filter_cell, get_known_error_codes_snapshot, KnownErrorCodes
 
 
 class BaseAnalyzer:
@@ -28,6 +29,7 @@ class BaseAnalyzer:
         self.log_dict: Dict = {}
         self.sheet = None
         self._images = {}
+        self.prompt_version: Optional[str] = None
 
         # Определяем путь к Excel файлу относительно корня проекта
         if os.path.exists("./data/panic_codes.xlsx"):
@@ -147,23 +149,12 @@ class BaseAnalyzer:
             ios_version=os_version_from_log or "Неизвестно"
         )
 
-    def _get_all_known_error_codes_from_excel(self, debug: bool = False) -> List[str]:
+    def _get_all_known_error_codes_from_excel(self, debug: bool = False) -> KnownErrorCodes:
         """
-        Возвращает список всех известных кодов ошибок.
-        Использует обновленный KNOWN_ERROR_CODES из utils.py который обрабатывает экранированные символы.
+        Возвращает текущую загрузку известных кодов ошибок (utils.get_known_error_codes_snapshot()).
+        Для текстовых логов используется text_codes - список без mini кодов, отфильтрованный при загрузке.
         """
-        if debug:
-            pass
-            # print(f"DEBUG: Using KNOWN_ERROR_CODES from utils.py. Total codes: {len(KNOWN_ERROR_CODES)}")
-        
-        # Фильтруем mini коды как в оригинальной логике
-        filtered_codes = [code for code in KNOWN_ERROR_CODES if " mini" not in code.lower()]
-        
-        if debug:
-            pass
-            # print(f"DEBUG: After filtering mini codes: {len(filtered_codes)} codes")
-        
-        return filtered_codes
+        return get_known_error_codes_snapshot()
 
     async def _get_error_code_via_ai(self, extracted_error_text: str, debug: bool = False) -> Optional[str]:
         if not extracted_error_text:
@@ -172,7 +163,8 @@ class BaseAnalyzer:
                 # print("DEBUG (AI): No extracted error text to send to AI.")
             return None
 
-        all_known_codes = self._get_all_known_error_codes_from_excel(debug=debug)
+        known_codes = self._get_all_known_error_codes_from_excel(debug=debug)
+        all_known_codes = known_codes.text_codes
         if not all_known_codes:
             if debug:
                 pass
@@ -186,6 +178,7 @@ class BaseAnalyzer:
         
         # Создаем клиент OpenAI здесь, т.к. этот метод вызывается для текстовых файлов
         client = openai.AsyncOpenAI(api_key=api_key)
+        self.prompt_version = prompt_version_tag(known_codes.text_version)
 
         if debug:
             pass
@@ -194,7 +187,8 @@ class BaseAnalyzer:
         ai_suggested_code = await get_ai_error_code_suggestion(
             client=client, # Передаем созданный клиент
             error_text=extracted_error_text,
-            known_error_codes=all_known_codes
+            known_error_codes=all_known_codes,
+            kb_version=known_codes.text_version
         )
 
         if debug:
@@ -491,7 +485,8 @@ class BaseAnalyzer:
                 panic_string=panic_str,
                 extracted_error_text_for_admin=extracted_admin_text,
                 is_mini_response_shown=False,
-                has_full_solution_available=False
+                has_full_solution_available=False,
+                prompt_version=self.prompt_version
             )
 
         # Определяем базовый код ошибки. Обычно он есть в первом элементе.
@@ -568,5 +563,6 @@ class BaseAnalyzer:
             is_mini_response_shown=is_mini_shown,
             has_full_solution_available=has_full_available,
             full_descriptions=final_full_descriptions_for_storage,
-            full_links=final_full_links_for_storage
+            full_links=final_full_links_for_storage,
+            prompt_version=self.prompt_version
         )
\ No newline at end of file
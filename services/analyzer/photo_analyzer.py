@@ -1,12 +1,12 @@
 import logging
 import json
 import re
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Union
 import openpyxl
 from openpyxl.utils import get_column_letter
 
 # Импортируем общие функции и константы
-from .utils import KNOWN_ERROR_CODES, filter_cell
+from .utils import filter_cell, get_known_error_codes_snapshot
 # Импортируем ИИ функции для полного анализа
 from services.telegram.ai.ai import analyze_image_via_ai
 
@@ -112,7 +112,8 @@ class PhotoAnalyzer:
     Интегрирован с обработчиком поиска ошибок в Excel и ИИ промпте.
     """
     
-    def __init__(self, lang: str, file_path: str, username: Optional[str] = None):
+    def __init__(self, lang: str, file_path: Union[str, List[str]], username: Optional[str] = None):
+        # file_path может быть списком путей: альбом скриншотов одного лога анализируется одним запросом
         self.lang = lang
         self.file_path = file_path
         self.username = username
@@ -185,9 +186,11 @@ class PhotoAnalyzer:
         full_sols, full_lnks = [], []
         determined_error_code = None
         panic_string_from_ai = ""
+        prompt_version = None
 
         try:
-            ai_result = await analyze_image_via_ai(self.file_path, KNOWN_ERROR_CODES)
+            known_codes = get_known_error_codes_snapshot()
+            ai_result = await analyze_image_via_ai(self.file_path, known_codes.codes, known_codes.version)
             
             if ai_result and isinstance(ai_result, dict):
                 crash_key = ai_result.get('crash_reporter_key')
@@ -202,6 +205,7 @@ class PhotoAnalyzer:
                     'crash_reporter_key': crash_key
                 }
                 determined_error_code = ai_result.get('error_code')
+                prompt_version = ai_result.get('prompt_version')
                 panic_string_from_ai = self.log_data.get('panic_string', '')
 
                 if determined_error_code:
@@ -288,5 +292,6 @@ class PhotoAnalyzer:
             is_mini_response_shown=is_mini_shown,
             has_full_solution_available=has_full_available,
             full_descriptions=final_full_descriptions_for_storage,
-            full_links=final_full_links_for_storage
+            full_links=final_full_links_for_storage,
+            prompt_version=prompt_version
         ) 
\ No newline at end of file
@@ -1,48 +1,66 @@
 import asyncio
 import logging
 import os
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 
 from aiogram import types
 from aiogram.types import Message
 
 from config import DEBUG_MODE
 from database.models import User
-from services.analyzer import LogAnalyzer, TxtAnalyzer, PhotoAnalyzer
+from services.analyzer.workers import (
+    AnalysisRequest, run_analysis, ANALYZER_LOG, ANALYZER_TXT, ANALYZER_PHOTO
+)
 from services.telegram.misc.utils import save_file, remove_file
 from services.telegram.schemas.analyzer import ResponseSolution, SolutionAboutError
 
 
 async def find_error_solutions(
         message: Message,
-        user: User
+        user: User,
+        album: Optional[List[Message]] = None
 ) -> ResponseSolution:
+    """album - остальные фото того же media group, анализируются вместе с message"""
     file_path = await save_file(
         message, file_type=message.content_type
     )
+    extra_file_paths = []
     try:
+        for album_message in album or []:
+            extra_file_paths.append(await save_file(album_message, file_type=album_message.content_type))
+
         content_type = types.ContentType.DOCUMENT
 
         if message.document and message.document.file_name.endswith(".ips"):
-            analyzer = LogAnalyzer(user.lang, file_path, message.from_user.username)
+            analyzer_kind = ANALYZER_LOG
         elif message.document and message.document.file_name.endswith(".txt"):
-            analyzer = TxtAnalyzer(user.lang, file_path, message.from_user.username)
+            analyzer_kind = ANALYZER_TXT
         elif (message.document and message.document.file_name.endswith(".png", ".jpg", ".jpg")) or message.photo:
             content_type = types.ContentType.PHOTO
-            analyzer = PhotoAnalyzer(user.lang, file_path)
+            analyzer_kind = ANALYZER_PHOTO
         else:
             return await message.answer(text='Бот не читает эти файлы')
 
         # Включаем режим отладки для поиска и анализа мини-решений
         enable_debug = True
-        solution_about_error = await analyzer.find_error_solutions(debug=DEBUG_MODE or enable_debug)
+        # Сам анализ может выполняться в отдельном процессе (ANALYSIS_BACKEND)
+        result = await run_analysis(AnalysisRequest(
+            analyzer=analyzer_kind,
+            lang=user.lang,
+            file_path=file_path,
+            username=message.from_user.username,
+            debug=DEBUG_MODE or enable_debug,
+            extra_file_paths=extra_file_paths if content_type == types.ContentType.PHOTO else None
+        ))
 
         return ResponseSolution(
-            phone=analyzer.get_model(),
-            solution=solution_about_error,
+            phone=result.phone,
+            solution=result.solution,
             content_type=content_type
         )
     except Exception as e:
         raise e
     finally:
         remove_file(file_path)
+        for extra_file_path in extra_file_paths:
+            remove_file(extra_file_path)
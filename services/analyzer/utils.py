@@ -1,6 +1,31 @@
 import openpyxl
+from dataclasses import dataclass
 from typing import List, Tuple, Optional
 from config import PANIC_CODES_EXCEL_PATH, DEFAULT_SHEET_NAME_FOR_CODES
+from services.telegram.ai.prompt_cache import knowledge_base_version
+
+
+@dataclass(frozen=True)
+class KnownErrorCodes:
+    """
+    Список кодов одной загрузки panic_codes.xlsx. Версии (отпечатки для кеша промптов)
+    считаются один раз здесь, а не на каждый запрос к модели.
+    """
+    codes: List[str]
+    version: str
+    # Коды без "mini" - для текстовых логов
+    text_codes: List[str]
+    text_version: str
+
+    @classmethod
+    def build(cls, codes: List[str]) -> "KnownErrorCodes":
+        text_codes = [code for code in codes if " mini" not in code.lower()]
+        return cls(
+            codes=codes,
+            version=knowledge_base_version(codes),
+            text_codes=text_codes,
+            text_version=knowledge_base_version(text_codes),
+        )
 
 
 def load_error_codes_from_excel() -> List[str]:
@@ -33,9 +58,22 @@ def reload_known_error_codes() -> List[str]:
     Returns:
         Обновленный список кодов ошибок
     """
-    global KNOWN_ERROR_CODES
-    KNOWN_ERROR_CODES = load_error_codes_from_excel()
-    return KNOWN_ERROR_CODES
+    global _known_error_codes
+    _known_error_codes = KnownErrorCodes.build(load_error_codes_from_excel())
+    return _known_error_codes.codes
+
+
+def get_known_error_codes() -> List[str]:
+    """
+    Текущий список известных кодов ошибок. Читать список нужно через эту функцию:
+    имя, импортированное через from ... import, не увидит перезагрузку.
+    """
+    return _known_error_codes.codes
+
+
+def get_known_error_codes_snapshot() -> KnownErrorCodes:
+    """Текущая загрузка кодов целиком: списки и их версии согласованы между собой."""
+    return _known_error_codes
 
 
 def filter_cell(text: Optional[str]) -> Tuple[List[str], List[str]]:
@@ -55,4 +93,4 @@ def filter_cell(text: Optional[str]) -> Tuple[List[str], List[str]]:
 
 
 # Загружаем коды ошибок один раз при импорте модуля
-KNOWN_ERROR_CODES = load_error_codes_from_excel() 
\ No newline at end of file
+_known_error_codes: KnownErrorCodes = KnownErrorCodes.build(load_error_codes_from_excel()) 
\ No newline at end of file
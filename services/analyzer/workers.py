@@ -0,0 +1,256 @@
+"""
+Выполнение анализа вне процесса бота.
+
+Разбор логов (openpyxl, регулярки, PIL, JSON больших логов) нагружает CPU и в
+процессе бота блокирует event loop, на котором крутится polling Telegram. Режим
+выбирается переменной окружения ANALYSIS_BACKEND:
+
+- inline  - анализ в процессе бота (поведение по умолчанию);
+- process - пул из ANALYSIS_PROCESSES дочерних процессов (multiprocessing);
+- redis   - задачи уходят в список Redis, их разбирают отдельные процессы
+            `python worker.py` (см. serve_redis_worker). Воркеры должны видеть
+            тот же каталог data/, что и бот (локальный брокер на одной машине).
+
+Бот сохраняет файл, отправляет AnalysisRequest и получает обратно AnalysisResult,
+а форматирование ответа, списание токенов и история остаются в процессе бота.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from typing import List, Optional, Tuple
+
+from services.telegram.schemas.analyzer import ModelPhone, SolutionAboutError
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_JOBS_KEY = "analysis:jobs"
+REDIS_RESULT_KEY = "analysis:result:{job_id}"
+# Пауза воркера после ошибки Redis растет от 1 с до REDIS_MAX_BACKOFF
+REDIS_MAX_BACKOFF = 30
+
+ANALYZER_LOG = "ips"
+ANALYZER_TXT = "txt"
+ANALYZER_PHOTO = "photo"
+
+
+@dataclass
+class AnalysisRequest:
+    analyzer: str
+    lang: str
+    file_path: str
+    username: Optional[str] = None
+    debug: bool = False
+    # Дополнительные изображения альбома (анализируются вместе с file_path)
+    extra_file_paths: Optional[List[str]] = None
+
+
+@dataclass
+class AnalysisResult:
+    phone: Optional[ModelPhone] = None
+    solution: Optional[SolutionAboutError] = None
+    error: Optional[str] = None
+
+
+class AnalysisWorkerError(Exception):
+    """Анализ в воркере завершился ошибкой или не уложился в таймаут."""
+
+
+def encode_job(job_id: str, request: AnalysisRequest, deadline: float) -> str:
+    """Задача для Redis в JSON: воркер не исполняет присланный код, как было бы с pickle."""
+    return json.dumps({"job_id": job_id, "deadline": deadline, "request": asdict(request)}, ensure_ascii=False)
+
+
+def decode_job(payload) -> Tuple[str, AnalysisRequest, float]:
+    data = json.loads(payload)
+    return data["job_id"], AnalysisRequest(**data["request"]), float(data["deadline"])
+
+
+def encode_result(result: AnalysisResult) -> str:
+    return json.dumps(asdict(result), ensure_ascii=False)
+
+
+def decode_result(payload) -> AnalysisResult:
+    data = json.loads(payload)
+    return AnalysisResult(
+        phone=ModelPhone(**data["phone"]) if data.get("phone") else None,
+        solution=SolutionAboutError(**data["solution"]) if data.get("solution") else None,
+        error=data.get("error")
+    )
+
+
+_codes_mtime: Optional[float] = None
+
+
+def _refresh_known_codes():
+    """
+    Воркер живет дольше одной замены panic_codes.xlsx, поэтому перед задачей
+    перечитывает список кодов, если файл изменился.
+    """
+    global _codes_mtime
+    from config import PANIC_CODES_EXCEL_PATH
+    from services.analyzer import reload_known_error_codes
+    from services.telegram.ai.prompt_cache import clear_prompt_cache
+
+    try:
+        mtime = os.path.getmtime(PANIC_CODES_EXCEL_PATH)
+    except OSError:
+        return
+    if _codes_mtime is not None and mtime != _codes_mtime:
+        reload_known_error_codes()
+        clear_prompt_cache()
+        logger.info("Воркер анализа перечитал список кодов ошибок")
+    _codes_mtime = mtime
+
+
+async def analyze(request: AnalysisRequest) -> AnalysisResult:
+    """Собственно анализ файла: одинаков для всех режимов."""
+    from services.analyzer import LogAnalyzer, TxtAnalyzer, PhotoAnalyzer
+
+    if request.analyzer == ANALYZER_LOG:
+        analyzer = LogAnalyzer(request.lang, request.file_path, request.username)
+    elif request.analyzer == ANALYZER_TXT:
+        analyzer = TxtAnalyzer(request.lang, request.file_path, request.username)
+    elif request.analyzer == ANALYZER_PHOTO:
+        analyzer = PhotoAnalyzer(request.lang, [request.file_path] + (request.extra_file_paths or []))
+    else:
+        return AnalysisResult(error=f"Неизвестный тип анализатора: {request.analyzer}")
+
+    solution = await analyzer.find_error_solutions(debug=request.debug)
+    return AnalysisResult(phone=analyzer.get_model(), solution=solution)
+
+
+def _analyze_in_process(request: AnalysisRequest) -> AnalysisResult:
+    """Точка входа в дочернем процессе: свой event loop на каждую задачу."""
+    _refresh_known_codes()
+    try:
+        return asyncio.run(analyze(request))
+    except Exception as e:
+        logger.exception(f"Ошибка анализа в воркере: {e}")
+        return AnalysisResult(error=f"{type(e).__name__}: {e}")
+
+
+class InlineBackend:
+    async def run(self, request: AnalysisRequest) -> AnalysisResult:
+        return await analyze(request)
+
+    async def close(self):
+        pass
+
+
+class ProcessBackend:
+    def __init__(self, processes: Optional[int] = None):
+        if processes is None:
+            processes = get_settings().analysis_processes
+        # spawn: дочерние процессы не наследуют event loop и соединения бота
+        self._executor = ProcessPoolExecutor(max_workers=max(1, processes), mp_context=get_context("spawn"))
+
+    async def run(self, request: AnalysisRequest) -> AnalysisResult:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, _analyze_in_process, request)
+        timeout = get_settings().analysis_job_timeout
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise AnalysisWorkerError(f"Анализ не завершился за {timeout} с")
+
+    async def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RedisBackend:
+    def __init__(self, url: Optional[str] = None):
+        from redis import asyncio as aioredis
+        self._redis = aioredis.from_url(url or get_settings().redis_url)
+
+    async def run(self, request: AnalysisRequest) -> AnalysisResult:
+        job_id = uuid.uuid4().hex
+        # Срок задачи: воркер не берется за нее, если бот уже перестал ждать результат
+        timeout = get_settings().analysis_job_timeout
+        deadline = time.time() + timeout
+        await self._redis.rpush(REDIS_JOBS_KEY, encode_job(job_id, request, deadline))
+        reply = await self._redis.blpop([REDIS_RESULT_KEY.format(job_id=job_id)], timeout=timeout)
+        if reply is None:
+            raise AnalysisWorkerError(f"Воркер не вернул результат за {timeout} с")
+        return decode_result(reply[1])
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+_backend = None
+
+
+def get_analysis_backend():
+    """Возвращает бэкенд анализа согласно ANALYSIS_BACKEND (создается один раз)."""
+    global _backend
+    if _backend is None:
+        backend = get_settings().analysis_backend
+        if backend == "process":
+            _backend = ProcessBackend()
+        elif backend == "redis":
+            _backend = RedisBackend()
+        else:
+            _backend = InlineBackend()
+        logger.info(f"Бэкенд анализа: {type(_backend).__name__}")
+    return _backend
+
+
+async def close_analysis_backend():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+async def run_analysis(request: AnalysisRequest) -> AnalysisResult:
+    """Выполняет анализ в выбранном бэкенде; ошибка воркера превращается в исключение."""
+    result = await get_analysis_backend().run(request)
+    if result.error:
+        raise AnalysisWorkerError(result.error)
+    return result
+
+
+def serve_redis_worker(url: Optional[str] = None):
+    """
+    Цикл воркера для режима redis: забирает задачи и кладет результаты.
+    Ошибки Redis не завершают воркер: он ждет с растущей паузой и пробует снова.
+    """
+    import redis
+
+    client = redis.Redis.from_url(url or get_settings().redis_url)
+    logger.info(f"Воркер анализа (pid {os.getpid()}) ожидает задачи в {REDIS_JOBS_KEY}")
+    backoff = 1
+    while True:
+        try:
+            _, payload = client.blpop([REDIS_JOBS_KEY])
+        except redis.RedisError as e:
+            logger.error(f"Ошибка Redis при получении задачи: {e}. Повтор через {backoff} с")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, REDIS_MAX_BACKOFF)
+            continue
+        backoff = 1
+
+        try:
+            job_id, request, deadline = decode_job(payload)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать задачу анализа: {e}")
+            continue
+        if time.time() > deadline:
+            logger.warning(f"Задача {job_id} пропущена: бот уже не ждет результат")
+            continue
+
+        result = _analyze_in_process(request)
+        result_key = REDIS_RESULT_KEY.format(job_id=job_id)
+        try:
+            client.rpush(result_key, encode_result(result))
+            # Если бот уже не ждет (таймаут), результат не должен висеть в Redis
+            client.expire(result_key, get_settings().analysis_job_timeout)
+        except redis.RedisError as e:
+            logger.error(f"Не удалось вернуть результат задачи {job_id}: {e}")
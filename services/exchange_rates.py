@@ -35,7 +35,8 @@ async def update_database_rates(orm: ORM):
     if rates:
         # Убедимся, что orm.currency_repo существует
         if hasattr(orm, 'currency_repo') and orm.currency_repo:
-            await orm.currency_repo.update_rates(rates)
+            changed = await orm.currency_repo.update_rates(rates)
+            logger.info(f"Daily rates update finished, {len(changed)} regional prices changed.")
         else:
             logger.error("ORM object does not have 'currency_repo' initialized.")
     else:
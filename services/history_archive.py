@@ -0,0 +1,142 @@
+"""
+Холодный архив истории анализов.
+
+Записи старше срока хранения выгружаются в сжатые файлы JSONL.gz в data/archive/
+(строка файла - одна запись analysis_history), и только после сверки количества
+удаляются из таблицы. Строки читаются курсором на стороне сервера пачками, поэтому
+память не зависит от объема архива. Архив можно просматривать без базы:
+`python scripts/archive_analysis_history.py query <файл>`.
+"""
+import asyncio
+import gzip
+import json
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import Column, MetaData, Table, func, select
+
+from database.database import ORM
+from database.models import AnalysisHistory
+from database.repo.analysis_history import AnalysisHistoryRepo
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+class ArchiveVerificationError(Exception):
+    """Число записей в архиве не совпало с базой, удаление не выполнялось."""
+
+
+@dataclass
+class ArchiveResult:
+    path: Optional[str]
+    archived: int
+    deleted: int
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in row._mapping.items()
+    }
+
+
+def _partition_table(name: str) -> Table:
+    """Партиция analysis_history с теми же колонками (для чтения напрямую из нее)."""
+    return Table(name, MetaData(), *[Column(column.name, column.type) for column in AnalysisHistory.__table__.c])
+
+
+def _count_lines(path: str) -> int:
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        return sum(1 for _ in archive)
+
+
+async def archive_old_analyses(
+        orm: ORM,
+        cutoff: datetime,
+        delete: bool = True,
+        batch_size: Optional[int] = None,
+        partitions: Optional[List[str]] = None
+) -> ArchiveResult:
+    """
+    Выгружает записи истории с created_at < cutoff в HISTORY_ARCHIVE_DIR, сверяет количество
+    с базой и (если delete) удаляет выгруженные записи пачками.
+    partitions - читать только эти партиции (те, что очистка сейчас удалит целиком);
+    удаляет их сама очистка, поэтому delete с ними не сочетается.
+    """
+    if partitions is not None and delete:
+        raise ValueError("Партиции удаляются целиком, delete=True с partitions не поддерживается")
+    sources = [AnalysisHistory.__table__] if partitions is None else [_partition_table(name) for name in partitions]
+    if not sources:
+        logger.info(f"Архив истории: нет партиций старше {cutoff:%Y-%m-%d}")
+        return ArchiveResult(path=None, archived=0, deleted=0)
+
+    settings = get_settings()
+    if batch_size is None:
+        batch_size = settings.history_archive_batch_size
+    os.makedirs(settings.history_archive_dir, exist_ok=True)
+    path = os.path.join(
+        settings.history_archive_dir, f"analysis_history_before_{cutoff:%Y%m%d}_{datetime.utcnow():%Y%m%d%H%M%S}.jsonl.gz"
+    )
+    temp_path = path + ".part"
+
+    archived = 0
+    max_id = 0
+    try:
+        with gzip.open(temp_path, "wt", encoding="utf-8") as archive:
+            async with orm.engine.connect() as conn:
+                for table in sources:
+                    result = await conn.stream(
+                        select(table)
+                        .where(table.c.created_at < cutoff)
+                        .order_by(table.c.id)
+                        .execution_options(yield_per=batch_size)
+                    )
+                    async for rows in result.partitions(batch_size):
+                        lines = [json.dumps(_row_to_dict(row), ensure_ascii=False) + "\n" for row in rows]
+                        # Сжатие и запись - в отдельном потоке, чтобы не блокировать event loop
+                        await asyncio.to_thread(archive.writelines, lines)
+                        archived += len(rows)
+                        max_id = max(max_id, rows[-1].id)
+                        logger.info(f"Архив истории: выгружено {archived} записей")
+
+        if not archived:
+            os.remove(temp_path)
+            logger.info(f"Архив истории: нет записей старше {cutoff:%Y-%m-%d}")
+            return ArchiveResult(path=None, archived=0, deleted=0)
+
+        in_database = 0
+        async with orm.engine.connect() as conn:
+            for table in sources:
+                in_database += await conn.scalar(
+                    select(func.count(table.c.id))
+                    .where(table.c.created_at < cutoff, table.c.id <= max_id)
+                ) or 0
+        in_file = await asyncio.to_thread(_count_lines, temp_path)
+        if not (archived == in_file == in_database):
+            raise ArchiveVerificationError(
+                f"выгружено {archived}, в файле {in_file}, в базе {in_database}"
+            )
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    logger.info(f"Архив истории {path}: {archived} записей, сверка пройдена")
+
+    deleted = 0
+    if delete:
+        async with orm.async_sessionmaker() as session:
+            history_repo = AnalysisHistoryRepo(session)
+            deleted = await history_repo.delete_archived_analyses(cutoff, max_id, batch_size)
+    return ArchiveResult(path=path, archived=archived, deleted=deleted)
+
+
+def iter_archive(path: str) -> Iterator[Dict[str, Any]]:
+    """Читает записи из файла архива (для просмотра без базы)."""
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            yield json.loads(line)
@@ -1,45 +1,65 @@
-import pandas as pd
 import logging
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from database.database import ORM  # Предполагаем ORM
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
 import zipfile
 
 logger = logging.getLogger(__name__)
 DEFAULT_EXCEL_PATH = "data/regional_prices.xlsx"
+REQUIRED_COLUMNS = ['country_code', 'currency', 'symbol', 'coefficient']
+
+
+def _is_empty(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
 
 
 def read_pricing_from_excel(file_path: str = DEFAULT_EXCEL_PATH) -> list:
     """Читает данные о региональных ценах из Excel файла."""
+    # read_only: лист читается потоково, без pandas и без загрузки стилей
+    workbook = None
     try:
-        df = pd.read_excel(file_path, engine='openpyxl')
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(cell).strip() if cell is not None else None for cell in next(rows, ())]
         # Проверяем наличие необходимых колонок
-        required_columns = ['country_code', 'currency', 'symbol', 'coefficient']
-        if not all(col in df.columns for col in required_columns):
-            missing = [col for col in required_columns if col not in df.columns]
+        missing = [col for col in REQUIRED_COLUMNS if col not in header]
+        if missing:
             logger.error(f"Excel file {file_path} is missing required columns: {missing}")
             return []
+        positions = {col: header.index(col) for col in REQUIRED_COLUMNS}
 
-        # Преобразуем в список словарей, обрабатывая возможные NaN
-        # Заполняем NaN значениями по умолчанию или пропускаем строки
-        df = df.dropna(subset=required_columns)  # Пропускаем строки, где не хватает ключевых данных
-        # Преобразуем coefficient в Decimal
-        df['coefficient'] = df['coefficient'].apply(lambda x: Decimal(str(x)) if pd.notna(x) else Decimal('1.0'))
-        pricing_data = df[required_columns].to_dict('records')
+        pricing_data = []
+        for row_number, row in enumerate(rows, start=2):
+            values = {col: row[index] if index < len(row) else None for col, index in positions.items()}
+            if any(_is_empty(value) for value in values.values()):
+                continue  # Пропускаем строки, где не хватает ключевых данных
+            try:
+                values['coefficient'] = Decimal(str(values['coefficient']))
+            except InvalidOperation:
+                logger.warning(f"Row {row_number} in {file_path}: invalid coefficient {values['coefficient']!r}, skipped")
+                continue
+            for col in ('country_code', 'currency', 'symbol'):
+                values[col] = str(values[col]).strip()
+            pricing_data.append(values)
         logger.info(f"Successfully read {len(pricing_data)} records from {file_path}")
         return pricing_data
     except FileNotFoundError:
         logger.error(f"Regional pricing Excel file not found at {file_path}")
         return []
-    except zipfile.BadZipFile:
+    except (zipfile.BadZipFile, InvalidFileException):
         logger.error(f"Failed to read {file_path}. The file is corrupted or not a valid Excel (.xlsx) file.")
         return []
     except Exception as e:
         logger.error(f"Error reading or processing Excel file {file_path}: {e}", exc_info=True)
         return []
+    finally:
+        if workbook is not None:
+            workbook.close()
 
 
-async def load_regional_pricing_to_db(orm: ORM, file_path: str = DEFAULT_EXCEL_PATH):
-    """Загружает региональные цены из Excel в базу данных."""
+async def load_regional_pricing_to_db(orm: ORM, file_path: str = DEFAULT_EXCEL_PATH) -> dict | None:
+    """Загружает региональные цены из Excel в базу данных и возвращает отчет об изменениях."""
     logger.info(f"Starting regional pricing load from {file_path}...")
     pricing_data = read_pricing_from_excel(file_path)
 
@@ -47,9 +67,37 @@ async def load_regional_pricing_to_db(orm: ORM, file_path: str = DEFAULT_EXCEL_P
         if hasattr(orm, 'regional_pricing_repo') and orm.regional_pricing_repo:
             # Опционально: очистить старые данные перед загрузкой новых
             # await orm.regional_pricing_repo.clear_pricing()
-            await orm.regional_pricing_repo.update_pricing_from_list(pricing_data)
-            logger.info(f"Finished loading {len(pricing_data)} regional pricing records to DB.")
+            diff = await orm.regional_pricing_repo.update_pricing_from_list(pricing_data)
+            logger.info(f"Finished loading {len(pricing_data)} regional pricing records to DB: {format_pricing_diff(diff)}")
+            return diff
         else:
             logger.error("ORM object does not have 'regional_pricing_repo' initialized.")
     else:
         logger.warning("No regional pricing data read from Excel, database not updated.")
+    return None
+
+
+def format_pricing_diff(diff: dict | None) -> str:
+    """Краткий отчет об изменениях цен для логов и ответа администратору."""
+    if not diff:
+        return "нет данных"
+    if not diff["added"] and not diff["changed"]:
+        return f"изменений нет ({diff['unchanged']} стран без изменений)"
+    lines = []
+    if diff["added"]:
+        lines.append(f"добавлены: {', '.join(diff['added'])}")
+    for country_code, fields in diff["changed"].items():
+        changes = ", ".join(f"{field} {old} → {new}" for field, (old, new) in fields.items())
+        lines.append(f"{country_code}: {changes}")
+    lines.append(f"без изменений: {diff['unchanged']}")
+    return "\n".join(lines)
+
+
+def summarize_pricing_diff(diff: dict | None) -> str:
+    """Отчет об изменениях цен одной строкой (когда полный не помещается в сообщение)."""
+    if not diff:
+        return "нет данных"
+    return (
+        f"добавлено стран: {len(diff['added'])}, изменено: {len(diff['changed'])}, "
+        f"без изменений: {diff['unchanged']}"
+    )
@@ -3,7 +3,7 @@ AI integration for the Telegram bot (Now using OpenAI only)
 """
 import logging
 import json
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Union
 from config import Environ 
 import os
 import openai
@@ -12,7 +12,11 @@ import re
 import random     
 import base64  
 
-from .ai_prompts import ANALYZE_IMAGE_SYSTEM_PROMPT_TEMPLATE, GET_ERROR_CODE_SUGGESTION_SYSTEM_PROMPT_TEMPLATE
+from .prompt_cache import get_system_prompt
+from .telemetry import (
+    record_ai_call, CallTimer,
+    STAGE_IMAGE_TO_JSON, STAGE_TEXT_EXTRACTION_OCR, STAGE_ERROR_CODE_SUGGESTION,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -24,14 +28,18 @@ TIMEOUT_RETRY_WAIT_SECONDS = 5
 
 async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, messages: List[Dict[str, any]],
                                 response_format_type: Optional[str] = None, temperature: float = 0.0,
-                                timeout: int = 60, call_description: str = "OpenAI API call") -> tuple[Optional[str], Optional[Dict[str, any]]]:
+                                timeout: int = 60, call_description: str = "OpenAI API call",
+                                stage: Optional[str] = None) -> tuple[Optional[str], Optional[Dict[str, any]]]:
     """
     Вспомогательная функция для вызова OpenAI API с внутренними повторами при ошибках.
     Возвращает (content, error_dict). Если успешно, content - строка, error_dict - None.
     Если ошибка, content - None, error_dict содержит детали ошибки.
+    Каждая попытка пишется в телеметрию под этапом stage (по умолчанию - call_description).
     """
     last_exception = None
+    telemetry_stage = stage or call_description
     for attempt in range(MAX_API_RETRIES_PER_STAGE + 1):
+        timer = CallTimer()
         try:
             logger.info(f"{call_description}, Попытка {attempt + 1}/{MAX_API_RETRIES_PER_STAGE + 1}")
             common_params = {
@@ -44,10 +52,12 @@ async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, mes
                 common_params["response_format"] = {"type": response_format_type}
 
             response = await client.chat.completions.create(**common_params)
+            usage = getattr(response, "usage", None)
 
             if not response.choices or not response.choices[0].message or response.choices[0].message.content is None:
                 error_message = f"Ответ {call_description} не содержит ожидаемого поля content или оно равно None."
                 logger.error(error_message)
+                record_ai_call(model_name, telemetry_stage, attempt + 1, timer.elapsed_ms, "no_content", usage=usage)
                 if attempt < MAX_API_RETRIES_PER_STAGE:
                     last_exception = ValueError(error_message)
                     wait_time = TIMEOUT_RETRY_WAIT_SECONDS * (2 ** attempt) + random.uniform(0, 1)
@@ -57,10 +67,12 @@ async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, mes
                 else: # All retries for no content exhausted
                     return None, {"error": "NO_CONTENT_IN_RESPONSE", "description": error_message}
             
+            record_ai_call(model_name, telemetry_stage, attempt + 1, timer.elapsed_ms, "ok", usage=usage)
             return response.choices[0].message.content.strip(), None # content, no error_dict
 
         except openai.RateLimitError as e:
             last_exception = e
+            record_ai_call(model_name, telemetry_stage, attempt + 1, timer.elapsed_ms, "rate_limit", error=e)
             logger.warning(f"OpenAI RateLimitError ({call_description}, Попытка {attempt + 1}): {e}")
             if attempt < MAX_API_RETRIES_PER_STAGE:
                 wait_time_rl = DEFAULT_RETRY_WAIT_SECONDS
@@ -86,6 +98,7 @@ async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, mes
         
         except (openai.APITimeoutError, openai.APIConnectionError) as e:
             last_exception = e
+            record_ai_call(model_name, telemetry_stage, attempt + 1, timer.elapsed_ms, "timeout", error=e)
             error_type_name = type(e).__name__
             logger.warning(f"OpenAI {error_type_name} ({call_description}, Попытка {attempt + 1}): {e}")
             if attempt < MAX_API_RETRIES_PER_STAGE:
@@ -98,6 +111,7 @@ async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, mes
 
         except openai.APIStatusError as e:
             last_exception = e
+            record_ai_call(model_name, telemetry_stage, attempt + 1, timer.elapsed_ms, "api_status", error=e)
             logger.error(f"OpenAI Ошибка статуса API ({call_description}, status={e.status_code}): {e.message}", exc_info=False)
             if 400 <= e.status_code < 500 and e.status_code != 429: # Non-retryable client errors
                 return None, {"error": "API_CLIENT_ERROR", "status_code": e.status_code, "description": e.message}
@@ -111,6 +125,7 @@ async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, mes
         
         except Exception as e:
             last_exception = e
+            record_ai_call(model_name, telemetry_stage, attempt + 1, timer.elapsed_ms, "error", error=e)
             logger.error(f"Непредвиденная ошибка при вызове OpenAI API ({call_description}, попытка {attempt + 1}): {e}", exc_info=True)
             if attempt == MAX_API_RETRIES_PER_STAGE:
                  return None, {"error": "UNEXPECTED_API_ERROR_LAST_ATTEMPT", "description": str(e)}
@@ -126,7 +141,7 @@ async def _make_openai_api_call(client: openai.AsyncOpenAI, model_name: str, mes
     
     return None, {"error": error_key_final, "description": final_error_msg, "last_exception_type": str(type(last_exception)), "last_exception_message": str(last_exception)}
 
-async def _do_one_full_analysis_pass(client, base64_image, known_error_codes, system_prompt_image_json, user_content_image_json, pass_num: int):
+async def _do_one_full_analysis_pass(client, base64_image, known_error_codes, system_prompt_image_json, user_content_image_json, pass_num: int, kb_version: Optional[str] = None):
     """Выполняет один полный проход анализа: Image-to-JSON, затем OCR fallback если нужно."""
     logger.info(f"Начало полного прохода анализа #{pass_num}")
     
@@ -135,7 +150,8 @@ async def _do_one_full_analysis_pass(client, base64_image, known_error_codes, sy
         client, "gpt-4o", 
         messages=[{"role": "system", "content": system_prompt_image_json}, {"role": "user", "content": user_content_image_json}],
         response_format_type="json_object", timeout=90,
-        call_description=f"Image-to-JSON (Pass {pass_num})"
+        call_description=f"Image-to-JSON (Pass {pass_num})",
+        stage=STAGE_IMAGE_TO_JSON
     )
 
     if error_dict:
@@ -171,7 +187,8 @@ async def _do_one_full_analysis_pass(client, base64_image, known_error_codes, sy
             messages=[{"role": "system", "content": text_extraction_system_prompt}, 
                       {"role": "user", "content": user_content_image_json}], 
             timeout=60,
-            call_description=f"Text Extraction OCR (Pass {pass_num})"
+            call_description=f"Text Extraction OCR (Pass {pass_num})",
+            stage=STAGE_TEXT_EXTRACTION_OCR
         )
 
         if text_error_dict:
@@ -180,7 +197,7 @@ async def _do_one_full_analysis_pass(client, base64_image, known_error_codes, sy
             logger.warning(f"OCR (Проход {pass_num}) вернул бесполезный текст: '{extracted_text_raw[:100]}...'. Пропускаем анализ этого текста.")
         else:
             logger.info(f"OCR (Проход {pass_num}) извлек текст (первые 500 симв): {extracted_text_raw[:500]}...")
-            suggested_error_code_ocr = await get_ai_error_code_suggestion(client, extracted_text_raw, known_error_codes)
+            suggested_error_code_ocr = await get_ai_error_code_suggestion(client, extracted_text_raw, known_error_codes, kb_version)
             if suggested_error_code_ocr:
                 logger.info(f"OCR fallback (Проход {pass_num}) нашел error_code: {suggested_error_code_ocr}. Обновляем результат.")
                 current_ai_result["error_code"] = suggested_error_code_ocr
@@ -192,26 +209,43 @@ async def _do_one_full_analysis_pass(client, base64_image, known_error_codes, sy
     return current_ai_result, None # Результат этого прохода, нет ошибки
 
 async def analyze_image_via_ai(
-        image_path: str,
-        known_error_codes: List[str]
+        image_path: Union[str, List[str]],
+        known_error_codes: List[str],
+        kb_version: Optional[str] = None
 ) -> Optional[Dict[str, Optional[str]]]:
+    """
+    image_path - путь к изображению или список путей (альбом скриншотов одного лога):
+    все изображения уходят одним запросом как несколько частей image_url.
+    kb_version - версия списка кодов, посчитанная при его загрузке (см. prompt_cache).
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         logger.error("OPENAI_API_KEY не найден для analyze_image_via_ai.")
         return None
 
-    try:
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-    except Exception as e:
-        logger.error(f"Ошибка чтения или кодирования изображения {image_path}: {e}", exc_info=True)
-        return None
+    image_paths = [image_path] if isinstance(image_path, str) else list(image_path)
+    base64_images = []
+    for path in image_paths:
+        try:
+            with open(path, "rb") as image_file:
+                base64_images.append(base64.b64encode(image_file.read()).decode('utf-8'))
+        except Exception as e:
+            logger.error(f"Ошибка чтения или кодирования изображения {path}: {e}", exc_info=True)
+            return None
+    base64_image = base64_images[0]
 
-    codes_list_str = "\n".join([f"- `{code}`" for code in known_error_codes])
-    system_prompt_image_json = ANALYZE_IMAGE_SYSTEM_PROMPT_TEMPLATE.format(known_error_codes_list_str=codes_list_str)
-    user_content_image_json = [
-        {"type": "text", "text": "Проанализируй текст на этом изображении лога сбоя iOS и верни ТОЛЬКО JSON с требуемой информацией, следуя СТРОГИМ правилам форматирования."},
-        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+    system_prompt_image_json, code_catalog = get_system_prompt("analyze_image", known_error_codes, kb_version)
+    if len(base64_images) == 1:
+        instruction = "Проанализируй текст на этом изображении лога сбоя iOS и верни ТОЛЬКО JSON с требуемой информацией, следуя СТРОГИМ правилам форматирования."
+    else:
+        instruction = (
+            f"Это {len(base64_images)} скриншота(ов) одного и того же лога сбоя iOS по порядку. "
+            "Проанализируй текст на всех изображениях вместе и верни ТОЛЬКО один JSON с требуемой информацией, "
+            "следуя СТРОГИМ правилам форматирования."
+        )
+    user_content_image_json = [{"type": "text", "text": instruction}] + [
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encoded}"}}
+        for encoded in base64_images
     ]
     client = openai.AsyncOpenAI(api_key=api_key)
     
@@ -222,7 +256,7 @@ async def analyze_image_via_ai(
         current_pass_result, error_dict_from_pass = await _do_one_full_analysis_pass(
             client, base64_image, known_error_codes, 
             system_prompt_image_json, user_content_image_json, 
-            pass_num=pass_idx + 1
+            pass_num=pass_idx + 1, kb_version=code_catalog.kb_version
         )
         
         if error_dict_from_pass:
@@ -251,15 +285,11 @@ async def analyze_image_via_ai(
     # Финальная обработка найденного результата
     current_ai_error_code = final_result_from_passes.get("error_code")
     if current_ai_error_code:
-        found_known_code = False
-        for known_code in known_error_codes:
-            if isinstance(current_ai_error_code, str) and known_code.lower() == current_ai_error_code.lower():
-                final_result_from_passes["error_code"] = known_code
-                if final_result_from_passes.get("panic_string") != known_code:
-                    final_result_from_passes["panic_string"] = known_code
-                found_known_code = True
-                break
-        if not found_known_code:
+        known_code = code_catalog.resolve(current_ai_error_code)
+        if known_code:
+            final_result_from_passes["error_code"] = known_code
+            final_result_from_passes["panic_string"] = known_code
+        else:
             logger.warning(f"Код ошибки '{current_ai_error_code}' от AI (финальный) не найден в списке известных! Заменяется на null.")
             final_result_from_passes["error_code"] = None
             final_result_from_passes["panic_string"] = None
@@ -267,13 +297,15 @@ async def analyze_image_via_ai(
         if final_result_from_passes.get("panic_string") is not None:
             logger.info("Финальный error_code is null, устанавливаем panic_string в null.")
             final_result_from_passes["panic_string"] = None
-            
+
+    final_result_from_passes["prompt_version"] = code_catalog.version_tag
     return final_result_from_passes
 
 async def get_ai_error_code_suggestion(
         client: openai.AsyncOpenAI,
         error_text: str,
         known_error_codes: List[str],
+        kb_version: Optional[str] = None,
 ) -> Optional[str]:
     """
     Определяет наиболее подходящий error_code из списка known_error_codes
@@ -283,9 +315,8 @@ async def get_ai_error_code_suggestion(
         logger.warning("Пустой error_text или known_error_codes передан в get_ai_error_code_suggestion.")
         return None
 
-    codes_list_str = "\n".join([f"- `{code}`" for code in known_error_codes])
-    system_prompt = GET_ERROR_CODE_SUGGESTION_SYSTEM_PROMPT_TEMPLATE.format(known_error_codes_list_str=codes_list_str)
-    user_prompt = f"{error_text}\n\nВыбери ОДИН код из списка выше или напиши null:"
+    system_prompt, code_catalog = get_system_prompt("error_code_suggestion", known_error_codes, kb_version)
+    user_prompt = f"{error_text}\n\nВерни номер ОДНОГО кода из списка выше или напиши null:"
 
     ai_response_raw, error_dict = await _make_openai_api_call(
         client, "gpt-4o",
@@ -293,7 +324,8 @@ async def get_ai_error_code_suggestion(
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ],
-        call_description="Error Code Suggestion from Text"
+        call_description="Error Code Suggestion from Text",
+        stage=STAGE_ERROR_CODE_SUGGESTION
     )
 
     if error_dict:
@@ -310,13 +342,10 @@ async def get_ai_error_code_suggestion(
         logger.info("AI вернул 'null', подходящий код ошибки не найден (text analysis).")
         return None
     
-    for known_code in known_error_codes:
-        if known_code == ai_response_raw:
-            logger.info(f"AI выбрал подходящий код ошибки (точное совпадение): {known_code}")
-            return known_code
-        if known_code.lower() == ai_response_raw.lower():
-            logger.info(f"AI выбрал код (без учета регистра): {known_code} (ответ AI: {ai_response_raw})")
-            return known_code
+    known_code = code_catalog.resolve(ai_response_raw)
+    if known_code:
+        logger.info(f"AI выбрал код ошибки: {known_code} (ответ AI: {ai_response_raw})")
+        return known_code
 
     logger.warning(f"Ответ AI '{ai_response_raw}' (для кода ошибки из текста) не 'null' и не найден в списке известных. Совпадений нет.")
     return None
@@ -0,0 +1,146 @@
+"""
+Кеш отрендеренных системных промптов.
+
+Системные промпты зависят только от версии шаблонов (PROMPT_VERSION) и от списка
+известных кодов ошибок (версии базы знаний), поэтому собираются один раз на пару
+этих версий, а не на каждый запрос к OpenAI.
+
+Коды передаются модели компактным нумерованным каталогом (`17. AppleBaseband`),
+модель возвращает только номер, а ответ разбирается обратно через словарь.
+"""
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from .ai_prompts import (
+    PROMPT_VERSION,
+    ANALYZE_IMAGE_SYSTEM_PROMPT_TEMPLATE,
+    GET_ERROR_CODE_SUGGESTION_SYSTEM_PROMPT_TEMPLATE,
+)
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TEMPLATES: Dict[str, str] = {
+    "analyze_image": ANALYZE_IMAGE_SYSTEM_PROMPT_TEMPLATE,
+    "error_code_suggestion": GET_ERROR_CODE_SUGGESTION_SYSTEM_PROMPT_TEMPLATE,
+}
+
+# Несколько версий базы знаний могут жить одновременно (фото анализируются по полному
+# списку кодов, текстовые логи - по списку без "mini"), но старые версии не нужны.
+MAX_CACHED_PROMPTS = 8
+
+
+def knowledge_base_version(known_error_codes: List[str]) -> str:
+    """Короткий стабильный отпечаток списка кодов ошибок."""
+    digest = hashlib.sha1("\x1f".join(known_error_codes).encode("utf-8")).hexdigest()
+    return digest[:12]
+
+
+def prompt_version_tag(kb_version: str) -> str:
+    """Метка для истории анализов: версия шаблонов + версия базы знаний."""
+    return f"{PROMPT_VERSION}/{kb_version}"
+
+
+@dataclass(frozen=True)
+class CodeCatalog:
+    """Нумерованный каталог кодов ошибок одной версии базы знаний."""
+    kb_version: str
+    text: str
+    codes_by_id: Dict[str, str]
+    codes_by_lower: Dict[str, str]
+
+    @property
+    def version_tag(self) -> str:
+        return prompt_version_tag(self.kb_version)
+
+    @classmethod
+    def build(cls, known_error_codes: List[str], kb_version: str) -> "CodeCatalog":
+        codes_by_id: Dict[str, str] = {}
+        codes_by_lower: Dict[str, str] = {}
+        lines = []
+        for number, code in enumerate(known_error_codes, start=1):
+            code_id = str(number)
+            codes_by_id[code_id] = code
+            codes_by_lower.setdefault(code.lower(), code)
+            lines.append(f"{code_id}. {code}")
+        return cls(
+            kb_version=kb_version,
+            text="\n".join(lines),
+            codes_by_id=codes_by_id,
+            codes_by_lower=codes_by_lower,
+        )
+
+    def resolve(self, answer: Any) -> Optional[str]:
+        """
+        Переводит ответ модели (номер кода) в код из базы знаний.
+        Если модель все же вернула сам код, он ищется без учета регистра.
+        Возвращает None, если ответ "null" или не найден в каталоге.
+        """
+        if answer is None:
+            return None
+        key = str(answer).strip().strip('`"\'').strip()
+        if not key or key.lower() == "null":
+            return None
+        code = self.codes_by_id.get(key.lstrip("#").rstrip("."))
+        if code is None:
+            code = self.codes_by_lower.get(key.lower())
+        return code
+
+
+_catalogs: "OrderedDict[str, CodeCatalog]" = OrderedDict()
+_rendered_prompts: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+
+
+def get_code_catalog(known_error_codes: List[str], kb_version: Optional[str] = None) -> CodeCatalog:
+    """
+    Возвращает каталог кодов, построенный один раз на версию базы знаний.
+    kb_version считается при загрузке списка (services.analyzer.utils); без нее
+    отпечаток списка приходится считать на каждый вызов.
+    """
+    if kb_version is None:
+        kb_version = knowledge_base_version(known_error_codes)
+    catalog = _catalogs.get(kb_version)
+    if catalog is None:
+        catalog = CodeCatalog.build(known_error_codes, kb_version)
+        _catalogs[kb_version] = catalog
+        while len(_catalogs) > MAX_CACHED_PROMPTS:
+            _catalogs.popitem(last=False)
+    else:
+        _catalogs.move_to_end(kb_version)
+    return catalog
+
+
+def get_system_prompt(
+        template_name: str,
+        known_error_codes: List[str],
+        kb_version: Optional[str] = None
+) -> Tuple[str, CodeCatalog]:
+    """
+    Возвращает (системный_промпт, каталог_кодов) для шаблона template_name.
+    Промпт рендерится один раз на версию шаблонов и версию базы знаний.
+    """
+    catalog = get_code_catalog(known_error_codes, kb_version)
+    cache_key = (template_name, PROMPT_VERSION, catalog.kb_version)
+
+    prompt = _rendered_prompts.get(cache_key)
+    if prompt is None:
+        prompt = PROMPT_TEMPLATES[template_name].format(known_error_codes_catalog=catalog.text)
+        _rendered_prompts[cache_key] = prompt
+        logger.info(
+            f"Системный промпт '{template_name}' отрендерен для версии {catalog.version_tag} "
+            f"({len(catalog.codes_by_id)} кодов, {len(prompt)} символов)."
+        )
+        while len(_rendered_prompts) > MAX_CACHED_PROMPTS:
+            _rendered_prompts.popitem(last=False)
+    else:
+        _rendered_prompts.move_to_end(cache_key)
+
+    return prompt, catalog
+
+
+def clear_prompt_cache() -> None:
+    """Сбрасывает кеш (например, после замены panic_codes.xlsx)."""
+    _catalogs.clear()
+    _rendered_prompts.clear()
@@ -0,0 +1,190 @@
+"""
+Телеметрия вызовов OpenAI.
+
+Каждая попытка вызова API пишется одной JSON-строкой в ротируемый локальный файл
+(data/telemetry/ai_calls.<pid>.jsonl). Запись идет через QueueHandler, а в файл пишет
+отдельный поток QueueListener, поэтому event loop не блокируется на диске.
+
+Вызовы делают бот, процессы пула анализа и Redis-воркеры. RotatingFileHandler не
+умеет ротировать общий файл из нескольких процессов, поэтому у каждого процесса свой
+файл, а сводка читает их все. Файлы старше TELEMETRY_KEEP_DAYS удаляются.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+TELEMETRY_DIR = "data/telemetry"
+TELEMETRY_FILE_PATTERN = os.path.join(TELEMETRY_DIR, "ai_calls.{pid}.jsonl")
+# Текущие файлы процессов, их ротации и общий файл прежних версий (ai_calls.jsonl)
+TELEMETRY_FILES_GLOB = os.path.join(TELEMETRY_DIR, "ai_calls*.jsonl*")
+TELEMETRY_MAX_BYTES = 5 * 1024 * 1024
+TELEMETRY_BACKUP_COUNT = 5
+TELEMETRY_KEEP_DAYS = 30
+
+# Этапы анализа, для которых собирается телеметрия
+STAGE_IMAGE_TO_JSON = "Image-to-JSON"
+STAGE_TEXT_EXTRACTION_OCR = "Text Extraction OCR"
+STAGE_ERROR_CODE_SUGGESTION = "Error Code Suggestion"
+
+_telemetry_logger = logging.getLogger("ai_telemetry")
+_listener: Optional[QueueListener] = None
+
+
+def _ensure_writer() -> None:
+    """Лениво поднимает фоновый писатель при первой записи."""
+    global _listener
+    if _listener is not None:
+        return
+
+    os.makedirs(TELEMETRY_DIR, exist_ok=True)
+    _remove_stale_files()
+    file_handler = RotatingFileHandler(
+        TELEMETRY_FILE_PATTERN.format(pid=os.getpid()),
+        maxBytes=TELEMETRY_MAX_BYTES,
+        backupCount=TELEMETRY_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    records_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _telemetry_logger.addHandler(QueueHandler(records_queue))
+    _telemetry_logger.setLevel(logging.INFO)
+    _telemetry_logger.propagate = False
+
+    _listener = QueueListener(records_queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def _remove_stale_files() -> None:
+    """Удаляет файлы завершившихся процессов, не менявшиеся дольше TELEMETRY_KEEP_DAYS."""
+    expires_before = time.time() - TELEMETRY_KEEP_DAYS * 86400
+    for path in glob.glob(TELEMETRY_FILES_GLOB):
+        try:
+            if os.path.getmtime(path) < expires_before:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def record_ai_call(
+        model: str,
+        stage: str,
+        attempt: int,
+        latency_ms: float,
+        outcome: str,
+        usage: Any = None,
+        error: Optional[BaseException] = None,
+) -> None:
+    """
+    Записывает одну попытку вызова API.
+    outcome: ok / no_content / rate_limit / timeout / api_status / error.
+    usage: объект usage из ответа OpenAI (может отсутствовать).
+    """
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+    record = {
+        "ts": datetime.utcnow().isoformat(timespec="seconds"),
+        "model": model,
+        "stage": stage,
+        "attempt": attempt,
+        "latency_ms": round(latency_ms, 1),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+        "outcome": outcome,
+        "error_class": type(error).__name__ if error else None,
+    }
+    try:
+        _ensure_writer()
+        _telemetry_logger.info(json.dumps(record, ensure_ascii=False))
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Не удалось записать телеметрию AI: {e}")
+
+
+class CallTimer:
+    """Замер длительности одной попытки вызова."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000
+
+
+def load_records(days: int = 7) -> List[Dict[str, Any]]:
+    """Читает записи телеметрии за последние days дней (включая ротированные файлы)."""
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat(timespec="seconds")
+    records = []
+    for path in sorted(glob.glob(TELEMETRY_FILES_GLOB)):
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("ts", "") >= since:
+                        records.append(record)
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"Не удалось прочитать файл телеметрии {path}: {e}")
+    return records
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(days: int = 7) -> Dict[str, Any]:
+    """
+    Сводка по телеметрии: p50/p95 задержки и доля повторов по этапам,
+    расход токенов по дням.
+    """
+    records = load_records(days)
+
+    by_stage: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    tokens_by_day: Dict[str, Dict[str, int]] = defaultdict(lambda: {"prompt": 0, "completion": 0, "cached": 0})
+    for record in records:
+        by_stage[record.get("stage", "unknown")].append(record)
+        day = tokens_by_day[record.get("ts", "")[:10]]
+        day["prompt"] += record.get("prompt_tokens", 0)
+        day["completion"] += record.get("completion_tokens", 0)
+        day["cached"] += record.get("cached_tokens", 0)
+
+    stages = {}
+    for stage, stage_records in by_stage.items():
+        latencies = [r["latency_ms"] for r in stage_records if r.get("outcome") == "ok"]
+        calls = sum(1 for r in stage_records if r.get("attempt") == 1)
+        attempts = len(stage_records)
+        failures = sum(1 for r in stage_records if r.get("outcome") != "ok")
+        stages[stage] = {
+            "calls": calls,
+            "attempts": attempts,
+            "failures": failures,
+            "retry_rate": ((attempts - calls) / calls) if calls else 0.0,
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+        }
+
+    return {
+        "days": days,
+        "total_attempts": len(records),
+        "stages": stages,
+        "tokens_by_day": dict(sorted(tokens_by_day.items())),
+    }
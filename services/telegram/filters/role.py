@@ -1,17 +1,20 @@
+from typing import Optional
+
 from aiogram.filters import BaseFilter
 from aiogram.types import Message
 
 from database.database import ORM
+from database.models import User
 
 
 class RoleFilter(BaseFilter):
     def __init__(self, roles):
         self.roles: list[str] = roles
 
-    async def __call__(self, message: Message):
-        orm = ORM()
-        await orm.create_repos()
-        user = await orm.user_repo.find_user_by_user_id(message.from_user.id)
+    async def __call__(self, message: Message, user: Optional[User] = None, orm: Optional[ORM] = None):
+        # Пользователя уже загрузил DataMiddleware (через кеш UserRepo)
+        if user is None and orm is not None and orm.user_repo and message.from_user:
+            user = await orm.user_repo.get_user_cached(message.from_user.id)
         if user is None:  
             return False 
         if user.role in self.roles:
@@ -0,0 +1,43 @@
+"""
+Выбор хранилища FSM.
+
+По умолчанию состояние и данные FSM живут в памяти процесса и теряются при
+перезапуске. С FSM_STORAGE=redis они хранятся в Redis (REDIS_URL), поэтому
+несколько реплик бота обслуживают одних и тех же пользователей, а перезапуск
+не сбрасывает "Полный ответ", ключи обратной связи и шаги мастеров.
+"""
+import json
+import logging
+from typing import Any
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+def _compact_dumps(value: Any) -> str:
+    """JSON без пробелов и без \\u-экранирования кириллицы: данные FSM в разы меньше."""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def create_fsm_storage() -> BaseStorage:
+    settings = get_settings()
+    if settings.fsm_storage == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+
+        # FSM_TTL - время жизни состояния и данных FSM в Redis (секунды, 0 - без ограничения)
+        storage = RedisStorage.from_url(
+            settings.redis_url,
+            key_builder=DefaultKeyBuilder(with_bot_id=True),
+            state_ttl=settings.fsm_ttl or None,
+            data_ttl=settings.fsm_ttl or None,
+            json_dumps=_compact_dumps,
+            json_loads=json.loads,
+        )
+        logger.info("Хранилище FSM: Redis")
+        return storage
+
+    logger.info("Хранилище FSM: память процесса")
+    return MemoryStorage()
@@ -1,9 +1,16 @@
+import asyncio
+
 from aiogram import Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 
 import config
+from database.database import ORM
+from database.session import pool_status
+from services.telegram.ai.telemetry import summarize
 from services.telegram.filters.role import RoleFilter
+from services.telegram.jobs.history_retention import cleanup_analysis_history
+from settings import get_settings, reload_settings
 
 router = Router()
 router.message.filter(RoleFilter(roles=["admin"]))
@@ -21,8 +28,59 @@ async def disable_debug_mode(message: Message):
     await message.answer("✅ Debug режим анализатора ВЫКЛЮЧЕН\n\nОтладочная информация больше не будет показываться в логах.")
 
 @router.message(Command("debug_status"))
-async def debug_status(message: Message):
-    """Показать статус debug режима"""
+async def debug_status(message: Message, orm: ORM):
+    """Показать статус debug режима и загрузку пула БД"""
     status = "ВКЛЮЧЕН" if config.DEBUG_MODE else "ВЫКЛЮЧЕН"
     emoji = "🐛" if config.DEBUG_MODE else "✅"
-    await message.answer(f"{emoji} Debug режим анализатора: {status}") 
\ No newline at end of file
+    pool = pool_status(orm.engine)
+    await message.answer(
+        f"{emoji} Debug режим анализатора: {status}\n"
+        f"🔌 Соединений из пула БД на обновление: {pool['checkouts_per_update']:.2f}\n"
+        f"🗄 Пул БД: занято {pool.get('in_use', '-')} из {pool.get('size', '-')}, "
+        f"свободно {pool.get('idle', '-')}, сверх лимита {pool.get('overflow', '-')}\n"
+        f"⏱ Ожидание соединения: в среднем {pool['avg_wait_ms']:.1f} мс, максимум {pool['max_wait_ms']:.1f} мс\n"
+        f"🔗 Открыто новых соединений: {pool['connects']}, в среднем {pool['avg_connect_ms']:.1f} мс, "
+        f"максимум {pool['max_connect_ms']:.1f} мс"
+    )
+
+@router.message(Command("reload_config"))
+async def reload_config(message: Message):
+    """Перечитать настройки окружения без перезапуска бота"""
+    reload_settings()
+    await message.answer("🔄 Настройки перечитаны")
+
+@router.message(Command("history_retention"))
+async def history_retention(message: Message, command: CommandObject, orm: ORM):
+    """Сколько записей истории удалит очистка (/history_retention [дней]), без удаления"""
+    days = int(command.args) if command.args and command.args.strip().isdigit() else get_settings().history_retention_days
+    if days <= 0:
+        await message.answer("🗂 Срок хранения истории не задан (HISTORY_RETENTION_DAYS). Укажите: /history_retention 90")
+        return
+    count = await cleanup_analysis_history(orm, days_to_keep=days, dry_run=True)
+    await message.answer(f"🗂 Записей истории старше {days} дн.: {count} (будут удалены очисткой)")
+
+@router.message(Command("ai_stats"))
+async def ai_stats(message: Message, command: CommandObject):
+    """Сводка телеметрии OpenAI: задержки, повторы и токены (/ai_stats [дней])"""
+    days = int(command.args) if command.args and command.args.strip().isdigit() else 7
+    stats = await asyncio.to_thread(summarize, days)
+
+    if not stats["total_attempts"]:
+        await message.answer(f"📊 Нет данных телеметрии AI за последние {days} дн.")
+        return
+
+    lines = [f"📊 <b>Телеметрия AI за {days} дн.</b> (попыток: {stats['total_attempts']})", ""]
+    for stage, stage_stats in sorted(stats["stages"].items()):
+        lines.append(
+            f"<b>{stage}</b>: вызовов {stage_stats['calls']}, попыток {stage_stats['attempts']}, "
+            f"ошибок {stage_stats['failures']}\n"
+            f"  p50 {stage_stats['p50_ms'] / 1000:.1f} с, p95 {stage_stats['p95_ms'] / 1000:.1f} с, "
+            f"повторы {stage_stats['retry_rate'] * 100:.0f}%"
+        )
+
+    lines.append("")
+    lines.append("<b>Токены по дням</b> (prompt / completion / из кеша):")
+    for day, tokens in stats["tokens_by_day"].items():
+        lines.append(f"{day}: {tokens['prompt']} / {tokens['completion']} / {tokens['cached']}")
+
+    await message.answer("\n".join(lines))
@@ -9,6 +9,9 @@ router = Router()
 # Фильтруем, чтобы inline-обработчик срабатывал только для админов
 router.inline_query.filter(RoleFilter(roles=["admin"]))
 
+# Сколько пользователей отдавать за раз; остальные Telegram догружает по next_offset
+INLINE_PAGE_SIZE = 20
+
 @router.inline_query()
 async def admin_user_search_inline(inline_query: InlineQuery, orm: ORM, i18n: I18n, user):
     """
@@ -22,8 +25,9 @@ async def admin_user_search_inline(inline_query: InlineQuery, orm: ORM, i18n: I1
         await inline_query.answer(results, cache_time=0)
         return
 
-    # Ищем пользователей в БД
-    users, _ = await orm.user_repo.search_users(query, page=0, limit=10)
+    # Ищем пользователей в БД (страница по offset из прошлого ответа)
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    users, has_more = await orm.user_repo.search_users(query, offset=offset, limit=INLINE_PAGE_SIZE)
 
     if users:
         for found_user in users:
@@ -49,4 +53,8 @@ async def admin_user_search_inline(inline_query: InlineQuery, orm: ORM, i18n: I1
             )
             results.append(result)
 
-    await inline_query.answer(results, cache_time=10) 
\ No newline at end of file
+    await inline_query.answer(
+        results,
+        cache_time=10,
+        next_offset=str(offset + len(users)) if has_more else ""
+    ) 
\ No newline at end of file
@@ -41,12 +41,10 @@ async def find_user(inq: InlineQuery, orm: ORM, i18n: I18n):
     user_lang = inq.from_user.language_code if inq.from_user.language_code in i18n.available_locales else 'ru'
 
     results = []
-    users = await orm.user_repo.find_all()
-    users = filter(lambda x: (x.username and query.lower() in x.username.lower())
-                             or (x.fullname and query.lower() in x.fullname.lower())
-                             or str(x.user_id).find(query) != -1, users)
-
+    offset = int(inq.offset) if inq.offset.isdigit() else 0
+    users, has_more = [], False
     if query:
+        users, has_more = await orm.user_repo.search_users(query, offset=offset, limit=20)
         for user in users:
             name_label = i18n.gettext("Имя:", locale=user_lang)
             workplace_label = i18n.gettext("Место работы:", locale=user_lang)
@@ -74,7 +72,11 @@ async def find_user(inq: InlineQuery, orm: ORM, i18n: I18n):
                     description=f"{user.city or ''} {user.affiliate or ''}"
                 )
             )
-    await inq.answer(results=results, cache_time=10)
+    await inq.answer(
+        results=results,
+        cache_time=10,
+        next_offset=str(offset + len(users)) if has_more else ""
+    )
 
 @router.message(Command("find"))
 async def find_command(message: Message, orm: ORM, i18n: I18n):
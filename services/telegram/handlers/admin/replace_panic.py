@@ -1,14 +1,16 @@
+import html
 import shutil
 from datetime import datetime
 import os
 import logging
 
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, Message
 
 from database.database import ORM
 from services.analyzer.xlsx import is_valid_panic_xlsx
 from services.analyzer import reload_known_error_codes
+from services.telegram.ai.prompt_cache import clear_prompt_cache
 from services.telegram.filters.role import RoleFilter
 from aiogram.utils.i18n import I18n
 
@@ -38,6 +40,9 @@ nand_list = dict(
     old=f"./data/old_cities/nand_list_{timestamp}.xlsx",
     name="nand_list.xlsx"
 )
+# Отчет об изменениях цен длиннее этого уходит файлом (лимит сообщения Telegram - 4096 символов)
+PRICING_REPORT_MAX_LENGTH = 3500
+
 regional_prices = dict(
     new=f"./data/verifying.regional_prices.xlsx",
     exist=f"./data/regional_prices.xlsx",
@@ -46,6 +51,20 @@ regional_prices = dict(
 )
 
 
+async def send_pricing_report(message: Message, header: str, diff: dict | None):
+    """Отправляет отчет об изменениях цен: текстом, а если он слишком длинный - файлом со сводкой."""
+    from services.regional_pricing_service import format_pricing_diff, summarize_pricing_diff
+
+    report = format_pricing_diff(diff)
+    if len(report) <= PRICING_REPORT_MAX_LENGTH:
+        await message.answer(text=f"{header}\n\n{html.escape(report)}")
+        return
+    await message.answer_document(
+        document=BufferedInputFile(report.encode("utf-8"), filename="regional_prices_changes.txt"),
+        caption=f"{header}\n\n{html.escape(summarize_pricing_diff(diff))}"
+    )
+
+
 @router.message(F.document.file_name.endswith(".xlsx"))
 async def replace_panic_file(message: Message, i18n: I18n, orm: ORM):
     await message.chat.do("typing")
@@ -80,14 +99,16 @@ async def replace_panic_file(message: Message, i18n: I18n, orm: ORM):
         if paths == regional_prices:
             from services.regional_pricing_service import load_regional_pricing_to_db
             try:
-                await load_regional_pricing_to_db(orm, paths["exist"])
-                await message.answer(text=i18n.gettext(f"Файл {paths['name']} заменен и данные обновлены."))
+                diff = await load_regional_pricing_to_db(orm, paths["exist"])
             except Exception as e:
                  logger.error(f"Ошибка при перезагрузке regional_prices: {e}")
                  await message.answer(text=i18n.gettext(f"Файл {paths['name']} заменен, но произошла ошибка при обновлении данных в базе."))
+                 return
+            await send_pricing_report(message, i18n.gettext(f"Файл {paths['name']} заменен и данные обновлены."), diff)
         elif paths == panic_codes:
             try:
                 updated_codes = reload_known_error_codes()
+                clear_prompt_cache()
                 logger.info(f"Перезагружен список кодов ошибок. Всего кодов: {len(updated_codes)}")
                 await message.answer(text=i18n.gettext(f"Файл {paths['name']} заменен и список кодов ошибок обновлен ({len(updated_codes)} кодов)."))
             except Exception as e:
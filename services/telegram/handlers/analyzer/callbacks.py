@@ -13,6 +13,7 @@ from aiogram.utils.i18n import I18n
 from database.models import User
 from services.telegram.misc.callbacks import ShowDiagnosticsCallback, FullButtonCallback
 from services.telegram.misc.keyboards import Keyboards
+from services.telegram.misc.payload_store import get_payload_store, full_answer_key
 from services.telegram.template.analyzer import template_about_analysis_result, template_about_analysis_result_header, SolutionAboutError
 from services.telegram.schemas.analyzer import ModelPhone
 from .utils import desanitize_callback_data
@@ -85,13 +86,13 @@ async def handle_show_full_answer(
     error_code = desanitize_callback_data(callback_data.error_code)
     model_id = callback_data.model
     
-    data = await state.get_data()
-    key = f"full_answer_{user.user_id}_{error_code}_{model_id}"
-    
-    if key not in data:
-        key = f"full_answer_{user.user_id}_{callback_data.error_code}_{model_id}"
-    
-    stored_data = data.get(key)
+    payload_store = get_payload_store()
+    key = full_answer_key(user.user_id, error_code, model_id)
+    stored_data = await payload_store.get(key)
+
+    if not stored_data:
+        key = full_answer_key(user.user_id, callback_data.error_code, model_id)
+        stored_data = await payload_store.get(key)
 
     if not stored_data:
         await callback_query.answer(
@@ -189,10 +190,8 @@ async def handle_show_full_answer(
     from .feedback import send_admin_notification_for_full_answer
     await send_admin_notification_for_full_answer(callback_query, stored_data, i18n, user)
 
-    # Удаляем данные из состояния
-    if key in data:
-        del data[key]
-        await state.set_data(data)
+    # Полный ответ показан, больше он не нужен
+    await payload_store.pop(key)
 
 
 def _create_short_info_for_consultation(user_message_text: str, i18n: I18n, lang: str) -> str:
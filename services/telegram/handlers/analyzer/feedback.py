@@ -15,6 +15,7 @@ from config import Environ
 from database.models import User
 from services.telegram.misc.callbacks import LikeDislikeCallback, ReportCallback, AdminCallback
 from services.telegram.misc.notifications.analyzer import notification_about_analysis_result
+from services.telegram.misc.payload_store import get_payload_store, feedback_key
 from services.telegram.template.analyzer import SolutionAboutError
 from .states import ReportState
 
@@ -147,13 +148,12 @@ async def _handle_dislike_action(query: CallbackQuery, new_kb: InlineKeyboardBui
         )
         
         # Сохраняем информацию для пересылки
-        data = await state.get_data()
-        chat_id = query.message.chat.id
-        message_id = query.message.message_id
-        key_suffix = f"_{chat_id}_{message_id}"
-        file_id = data.get(f"file_id{key_suffix}")
-        original_msg_id = data.get(f"original_msg_id{key_suffix}")
-        analysis_text = data.get(f"analysis_text{key_suffix}")
+        feedback_data = await get_payload_store().get(
+            feedback_key(query.message.chat.id, query.message.message_id)
+        ) or {}
+        file_id = feedback_data.get("file_id")
+        original_msg_id = feedback_data.get("original_msg_id")
+        analysis_text = feedback_data.get("analysis_text")
 
         await state.update_data(
             report_file_id=file_id,
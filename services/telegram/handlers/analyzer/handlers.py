@@ -3,6 +3,7 @@
 """
 import asyncio
 from datetime import datetime
+import hashlib
 import logging
 import re
 from typing import Optional
@@ -11,17 +12,22 @@ import os
 from aiogram import Router, F, Bot
 from aiogram.filters import or_f
 from aiogram.fsm.context import FSMContext
-from aiogram.types import Message
+from aiogram.types import ContentType, Message
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.utils.i18n import I18n
 
-from config import Environ, SUBSCRIPTION_ANALYSIS_LIMIT
+from config import Environ
 from database.database import ORM
 from database.models import User
+from database.session import release_request_session
 from services.analyzer.solutions import find_error_solutions
+from services.analysis_completion import complete_analysis
+from services.telegram.jobs.analysis_queue import AnalysisQueue, AnalysisJob, AnalysisQueueFull
 from services.telegram.filters.role import RoleFilter
 from services.telegram.misc.callbacks import FullButtonCallback, LikeDislikeCallback
 from services.telegram.misc.keyboards import Keyboards
+from services.telegram.misc.media_group import collect_media_group
+from services.telegram.misc.payload_store import get_payload_store, full_answer_key, feedback_key
 from services.telegram.misc.notifications.analyzer import notify_no_funds, notification_about_analysis_result
 from services.telegram.misc.utils import delete_message, remove_file
 from services.telegram.template.analyzer import template_about_analysis_result, template_about_analysis_result_header, \
@@ -49,34 +55,35 @@ async def document_analyze(
         orm: ORM,
         i18n: I18n,
         state: FSMContext,
-        env: Environ
+        env: Environ,
+        analysis_queue: Optional[AnalysisQueue] = None
 ):
-    """Основной обработчик анализа файлов"""
+    """Основной обработчик анализа файлов: проверки и постановка анализа в очередь"""
     logger.info(f"Starting analysis for user_id={user.user_id}, username={message.from_user.username if message.from_user else 'Unknown'}, user_lang={user.lang}")
     
     if not message.bot:
         await message.answer(i18n.gettext("Ошибка: бот недоступен", locale=user.lang))
         return
+
+    # Альбом скриншотов одного лога анализируем одним заданием
+    album = None
+    if message.media_group_id and message.photo:
+        album_messages = await collect_media_group(message)
+        if album_messages is None:
+            return
+        message, album = album_messages[0], album_messages[1:]
     
     # Проверяем ограничения по хешу файла ПЕРЕД началом анализа
+    file_hash = None
     if orm and orm.async_sessionmaker:
         try:
-            # Скачиваем файл для вычисления хеша
-            file_obj = None
-            if message.document:
-                file_obj = await message.bot.download(message.document)
-            elif message.photo:
-                file_obj = await message.bot.download(message.photo[-1])
-            
-            if file_obj:
-                from services.telegram.misc.utils import calculate_file_hash_from_file_like
-                file_hash = await calculate_file_hash_from_file_like(file_obj)
-                
-                # Проверяем ограничения по хешу
-                async with orm.async_sessionmaker() as session:
+            file_hash = await _calculate_upload_hash(message, album)
+            if file_hash:
+                # Проверяем ограничения по хешу и сразу занимаем круг анализа
+                async with orm.scoped_sessionmaker() as session:
                     from database.repo.analysis_history import AnalysisHistoryRepo
                     history_repo = AnalysisHistoryRepo(session)
-                    can_analyze, error_message, existing_analysis_id = await history_repo.can_analyze_file_by_hash(
+                    can_analyze, error_message = await history_repo.reserve_attempt_by_hash(
                         user.user_id, file_hash
                     )
                 
@@ -89,36 +96,139 @@ async def document_analyze(
         except Exception as e:
             logger.warning(f"Error checking file hash limitations: {e}")
             # Продолжаем анализ если не удалось проверить ограничения
-        
-    wait_message = await message.answer(i18n.gettext("Подождите, идет Анализ...", locale=user.lang))
+
+    if analysis_queue is None or not analysis_queue.is_running:
+        wait_message = await message.answer(i18n.gettext("Подождите, идет Анализ...", locale=user.lang))
+        await _run_analysis(message, user, orm, i18n, state, wait_message, album, file_hash)
+        return
+
+    wait_message = await message.answer(i18n.gettext("Анализ поставлен в очередь...", locale=user.lang))
+
+    async def on_position(position: int):
+        await wait_message.edit_text(
+            i18n.gettext("⏳ Файл в очереди на анализ: позиция {position}, ожидание ~{eta} сек.", locale=user.lang)
+            .format(position=position, eta=analysis_queue.estimate_wait(position))
+        )
+
+    async def on_start():
+        await wait_message.edit_text(i18n.gettext("Подождите, идет Анализ...", locale=user.lang))
+        await message.chat.do("typing")
+
+    async def on_finish(error: Optional[BaseException]):
+        # Ошибки анализа _run_analysis обрабатывает сам; сюда попадают только непредвиденные
+        if error is not None:
+            await wait_message.edit_text(
+                i18n.gettext("Произошла непредвиденная ошибка при анализе. Администраторы уведомлены.", locale=user.lang)
+            )
+
+    job = AnalysisJob(
+        run=lambda: _run_analysis(message, user, orm, i18n, state, wait_message, album, file_hash),
+        user_id=user.user_id,
+        on_start=on_start,
+        on_position=on_position,
+        on_finish=on_finish
+    )
+    try:
+        position = analysis_queue.submit(job)
+    except AnalysisQueueFull:
+        await _cancel_file_attempt(orm, user.user_id, file_hash)
+        await wait_message.edit_text(
+            i18n.gettext("⏳ Сейчас анализируется слишком много файлов. Пожалуйста, отправьте файл еще раз через пару минут.",
+                         locale=user.lang)
+        )
+        return
+
+    if position > 0:
+        await wait_message.edit_text(
+            i18n.gettext("⏳ Файл в очереди на анализ: позиция {position}, ожидание ~{eta} сек.", locale=user.lang)
+            .format(position=position, eta=analysis_queue.estimate_wait(position))
+        )
+
+
+async def _cancel_file_attempt(orm: ORM, user_id: int, file_hash: Optional[str]):
+    """Возвращает круг анализа файла, если анализ так и не состоялся."""
+    if not file_hash:
+        return
+    try:
+        async with orm.scoped_sessionmaker() as session:
+            from database.repo.analysis_history import AnalysisHistoryRepo
+            await AnalysisHistoryRepo(session).cancel_attempt_by_hash(user_id, file_hash)
+    except Exception as e:
+        logger.warning(f"Error releasing file attempt: {e}")
+
+
+async def _calculate_upload_hash(message: Message, album: Optional[list[Message]] = None) -> Optional[str]:
+    """
+    Хеш загруженного файла. Для альбома - хеш отсортированных хешей всех фото,
+    поэтому тот же альбом в другом порядке считается тем же файлом.
+    """
+    from services.telegram.misc.utils import calculate_file_hash_from_file_like
+
+    hashes = []
+    for item in [message] + (album or []):
+        if item.document:
+            file_obj = await message.bot.download(item.document)
+        elif item.photo:
+            file_obj = await message.bot.download(item.photo[-1])
+        else:
+            continue
+        if file_obj:
+            hashes.append(await calculate_file_hash_from_file_like(file_obj))
+    if not hashes:
+        return None
+    if len(hashes) == 1:
+        return hashes[0]
+    return hashlib.sha256("\n".join(sorted(hashes)).encode("utf-8")).hexdigest()
+
+
+async def _run_analysis(
+        message: Message,
+        user: User,
+        orm: ORM,
+        i18n: I18n,
+        state: FSMContext,
+        wait_message: Message,
+        album: Optional[list[Message]] = None,
+        file_hash: Optional[str] = None
+):
+    """Полный цикл анализа файла: поиск решения, списание, история, ответ"""
     await message.chat.do("typing")
     response_solutions = None
+    # Круг анализа, занятый по хешу, засчитывается только если анализ дошел до списания
+    attempt_settled = False
 
     try:
-        # Проверяем баланс токенов и подписку
-        if not orm or not orm.user_repo:
+        if not orm or not orm.async_sessionmaker:
             await message.answer(i18n.gettext("Ошибка: сервис временно недоступен", locale=user.lang))
             return
             
-        initial_token_balance = await orm.user_repo.get_token_balance(user.user_id)
-        active_subscription_for_balance_check = None
-
-        response_solutions = await find_error_solutions(message=message, user=user)
+        # Анализ долгий: соединение сессии обновления не должно простаивать все это время
+        await release_request_session()
+        response_solutions = await find_error_solutions(message=message, user=user, album=album)
         solution = response_solutions.solution
         phone_model_info = response_solutions.phone
         current_crash_reporter_key = getattr(phone_model_info, 'crash_reporter_key', None)
-        
         if current_crash_reporter_key:
             current_crash_reporter_key = current_crash_reporter_key.lower()
-            active_subscription_for_balance_check = await orm.user_repo.get_active_subscription(
-                user.user_id, current_crash_reporter_key
-            )
 
-        # Проверяем, есть ли средства для анализа
-        if initial_token_balance <= 0 and (
-            not active_subscription_for_balance_check or 
-            not active_subscription_for_balance_check.analysis_count > 0
-        ):
+        solution_found = bool(solution and solution.descriptions)
+
+        # Проверка средств, списание, история и счетчики попыток - одной транзакцией
+        completion = await complete_analysis(
+            orm,
+            user_id=user.user_id,
+            lang=user.lang,
+            i18n=i18n,
+            crash_reporter_key=current_crash_reporter_key,
+            product=getattr(phone_model_info, 'version', None),
+            solution_found=solution_found,
+            history_fields=_build_history_fields(message, solution, phone_model_info),
+            file_hash=file_hash,
+            # Ключ со скриншота распознается OCR и может быть обрезан
+            crash_key_may_be_truncated=response_solutions.content_type == ContentType.PHOTO
+        )
+        attempt_settled = completion.has_funds
+        if not completion.has_funds:
             await delete_message(message.bot, wait_message)
             return await notify_no_funds(message=message, orm=orm, i18n=i18n, user=user)
 
@@ -146,8 +256,6 @@ async def document_analyze(
         admin_solution_obj_for_notification = None
 
         # Обрабатываем результат анализа
-        solution_found = solution and solution.descriptions
-        
         if not solution_found:
             user_final_text = await _handle_no_solution(
                 solution, response_solutions, keyboard_builder, user_final_text, 
@@ -160,53 +268,13 @@ async def document_analyze(
                 admin_notification_body_parts, state, i18n, user, message
             )
 
-        # Обрабатываем токены и подписки ТОЛЬКО если найдено решение
-        if solution_found:
-            await _process_tokens_and_subscriptions(
-                orm, user, current_crash_reporter_key, phone_model_info, 
-                initial_token_balance, active_subscription_for_balance_check,
-                token_message_parts, i18n
-            )
-
-        # Удаляем сообщение ожидания
-        await delete_message(message.bot, wait_message)
+        # Сообщения о списании (формируются при завершении анализа)
+        token_message_parts.extend(completion.token_message_parts)
 
-        # Сохраняем анализ в истории
-        file_hash_for_attempts = None
-        try:
-            # Вычисляем хеш для обновления счетчиков попыток
-            file_obj = None
-            if message.document:
-                file_obj = await message.bot.download(message.document)
-            elif message.photo:
-                file_obj = await message.bot.download(message.photo[-1])
-            
-            if file_obj:
-                from services.telegram.misc.utils import calculate_file_hash_from_file_like
-                file_hash_for_attempts = await calculate_file_hash_from_file_like(file_obj)
-        except Exception as e:
-            logger.warning(f"Error calculating hash for attempt tracking: {e}")
-        
-        await _save_analysis_to_history(
-            orm, user, message, response_solutions, solution, 
-            phone_model_info, solution_found, token_message_parts
+        # Статус анализа: завершен (ответ придет следующим сообщением)
+        await _edit_wait_message(
+            message, wait_message, i18n.gettext("✅ Анализ завершен", locale=user.lang)
         )
-        
-        # Обновляем счетчики попыток по хешу файла
-        if file_hash_for_attempts and orm and orm.async_sessionmaker:
-            try:
-                async with orm.async_sessionmaker() as session:
-                    from database.repo.analysis_history import AnalysisHistoryRepo
-                    history_repo = AnalysisHistoryRepo(session)
-                    
-                    if solution_found:
-                        # При успешном анализе сбрасываем счетчик
-                        await history_repo.reset_attempts_by_hash(user.user_id, file_hash_for_attempts)
-                    else:
-                        # При неуспешном анализе увеличиваем счетчик
-                        await history_repo.increment_attempts_by_hash(user.user_id, file_hash_for_attempts)
-            except Exception as e:
-                logger.warning(f"Error updating attempt counters: {e}")
 
         # Добавляем кнопки лайка/дизлайка
         _add_feedback_buttons(keyboard_builder)
@@ -238,6 +306,8 @@ async def document_analyze(
         logger.exception(f"Произошла ошибка при анализе файла: {e}")
         await _handle_analysis_error(message, wait_message, e, i18n, user)
     finally:
+        if not attempt_settled:
+            await _cancel_file_attempt(orm, user.user_id, file_hash)
         # Очищаем временные файлы
         await _cleanup_temp_files(response_solutions)
 
@@ -373,71 +443,9 @@ async def _save_full_answer_data(state, solution, phone_model_info, model_id_for
             "original_from_user_full_name": getattr(message.from_user, 'full_name', None)
         })
     
-    await state.update_data({
-        f"full_answer_{user.user_id}_{solution.error_code}_{model_id_for_callback}": data_to_save
-    })
-
-
-async def _process_tokens_and_subscriptions(orm, user, current_crash_reporter_key, phone_model_info, 
-                                          initial_token_balance, active_subscription_for_balance_check,
-                                          token_message_parts, i18n):
-    """Обрабатывает токены и подписки"""
-    use_general_token = False
-
-    if current_crash_reporter_key:
-        active_subscription = await orm.user_repo.get_active_subscription(
-            user.user_id, current_crash_reporter_key
-        )
-
-        if active_subscription and active_subscription.analysis_count > 0:
-            updated_subscription = await orm.user_repo.decrement_subscription_analysis_count(
-                user.user_id, current_crash_reporter_key
-            )
-            if updated_subscription is not None:
-                remaining_analyses = updated_subscription.analysis_count
-                token_message_parts.append(
-                    i18n.gettext(
-                        "Анализ по подписке (осталось {count} бесплатных для этого устройства).", 
-                        locale=user.lang
-                    ).format(count=remaining_analyses)
-                )
-            else:
-                use_general_token = True
-        else:
-            use_general_token = True
-    else:
-        use_general_token = True
-
-    if use_general_token and initial_token_balance > 0:
-        new_balance = await orm.user_repo.deduct_token(user.user_id)
-        if new_balance is not None:
-            # Создаем новую подписку если есть crash_reporter_key
-            if current_crash_reporter_key and phone_model_info.version:
-                analyses_for_new_sub = SUBSCRIPTION_ANALYSIS_LIMIT - 1
-                await orm.user_repo.create_or_update_subscription(
-                    user_id=user.user_id,
-                    crash_reporter_key=current_crash_reporter_key,
-                    product=phone_model_info.version,
-                    analysis_limit=analyses_for_new_sub
-                )
-                token_message_parts.append(
-                    i18n.gettext(
-                        "Списан 1 токен (остаток: {balance}).\nНачался 30-дневный период: "
-                        "следующие {count} анализов для этого отчета будут бесплатными.",
-                        locale=user.lang
-                    ).format(balance=new_balance, count=analyses_for_new_sub)
-                )
-            else:
-                token_message_parts.append(
-                    i18n.gettext("Списан 1 токен (остаток: {balance}).", locale=user.lang)
-                    .format(balance=new_balance)
-                )
-        else:
-            token_message_parts.append(
-                i18n.gettext("Произошла ошибка при списании токена.", locale=user.lang)
-            )
-    elif use_general_token:
-        logger.warning(f"User {user.user_id} has 0 balance, but analysis proceeded to token deduction stage.")
+    await get_payload_store().put(
+        full_answer_key(user.user_id, solution.error_code, model_id_for_callback), data_to_save
+    )
 
 
 def _add_feedback_buttons(keyboard_builder):
@@ -480,10 +488,10 @@ async def _save_feedback_data(message, sent_message, user_final_text, state):
 
     # Сохраняем данные для дизлайков
     if file_id != "none":
-        await state.update_data({
-            f"file_id_{sent_message.chat.id}_{sent_message.message_id}": file_id,
-            f"original_msg_id_{sent_message.chat.id}_{sent_message.message_id}": message.message_id,
-            f"analysis_text_{sent_message.chat.id}_{sent_message.message_id}": user_final_text,
+        await get_payload_store().put(feedback_key(sent_message.chat.id, sent_message.message_id), {
+            "file_id": file_id,
+            "original_msg_id": message.message_id,
+            "analysis_text": user_final_text,
         })
 
 
@@ -533,13 +541,27 @@ def _create_short_consultation_info(user_final_text, i18n, lang):
     return short_info
 
 
-async def _handle_analysis_error(message, wait_message, error, i18n, user):
-    """Обрабатывает ошибки анализа"""
-    if message.bot and wait_message:
+async def _edit_wait_message(message, wait_message, text: str) -> bool:
+    """Обновляет сообщение о статусе анализа; если не вышло - удаляет его."""
+    if not message.bot or not wait_message:
+        return False
+    try:
+        await wait_message.edit_text(text)
+        return True
+    except Exception as e:
+        logger.warning(f"Не удалось обновить статус анализа: {e}")
         try:
             await delete_message(message.bot, wait_message)
         except Exception:
             pass
+        return False
+
+
+async def _handle_analysis_error(message, wait_message, error, i18n, user):
+    """Обрабатывает ошибки анализа"""
+    error_text = i18n.gettext("Произошла непредвиденная ошибка при анализе. Администраторы уведомлены.",
+                              locale=user.lang)
+    status_updated = await _edit_wait_message(message, wait_message, error_text)
     
     error_details_for_admin = SolutionAboutError(
         descriptions=[f"Подробности для администратора: {error}"],
@@ -565,161 +587,88 @@ async def _handle_analysis_error(message, wait_message, error, i18n, user):
     except Exception as notify_error:
         logger.error(f"Could not send error notification: {notify_error}")
     
-    await message.answer(
-        i18n.gettext("Произошла непредвиденная ошибка при анализе. Администраторы уведомлены.", 
-                     locale=user.lang)
-    )
+    if not status_updated:
+        await message.answer(error_text)
 
 
-async def _save_analysis_to_history(
-    orm, user, message, response_solutions, solution, 
-    phone_model_info, solution_found, token_message_parts
-):
-    """Сохраняет анализ в истории пользователя"""
-    try:
-        # Определяем тип файла и получаем file_id
-        file_type = "unknown"
-        original_filename = None
-        file_size = None
-        file_id = None  # Используем file_id вместо физического пути
-        file_hash = None  # Хеш файла для дедупликации
-        
-        # Вычисляем хеш файла
-        try:
-            file_obj = None
-            if message.document:
-                original_filename = message.document.file_name
-                file_size = message.document.file_size
-                file_id = message.document.file_id  # Сохраняем file_id от Telegram
-                file_obj = await message.bot.download(message.document)
-                if original_filename:
-                    if original_filename.endswith('.ips'):
-                        file_type = "ips"
-                    elif original_filename.endswith('.txt'):
-                        file_type = "txt"
-                    elif original_filename.endswith('.json'):
-                        file_type = "json"
-            elif message.photo:
-                file_type = "photo"
-                original_filename = "photo.jpg"
-                file_id = message.photo[-1].file_id  # Берем самое большое фото
-                file_obj = await message.bot.download(message.photo[-1])
-                if message.photo:
-                    file_size = message.photo[-1].file_size
-            
-            # Вычисляем хеш
-            if file_obj:
-                from services.telegram.misc.utils import calculate_file_hash_from_file_like
-                file_hash = await calculate_file_hash_from_file_like(file_obj)
-                logger.info(f"Calculated file hash: {file_hash}")
-        except Exception as e:
-            logger.warning(f"Error calculating file hash: {e}")
-            # Продолжаем без хеша
-
-        # Определяем количество потраченных токенов
-        tokens_used = 0
-        if solution_found and token_message_parts:
-            # Пытаемся извлечь количество токенов из сообщений
-            for token_msg in token_message_parts:
-                if isinstance(token_msg, str) and "Списан 1 токен" in token_msg:
-                    tokens_used = 1
-                    break
-        
-        # Формируем текст решения - БЕЗОПАСНО
-        solution_text = None
-        if solution and hasattr(solution, 'descriptions') and solution.descriptions:
-            try:
-                if isinstance(solution.descriptions, list):
-                    solution_text = "\n".join(str(desc) for desc in solution.descriptions if desc)
-                else:
-                    solution_text = str(solution.descriptions)
-                # Обрезаем если слишком длинный
-                if solution_text and len(solution_text) > 5000:
-                    solution_text = solution_text[:5000] + "..."
-            except Exception as e:
-                logger.warning(f"Error processing solution.descriptions: {e}")
-                solution_text = "Ошибка обработки решения"
-        
-        # Получаем информацию об ошибке - БЕЗОПАСНО
-        error_code = None
-        error_description = None
-        
-        if solution:
-            try:
-                if hasattr(solution, 'error_code') and solution.error_code:
-                    error_code = str(solution.error_code)[:500]  # Обрезаем
-            except Exception as e:
-                logger.warning(f"Error processing error_code: {e}")
-                
-            try:
-                if hasattr(solution, 'panic_string') and solution.panic_string:
-                    error_description = str(solution.panic_string)[:1000]  # Обрезаем
-            except Exception as e:
-                logger.warning(f"Error processing panic_string: {e}")
-        
-        # Получаем информацию об устройстве - БЕЗОПАСНО
-        device_model = None
-        ios_version = None
-        
-        if phone_model_info:
-            try:
-                if hasattr(phone_model_info, 'model') and phone_model_info.model:
-                    device_model = str(phone_model_info.model)[:200]  # Обрезаем
-            except Exception as e:
-                logger.warning(f"Error processing device_model: {e}")
-                
-            try:
-                if hasattr(phone_model_info, 'ios_version') and phone_model_info.ios_version:
-                    ios_version = str(phone_model_info.ios_version)[:100]  # Обрезаем
-            except Exception as e:
-                logger.warning(f"Error processing ios_version: {e}")
+def _build_history_fields(message, solution, phone_model_info) -> dict:
+    """Собирает поля записи истории анализа (хеш файла уже посчитан при проверке ограничений)"""
+    # Определяем тип файла и получаем file_id
+    file_type = "unknown"
+    original_filename = None
+    file_size = None
+    file_id = None  # Используем file_id вместо физического пути
 
-        # Безопасная обработка filename и размера
+    if message.document:
+        original_filename = message.document.file_name
+        file_size = message.document.file_size
+        file_id = message.document.file_id  # Сохраняем file_id от Telegram
         if original_filename:
-            original_filename = str(original_filename)[:500]  # Обрезаем
-        if file_size and not isinstance(file_size, int):
-            try:
-                file_size = int(file_size)
-            except:
-                file_size = 0
-
-        # Логируем параметры для отладки
-        logger.info(f"Saving analysis with params: user_id={user.user_id}, "
-                   f"device_model='{device_model}', ios_version='{ios_version}', "
-                   f"original_filename='{original_filename}', file_type='{file_type}', "
-                   f"file_size={file_size}, error_code='{error_code}', "
-                   f"solution_found={solution_found}, tokens_used={tokens_used}, "
-                   f"file_id='{file_id}'")
-
-        # Сохраняем в базу данных
-        if orm and orm.async_sessionmaker:
-            async with orm.async_sessionmaker() as session:
-                from database.repo.analysis_history import AnalysisHistoryRepo
-                history_repo = AnalysisHistoryRepo(session)
-                
-                await history_repo.create_analysis_record(
-                    user_id=int(user.user_id),
-                    device_model=device_model,
-                    ios_version=ios_version,
-                    original_filename=original_filename,
-                    file_type=str(file_type),
-                    file_size=file_size,
-                    file_path=file_id,  # Сохраняем file_id в поле file_path
-                    file_hash=file_hash,  # Сохраняем хеш файла
-                    error_code=error_code,
-                    error_description=error_description,
-                    solution_text=solution_text,
-                    is_solution_found=bool(solution_found),
-                    tokens_used=int(tokens_used)
-                )
-                
-            logger.info(f"Analysis saved to history for user {user.user_id}")
-        else:
-            logger.error("ORM or async_sessionmaker not available for saving history")
-        
-    except Exception as e:
-        logger.error(f"Error saving analysis to history for user {user.user_id}: {e}")
-        # Не прерываем основной процесс анализа при ошибке сохранения истории
+            if original_filename.endswith('.ips'):
+                file_type = "ips"
+            elif original_filename.endswith('.txt'):
+                file_type = "txt"
+            elif original_filename.endswith('.json'):
+                file_type = "json"
+    elif message.photo:
+        file_type = "photo"
+        original_filename = "photo.jpg"
+        file_id = message.photo[-1].file_id  # Берем самое большое фото
+        file_size = message.photo[-1].file_size
+
+    # Формируем текст решения - БЕЗОПАСНО
+    solution_text = None
+    if solution and hasattr(solution, 'descriptions') and solution.descriptions:
+        try:
+            if isinstance(solution.descriptions, list):
+                solution_text = "\n".join(str(desc) for desc in solution.descriptions if desc)
+            else:
+                solution_text = str(solution.descriptions)
+            # Обрезаем если слишком длинный
+            if solution_text and len(solution_text) > 5000:
+                solution_text = solution_text[:5000] + "..."
+        except Exception as e:
+            logger.warning(f"Error processing solution.descriptions: {e}")
+            solution_text = "Ошибка обработки решения"
+
+    # Получаем информацию об ошибке и устройстве, обрезая под размеры колонок
+    error_code = None
+    error_description = None
+    if solution:
+        if getattr(solution, 'error_code', None):
+            error_code = str(solution.error_code)[:500]
+        if getattr(solution, 'panic_string', None):
+            error_description = str(solution.panic_string)[:1000]
+
+    device_model = None
+    ios_version = None
+    if phone_model_info:
+        if getattr(phone_model_info, 'model', None):
+            device_model = str(phone_model_info.model)[:200]
+        if getattr(phone_model_info, 'ios_version', None):
+            ios_version = str(phone_model_info.ios_version)[:100]
+
+    # Безопасная обработка filename и размера
+    if original_filename:
+        original_filename = str(original_filename)[:500]
+    if file_size and not isinstance(file_size, int):
+        try:
+            file_size = int(file_size)
+        except (TypeError, ValueError):
+            file_size = 0
+
+    return dict(
+        device_model=device_model,
+        ios_version=ios_version,
+        original_filename=original_filename,
+        file_type=str(file_type),
+        file_size=file_size,
+        file_path=file_id,  # Сохраняем file_id в поле file_path
+        error_code=error_code,
+        error_description=error_description,
+        solution_text=solution_text,
+        prompt_version=getattr(solution, 'prompt_version', None)
+    )
 
 
 async def _cleanup_temp_files(response_solutions):
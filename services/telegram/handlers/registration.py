@@ -27,6 +27,7 @@ from services.telegram.handlers.admin import (
     inline_search as admin_inline_search
 )
 from services.telegram.middlewares.data import DataMiddleware
+from services.telegram.middlewares.db_session import DbSessionMiddleware
 
 router = Router()
 
@@ -222,6 +223,8 @@ class TgRegister:
         i18n_middleware = SimpleI18nMiddleware(self.i18n, "i18n", "i18n_middleware")
         middleware = DataMiddleware(self.orm, scheduler, i18n_middleware.i18n)
 
+        # Внешний middleware: сессия БД охватывает фильтры, DataMiddleware и обработчик
+        self.dp.update.outer_middleware(DbSessionMiddleware(self.orm))
         self.dp.update.middleware(middleware)
         self.dp.update.middleware(i18n_middleware)
         self.dp.callback_query.middleware(middleware)
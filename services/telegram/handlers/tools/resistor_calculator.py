@@ -16,6 +16,7 @@ from services.analyzer.resistor_calculator import (
     get_tolerance_for_smd_code, determine_resistor_series, find_closest_e24_value
 )
 from services.telegram.filters.role import RoleFilter
+from services.telegram.misc.payload_store import get_payload_store, feedback_key
 from services.telegram.misc.callbacks import (
     ResistorCallback, SmdSizeCallback, ResistorPowerCallback, ResistorModeCallback, SmdModeCallback,
     ResistorInfoCallback, LikeDislikeCallback
@@ -366,9 +367,9 @@ async def smd_size_select_handler(query: CallbackQuery, callback_data: SmdSizeCa
             await query.message.edit_text(response, reply_markup=builder.as_markup())
         
         # Save context for dislike system
-        await state.update_data({
-            f"analysis_text_{query.message.chat.id}_{query.message.message_id}": response
-        })
+        await get_payload_store().put(
+            feedback_key(query.message.chat.id, query.message.message_id), {"analysis_text": response}
+        )
     await query.answer()
 
 
@@ -4,7 +4,7 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InaccessibleMessage
 from aiogram.utils.i18n import I18n
 from aiogram.enums import ParseMode
-from typing import Union
+from typing import Optional, Union
 import urllib.parse
 
 from database.database import ORM
@@ -15,6 +15,7 @@ from services.telegram.misc.callbacks import (
     AnalysisHistoryPagination, AnalysisFilterCallback
 )
 from services.telegram.misc.keyboards import Keyboards
+from services.telegram.jobs.analysis_queue import AnalysisQueue
 
 logger = logging.getLogger(__name__)
 router = Router()
@@ -31,14 +32,14 @@ router.callback_query.filter(RoleFilter(roles=["admin", "user"]))
 async def show_analysis_history_main(message: Message, user: User, orm: ORM, i18n: I18n):
     """Показать главное меню истории анализов."""
     try:
-        if not orm or not hasattr(orm, 'analysis_history_repo') or not orm.analysis_history_repo or not orm.async_sessionmaker:
+        if not orm or not orm.scoped_sessionmaker:
             await message.answer(
                 i18n.gettext("❌ Сервис истории анализов временно недоступен", locale=user.lang)
             )
             return
 
         # Получаем статистику
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             stats = await history_repo.get_user_statistics(user.user_id)
@@ -99,128 +100,167 @@ async def show_analysis_history_main(message: Message, user: User, orm: ORM, i18
         )
 
 
-@router.callback_query(AnalysisHistoryCallback.filter(F.action == "list"))
-async def show_analysis_list(
-    callback: CallbackQuery, 
-    callback_data: AnalysisHistoryCallback,
-    user: User, 
-    orm: ORM, 
-    i18n: I18n
+HISTORY_PAGE_SIZE = 5
+
+
+def _history_filter_kwargs(filter_dict: dict | None) -> dict:
+    """Фильтр из callback-данных в аргументы get_user_history."""
+    if not filter_dict:
+        return {}
+    if filter_dict.get("type") == "file_type" and filter_dict.get("value"):
+        return {"file_type_filter": filter_dict["value"]}
+    if filter_dict.get("type") == "success":
+        return {"success_filter": filter_dict.get("value") == "true"}
+    return {}
+
+
+async def _show_history_page(
+    callback: CallbackQuery,
+    user: User,
+    orm: ORM,
+    i18n: I18n,
+    page: int = 0,
+    cursor: int | None = None,
+    backward: bool = False,
+    filter_dict: dict | None = None
 ):
-    """Показать список анализов с пагинацией."""
-    try:
-        if not orm or not orm.async_sessionmaker:
-            await callback.answer(
-                i18n.gettext("❌ Сервис временно недоступен", locale=user.lang), 
-                show_alert=True
-            )
-            return
-            
-        page = callback_data.page or 0
-        page_size = 5  # Увеличиваем до 5 элементов на странице
-        
-        # Получаем список анализов
-        async with orm.async_sessionmaker() as session:
-            from database.repo.analysis_history import AnalysisHistoryRepo
-            history_repo = AnalysisHistoryRepo(session)
+    """Загружает страницу истории по курсору и показывает ее в сообщении."""
+    from database.repo.analysis_history import AnalysisHistoryRepo
+
+    filter_kwargs = _history_filter_kwargs(filter_dict)
+    async with orm.scoped_sessionmaker() as session:
+        history_repo = AnalysisHistoryRepo(session)
+        history_data = await history_repo.get_user_history(
+            user_id=user.user_id,
+            page_size=HISTORY_PAGE_SIZE,
+            cursor=cursor,
+            backward=backward,
+            **filter_kwargs
+        )
+        if not history_data["analyses"] and cursor is not None:
+            # Запись-курсор удалена или страница опустела - начинаем сначала
+            page = 0
             history_data = await history_repo.get_user_history(
                 user_id=user.user_id,
-                page=page,
-                page_size=page_size
+                page_size=HISTORY_PAGE_SIZE,
+                **filter_kwargs
             )
-        
-        analyses = history_data["analyses"]
-        total_pages = history_data["total_pages"]
-        
-        if not analyses:
+
+    analyses = history_data["analyses"]
+    if not history_data["has_prev"]:
+        page = 0
+
+    if not analyses:
+        if filter_dict:
+            text = i18n.gettext(
+                "📭 *Анализы не найдены*\n\n"
+                "По выбранному фильтру анализы не найдены.",
+                locale=user.lang
+            )
+            keyboard = Keyboards.analysis_filter_menu(i18n, user)
+        else:
             text = i18n.gettext(
                 "📭 *У вас пока нет анализов*\n\n"
                 "Отправьте файл для анализа, чтобы он появился в истории!",
                 locale=user.lang
             )
             keyboard = Keyboards.analysis_history_main(i18n, user)
+    else:
+        if filter_dict:
+            text = i18n.gettext(
+                "📊 *Отфильтрованные анализы:*\n\n", 
+                locale=user.lang
+            )
         else:
             text = i18n.gettext(
                 "📊 *Ваши последние анализы:*\n\n", 
                 locale=user.lang
             )
+        
+        # Формируем список анализов
+        for i, analysis in enumerate(analyses, 1):
+            number = page * HISTORY_PAGE_SIZE + i
+            device_emoji = "📱" if analysis.device_model and ("iPhone" in analysis.device_model or "iPad" in analysis.device_model) else "📱"
             
-            # Формируем список анализов
-            for i, analysis in enumerate(analyses, 1):
-                number = page * page_size + i
-                device_emoji = "📱" if analysis.device_model and ("iPhone" in analysis.device_model or "iPad" in analysis.device_model) else "📱"
-                
-                file_type_emoji = {
-                    "ips": "📄",
-                    "txt": "📝", 
-                    "photo": "🖼️",
-                    "json": "🔧"
-                }.get(analysis.file_type, "📄")
-                
-                status_text = i18n.gettext("✅ Solution found", locale=user.lang) if analysis.is_solution_found else i18n.gettext("❌ Solution not found", locale=user.lang)
-                
-                # Безопасное экранирование для Markdown
-                device_name = analysis.device_model or i18n.gettext("Неизвестное устройство", locale=user.lang)
-                device_name = device_name.replace('*', '\\*').replace('_', '\\_').replace('[', '\\[').replace(']', '\\]')
-                
-                ios_version = analysis.ios_version or ""
-                ios_version = ios_version.replace('*', '\\*').replace('_', '\\_').replace('[', '\\[').replace(']', '\\]')
-                
-                # Правильное отображение типа файла
-                file_type_display = {
-                    "ips": ".ips",
-                    "txt": ".txt", 
-                    "photo": "photo",
-                    "json": ".json"
-                }.get(analysis.file_type, analysis.file_type or "file")
-                
-                # Форматируем дату
-                date_str = analysis.created_at.strftime("%d.%m.%Y, %H:%M")
-                
-                text += i18n.gettext(
-                    "   {number}. {device_emoji} {device}, {ios}\n"
-                    "      {file_emoji} Тип: {file_type}\n"
-                    "      📅 {date}\n"
-                    "      {status}\n\n",
-                    locale=user.lang
-                ).format(
-                    number=number,
-                    device_emoji=device_emoji,
-                    device=device_name,
-                    ios=ios_version,
-                    file_emoji=file_type_emoji,
-                    file_type=file_type_display,
-                    date=date_str,
-                    status=status_text
-                )
+            file_type_emoji = {
+                "ips": "📄",
+                "txt": "📝", 
+                "photo": "🖼️",
+                "json": "🔧"
+            }.get(analysis.file_type, "📄")
+            
+            status_text = i18n.gettext("✅ Solution found", locale=user.lang) if analysis.is_solution_found else i18n.gettext("❌ Solution not found", locale=user.lang)
+            
+            # Безопасное экранирование для Markdown
+            device_name = analysis.device_model or i18n.gettext("Неизвестное устройство", locale=user.lang)
+            device_name = device_name.replace('*', '\\*').replace('_', '\\_').replace('[', '\\[').replace(']', '\\]')
+            
+            ios_version = analysis.ios_version or ""
+            ios_version = ios_version.replace('*', '\\*').replace('_', '\\_').replace('[', '\\[').replace(']', '\\]')
             
-            # Исправляем отображение пагинации - убираем текст
-            # current_start = page * page_size + 1
-            # current_end = min((page + 1) * page_size, history_data["total_count"])
+            # Правильное отображение типа файла
+            file_type_display = {
+                "ips": ".ips",
+                "txt": ".txt", 
+                "photo": "photo",
+                "json": ".json"
+            }.get(analysis.file_type, analysis.file_type or "file")
             
-            # text += i18n.gettext(
-            #     "\\[{current_start}\\-{current_end} из {total}\\] ◀️ ▶️",
-            #     locale=user.lang
-            # ).format(
-            #     current_start=current_start,
-            #     current_end=current_end,
-            #     total=history_data["total_count"]
-            # )
+            # Форматируем дату
+            date_str = analysis.created_at.strftime("%d.%m.%Y, %H:%M")
             
-            keyboard = Keyboards.analysis_history_list(
-                i18n, user, analyses, page, total_pages
+            text += i18n.gettext(
+                "   {number}. {device_emoji} {device}, {ios}\n"
+                "      {file_emoji} Тип: {file_type}\n"
+                "      📅 {date}\n"
+                "      {status}\n\n",
+                locale=user.lang
+            ).format(
+                number=number,
+                device_emoji=device_emoji,
+                device=device_name,
+                ios=ios_version,
+                file_emoji=file_type_emoji,
+                file_type=file_type_display,
+                date=date_str,
+                status=status_text
             )
         
-        try:
-            if callback.message and hasattr(callback.message, 'edit_text'):
-                await callback.message.edit_text(  # type: ignore
-                    text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-        except Exception as e:
-            logger.warning(f"Could not edit message: {e}")
-        await callback.answer()
+        keyboard = Keyboards.analysis_history_list(
+            i18n, user, analyses, page,
+            history_data["has_prev"], history_data["has_next"], filter_dict
+        )
+    
+    try:
+        if callback.message and hasattr(callback.message, 'edit_text'):
+            await callback.message.edit_text(  # type: ignore
+                text,
+                reply_markup=keyboard,
+                parse_mode=ParseMode.MARKDOWN
+            )
+    except Exception as e:
+        logger.warning(f"Could not edit message: {e}")
+    await callback.answer()
+
+
+@router.callback_query(AnalysisHistoryCallback.filter(F.action == "list"))
+async def show_analysis_list(
+    callback: CallbackQuery, 
+    callback_data: AnalysisHistoryCallback,
+    user: User, 
+    orm: ORM, 
+    i18n: I18n
+):
+    """Показать первую страницу списка анализов."""
+    try:
+        if not orm or not orm.async_sessionmaker:
+            await callback.answer(
+                i18n.gettext("❌ Сервис временно недоступен", locale=user.lang), 
+                show_alert=True
+            )
+            return
+            
+        await _show_history_page(callback, user, orm, i18n)
         
     except Exception as e:
         logger.error(f"Error showing analysis list: {e}")
@@ -246,7 +286,7 @@ async def show_analysis_detail(
             )
             return
             
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             analysis = await history_repo.get_analysis_by_id(
@@ -288,7 +328,7 @@ async def show_analysis_detail(
             )
         
         # Проверяем возможность повторного анализа
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             history_repo = AnalysisHistoryRepo(session)
             can_repeat, error_message = await history_repo.can_repeat_analysis(
                 analysis.id, user.user_id
@@ -368,7 +408,7 @@ async def delete_analysis(
             )
             return
             
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             success = await history_repo.delete_analysis(
@@ -406,7 +446,7 @@ async def return_to_main(
 ):
     """Вернуться к главному меню истории анализов."""
     try:
-        if not orm or not hasattr(orm, 'analysis_history_repo') or not orm.analysis_history_repo or not orm.async_sessionmaker:
+        if not orm or not orm.scoped_sessionmaker:
             await callback.answer(
                 i18n.gettext("❌ Сервис истории анализов временно недоступен", locale=user.lang),
                 show_alert=True
@@ -414,7 +454,7 @@ async def return_to_main(
             return
 
         # Получаем статистику
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             stats = await history_repo.get_user_statistics(user.user_id)
@@ -489,7 +529,7 @@ async def handle_history_pagination(
     orm: ORM,
     i18n: I18n
 ):
-    """Обработка пагинации истории анализов с циклической навигацией."""
+    """Обработка пагинации истории анализов по курсору (с учетом фильтра)."""
     try:
         if not orm or not orm.async_sessionmaker:
             await callback.answer(
@@ -498,30 +538,20 @@ async def handle_history_pagination(
             )
             return
             
-        page = callback_data.page
-        page_size = 5  # Размер страницы 5
-        
-        # Получаем общее количество анализов для корректной циклической навигации
-        async with orm.async_sessionmaker() as session:
-            from database.repo.analysis_history import AnalysisHistoryRepo
-            history_repo = AnalysisHistoryRepo(session)
-            history_data = await history_repo.get_user_history(
-                user_id=user.user_id,
-                page=0,  # Сначала получаем первую страницу для определения общего количества
-                page_size=page_size
-            )
-        
-        total_pages = history_data["total_pages"]
+        filter_dict = None
+        if callback_data.filter_type:
+            filter_dict = {
+                "type": callback_data.filter_type,
+                "value": callback_data.filter_value
+            }
         
-        # Если запрошенная страница выходит за пределы, корректируем (циклическая навигация)
-        if page >= total_pages and total_pages > 0:
-            page = 0  # Переход на первую страницу
-        elif page < 0:
-            page = max(0, total_pages - 1)  # Переход на последнюю страницу
-        
-        # Создаем новый callback для отображения списка с корректной страницей
-        history_callback = AnalysisHistoryCallback(action="list", page=page)
-        await show_analysis_list(callback, history_callback, user, orm, i18n)
+        await _show_history_page(
+            callback, user, orm, i18n,
+            page=callback_data.page,
+            cursor=callback_data.cursor,
+            backward=callback_data.backward,
+            filter_dict=filter_dict
+        )
         
     except Exception as e:
         logger.error(f"Error handling pagination: {e}")
@@ -547,7 +577,7 @@ async def download_analysis_file(
             )
             return
             
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             analysis = await history_repo.get_analysis_by_id(
@@ -619,7 +649,7 @@ async def share_analysis(
             )
             return
             
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             analysis = await history_repo.get_analysis_by_id(
@@ -721,9 +751,10 @@ async def repeat_analysis(
     callback_data: AnalysisDetailCallback,
     user: User,
     orm: ORM,
-    i18n: I18n
+    i18n: I18n,
+    analysis_queue: Optional[AnalysisQueue] = None
 ):
-    """Повторить анализ автоматически."""
+    """Повторить анализ автоматически (через общую очередь анализа, если она запущена)."""
     try:
         if not orm or not orm.async_sessionmaker:
             await callback.answer(
@@ -732,7 +763,7 @@ async def repeat_analysis(
             )
             return
             
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             
@@ -811,14 +842,14 @@ async def repeat_analysis(
             from services.telegram.handlers.analyzer.handlers import document_analyze
             from aiogram.fsm.context import FSMContext
             from aiogram.fsm.storage.memory import MemoryStorage
-            from config import Environ
+            from settings import get_settings
             
             # Создаем временный FSM контекст
             from aiogram.fsm.storage.base import StorageKey
             storage = MemoryStorage()
             storage_key = StorageKey(bot_id=bot.id, chat_id=callback.message.chat.id, user_id=user.user_id)  # type: ignore
             state = FSMContext(storage=storage, key=storage_key)
-            env = Environ()
+            env = get_settings()
             
             # Удаляем сообщение ожидания перед запуском анализа
             from services.telegram.misc.utils import delete_message
@@ -826,7 +857,7 @@ async def repeat_analysis(
                 await delete_message(bot, wait_message)  # type: ignore
             
             # Увеличиваем счетчик попыток ДО запуска анализа
-            async with orm.async_sessionmaker() as session:
+            async with orm.scoped_sessionmaker() as session:
                 history_repo = AnalysisHistoryRepo(session)
                 await history_repo.increment_repeat_attempts(
                     callback_data.analysis_id, user.user_id
@@ -839,10 +870,10 @@ async def repeat_analysis(
                 current_attempts = current_analysis.repeat_attempts if current_analysis else 0
             
             # Запускаем полный анализ файла
-            await document_analyze(sent_message, user, orm, i18n, state, env)
+            await document_analyze(sent_message, user, orm, i18n, state, env, analysis_queue)
             
             # Проверяем результат и показываем информацию о кругах
-            async with orm.async_sessionmaker() as session:
+            async with orm.scoped_sessionmaker() as session:
                 history_repo = AnalysisHistoryRepo(session)
                 # Получаем результат анализа
                 updated_analysis = await history_repo.get_analysis_by_id(
@@ -1003,120 +1034,12 @@ async def apply_filter(
             return
         
         # Применяем фильтр
-        page_size = 5
         filter_dict = {
             "type": callback_data.filter_type,
             "value": callback_data.filter_value
         }
         
-        async with orm.async_sessionmaker() as session:
-            from database.repo.analysis_history import AnalysisHistoryRepo
-            history_repo = AnalysisHistoryRepo(session)
-            
-            # Получаем отфильтрованные данные
-            if callback_data.filter_type == "file_type" and callback_data.filter_value:
-                # Фильтр по типу файла
-                history_data = await history_repo.get_user_history(
-                    user_id=user.user_id,
-                    page=0,
-                    page_size=page_size,
-                    file_type_filter=callback_data.filter_value
-                )
-            elif callback_data.filter_type == "success":
-                # Фильтр по успешности
-                is_success = callback_data.filter_value == "true"
-                history_data = await history_repo.get_user_history(
-                    user_id=user.user_id,
-                    page=0,
-                    page_size=page_size,
-                    success_filter=is_success
-                )
-            else:
-                # По умолчанию без фильтра
-                history_data = await history_repo.get_user_history(
-                    user_id=user.user_id,
-                    page=0,
-                    page_size=page_size
-                )
-        
-        analyses = history_data["analyses"]
-        total_pages = history_data["total_pages"]
-        
-        if not analyses:
-            text = i18n.gettext(
-                "📭 *Анализы не найдены*\n\n"
-                "По выбранному фильтру анализы не найдены.",
-                locale=user.lang
-            )
-            keyboard = Keyboards.analysis_filter_menu(i18n, user)
-        else:
-            text = i18n.gettext(
-                "📊 *Отфильтрованные анализы:*\n\n", 
-                locale=user.lang
-            )
-            
-            # Формируем список анализов (та же логика что и в show_analysis_list)
-            for i, analysis in enumerate(analyses, 1):
-                device_emoji = "📱" if analysis.device_model and ("iPhone" in analysis.device_model or "iPad" in analysis.device_model) else "📱"
-                
-                file_type_emoji = {
-                    "ips": "📄",
-                    "txt": "📝", 
-                    "photo": "🖼️",
-                    "json": "🔧"
-                }.get(analysis.file_type, "📄")
-                
-                status_text = i18n.gettext("✅ Solution found", locale=user.lang) if analysis.is_solution_found else i18n.gettext("❌ Solution not found", locale=user.lang)
-                
-                # Безопасное экранирование для Markdown
-                device_name = analysis.device_model or i18n.gettext("Неизвестное устройство", locale=user.lang)
-                device_name = device_name.replace('*', '\\*').replace('_', '\\_').replace('[', '\\[').replace(']', '\\]')
-                
-                ios_version = analysis.ios_version or ""
-                ios_version = ios_version.replace('*', '\\*').replace('_', '\\_').replace('[', '\\[').replace(']', '\\]')
-                
-                # Правильное отображение типа файла
-                file_type_display = {
-                    "ips": ".ips",
-                    "txt": ".txt", 
-                    "photo": "photo",
-                    "json": ".json"
-                }.get(analysis.file_type, analysis.file_type or "file")
-                
-                # Форматируем дату
-                date_str = analysis.created_at.strftime("%d.%m.%Y, %H:%M")
-                
-                text += i18n.gettext(
-                    "   {number}. {device_emoji} {device}, {ios}\n"
-                    "      {file_emoji} Тип: {file_type}\n"
-                    "      📅 {date}\n"
-                    "      {status}\n\n",
-                    locale=user.lang
-                ).format(
-                    number=i,
-                    device_emoji=device_emoji,
-                    device=device_name,
-                    ios=ios_version,
-                    file_emoji=file_type_emoji,
-                    file_type=file_type_display,
-                    date=date_str,
-                    status=status_text
-                )
-            
-            keyboard = Keyboards.analysis_history_list(
-                i18n, user, analyses, 0, total_pages, filter_dict
-            )
-        
-        try:
-            if callback.message and hasattr(callback.message, 'edit_text'):
-                await callback.message.edit_text(  # type: ignore
-                    text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.MARKDOWN
-                )
-        except Exception as e:
-            logger.warning(f"Could not edit message: {e}")
-        await callback.answer()
+        await _show_history_page(callback, user, orm, i18n, filter_dict=filter_dict)
         
     except Exception as e:
         logger.error(f"Error applying filter: {e}")
@@ -1173,7 +1096,7 @@ async def clear_all_history(
             )
             return
             
-        async with orm.async_sessionmaker() as session:
+        async with orm.scoped_sessionmaker() as session:
             from database.repo.analysis_history import AnalysisHistoryRepo
             history_repo = AnalysisHistoryRepo(session)
             deleted_count = await history_repo.clear_user_history(user.user_id)
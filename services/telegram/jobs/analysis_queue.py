@@ -0,0 +1,150 @@
+"""
+Очередь фоновых задач анализа.
+
+Обработчик апдейта только ставит анализ в ограниченную очередь и сразу отвечает
+пользователю, а сам анализ выполняет фиксированный пул воркеров. Так всплеск
+загрузок не порождает неограниченное число одновременных анализов, каждый из
+которых держит память и соединения с БД.
+
+Статус задачи показывается пользователю через хуки AnalysisJob: on_position -
+новая позиция, когда задачи впереди уходят в работу; on_start - анализ начался;
+on_finish - анализ завершился (с ошибкой или без).
+"""
+import asyncio
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Начальная оценка длительности одного анализа (секунды), пока нет замеров
+DEFAULT_JOB_SECONDS = 20.0
+# Вес нового замера в скользящем среднем длительности
+DURATION_SMOOTHING = 0.2
+
+
+class AnalysisQueueFull(Exception):
+    """Очередь анализа заполнена, новая задача не принята."""
+
+
+@dataclass
+class AnalysisJob:
+    run: Callable[[], Awaitable[Any]]
+    user_id: int
+    on_start: Optional[Callable[[], Awaitable[Any]]] = None
+    on_position: Optional[Callable[[int], Awaitable[Any]]] = None
+    on_finish: Optional[Callable[[Optional[BaseException]], Awaitable[Any]]] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    position: int = 0
+
+
+class AnalysisQueue:
+    def __init__(self, workers: Optional[int] = None, maxsize: Optional[int] = None):
+        settings = get_settings()
+        if workers is None:
+            workers = settings.analysis_workers
+        if maxsize is None:
+            maxsize = settings.analysis_queue_size
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._busy = 0
+        self._avg_job_seconds = DEFAULT_JOB_SECONDS
+        # Ожидающие задачи в порядке очереди (для пересчета позиций)
+        self._waiting: List[AnalysisJob] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [
+            asyncio.create_task(self._worker(number), name=f"analysis-worker-{number}")
+            for number in range(1, self.workers + 1)
+        ]
+        logger.info(f"Очередь анализа запущена: воркеров {self.workers}, размер очереди {self.maxsize}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Очередь анализа остановлена")
+
+    def submit(self, job: AnalysisJob) -> int:
+        """
+        Ставит задачу в очередь.
+        Возвращает позицию в очереди (0 - свободный воркер возьмет задачу сразу).
+        Бросает AnalysisQueueFull, если очередь заполнена.
+        """
+        if self._queue is None:
+            raise RuntimeError("Очередь анализа не запущена")
+
+        position = max(0, self._queue.qsize() + self._busy - self.workers + 1)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise AnalysisQueueFull()
+        job.position = position
+        self._waiting.append(job)
+
+        logger.info(f"Анализ пользователя {job.user_id} поставлен в очередь, позиция {position}")
+        return position
+
+    def estimate_wait(self, position: int) -> int:
+        """Примерное ожидание (секунды) до начала анализа на данной позиции."""
+        if position <= 0:
+            return 0
+        return int(math.ceil(position / self.workers) * self._avg_job_seconds)
+
+    async def _call_hook(self, job: AnalysisJob, hook: Optional[Callable[..., Awaitable[Any]]], *args):
+        if hook is None:
+            return
+        try:
+            await hook(*args)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить статус анализа пользователя {job.user_id}: {e}")
+
+    def _refresh_positions(self):
+        """Сообщает ожидающим задачам новые позиции (в фоне, не задерживая воркер)."""
+        for index, job in enumerate(self._waiting):
+            position = max(0, index + 1 + self._busy - self.workers)
+            if 0 < position < job.position:
+                job.position = position
+                asyncio.create_task(self._call_hook(job, job.on_position, position))
+
+    async def _worker(self, number: int):
+        assert self._queue is not None
+        while True:
+            job: AnalysisJob = await self._queue.get()
+            self._waiting.remove(job)
+            self._busy += 1
+            started = time.monotonic()
+            logger.info(
+                f"Воркер {number}: анализ пользователя {job.user_id}, "
+                f"ожидание в очереди {started - job.enqueued_at:.1f} с"
+            )
+            self._refresh_positions()
+            error: Optional[BaseException] = None
+            try:
+                await self._call_hook(job, job.on_start)
+                await job.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = e
+                logger.exception(f"Воркер {number}: ошибка при выполнении анализа пользователя {job.user_id}: {e}")
+            finally:
+                elapsed = time.monotonic() - started
+                self._avg_job_seconds += DURATION_SMOOTHING * (elapsed - self._avg_job_seconds)
+                self._busy -= 1
+                self._queue.task_done()
+            await self._call_hook(job, job.on_finish, error)
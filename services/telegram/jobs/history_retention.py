@@ -0,0 +1,95 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from database.database import ORM
+from database.partitions import (
+    drop_history_partitions, ensure_history_partitions, is_history_partitioned, list_expired_partitions, month_start
+)
+from database.repo.analysis_history import AnalysisHistoryRepo
+from services.history_archive import archive_old_analyses
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+async def cleanup_analysis_history(orm: ORM, days_to_keep: Optional[int] = None,
+                                   dry_run: Optional[bool] = None) -> int:
+    """
+    Удаляет (или при dry_run считает) записи истории старше days_to_keep дней.
+    По умолчанию срок - HISTORY_RETENTION_DAYS (0 - история не удаляется),
+    dry_run - HISTORY_RETENTION_DRY_RUN (только посчитать и записать в лог).
+    Секционированная история очищается целыми месячными партициями.
+    При HISTORY_ARCHIVE записи сначала выгружаются в архив (см. services/history_archive.py).
+    """
+    settings = get_settings()
+    if days_to_keep is None:
+        days_to_keep = settings.history_retention_days
+    if dry_run is None:
+        dry_run = settings.history_retention_dry_run
+    logger.info(f"Запуск очистки истории анализов: старше {days_to_keep} дн., dry_run={dry_run}")
+    cutoff = datetime.utcnow() - timedelta(days=days_to_keep)
+    async with orm.engine.connect() as conn:
+        partitioned = await is_history_partitioned(conn)
+        expired_partitions = await list_expired_partitions(conn, cutoff) if partitioned else []
+    if partitioned:
+        if settings.history_archive and not dry_run:
+            # Удаляются только целые месяцы до cutoff - архивируем ровно эти партиции,
+            # а не строки партиции по умолчанию, которые остаются в базе
+            await archive_old_analyses(orm, month_start(cutoff), delete=False, partitions=expired_partitions)
+        count = await drop_history_partitions(orm.engine, cutoff, dry_run=dry_run, partitions=expired_partitions)
+        logger.info(f"Очистка партиций истории анализов (dry_run={dry_run}): {count} записей")
+        return count
+
+    if settings.history_archive and not dry_run:
+        result = await archive_old_analyses(orm, cutoff)
+        logger.info(f"Очистка истории анализов завершена: {result.deleted} записей перенесено в архив {result.path}")
+        return result.deleted
+
+    async with orm.async_sessionmaker() as session:
+        history_repo = AnalysisHistoryRepo(session)
+        count = await history_repo.cleanup_old_analyses(
+            days_to_keep=days_to_keep,
+            batch_size=settings.history_retention_batch_size,
+            dry_run=dry_run
+        )
+    if dry_run:
+        logger.info(f"Очистка истории анализов (dry run): к удалению {count} записей")
+    else:
+        logger.info(f"Очистка истории анализов завершена: удалено {count} записей")
+    return count
+
+
+async def prepare_history_partitions(orm: ORM):
+    """Создает партиции истории на ближайшие месяцы (если история секционирована)."""
+    await ensure_history_partitions(orm.engine)
+
+
+def schedule_history_retention(scheduler: AsyncIOScheduler, orm: ORM):
+    """Schedules partition maintenance and the nightly analysis history retention job."""
+    scheduler.add_job(
+        prepare_history_partitions,
+        trigger='cron',
+        hour=3,
+        minute=30,
+        kwargs={'orm': orm},
+        id='history_partitions_job',
+        name='Analysis History Partitions',
+        replace_existing=True
+    )
+    days_to_keep = get_settings().history_retention_days
+    if days_to_keep <= 0:
+        logger.info("Срок хранения истории анализов не задан, очистка не запланирована.")
+        return
+    scheduler.add_job(
+        cleanup_analysis_history,
+        trigger='cron',
+        hour=4,  # Ночью, после обновления курсов в 3:00
+        minute=0,
+        kwargs={'orm': orm},
+        id='history_retention_job',
+        name='Analysis History Retention',
+        replace_existing=True
+    )
+    logger.info(f"Очистка истории анализов старше {days_to_keep} дн. запланирована.")
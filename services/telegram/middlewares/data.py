@@ -5,8 +5,8 @@ from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject, Update, Message, CallbackQuery
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from config import Environ
 from database.database import ORM
+from settings import get_settings
 
 
 class DataMiddleware(BaseMiddleware):
@@ -22,7 +22,7 @@ class DataMiddleware(BaseMiddleware):
             event: TelegramObject,
             data: Dict[str, Any]
     ) -> Any:
-        data["env"] = Environ()
+        data["env"] = get_settings()
         data["orm"] = self.orm
         data["scheduler"] = self.scheduler
         data["i18n"] = self.i18n
@@ -38,7 +38,7 @@ class DataMiddleware(BaseMiddleware):
             
         if user_id and self.orm.user_repo:
             try:
-                user = await self.orm.user_repo.find_user_by_user_id(user_id)
+                user = await self.orm.user_repo.get_user_cached(user_id)
                 if user:
                     data["user"] = user
             except Exception as e:
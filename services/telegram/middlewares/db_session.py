@@ -0,0 +1,50 @@
+from typing import Dict, Any, Awaitable, Callable
+import logging
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from database.database import ORM
+from database.session import request_session, release_request_session, pool_stats, checkouts_per_update
+
+logger = logging.getLogger(__name__)
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Одна сессия БД (и одно соединение из пула) на все обращения к БД при обработке обновления."""
+
+    def __init__(self, orm: ORM):
+        self.orm = orm
+
+    async def __call__(
+            self,
+            handler: Callable[
+                [TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        pool_stats["updates"] += 1
+        try:
+            async with request_session(self.orm.async_sessionmaker):
+                return await handler(event, data)
+        finally:
+            logger.debug(f"Соединений из пула на обновление (в среднем): {checkouts_per_update():.2f}")
+
+
+class DbReleaseRequestMiddleware(BaseRequestMiddleware):
+    """
+    Middleware запросов к Telegram API: перед вызовом API сессия обновления
+    коммитится и отдает соединение в пул, чтобы оно не ждало ответа Telegram.
+    """
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ):
+        await release_request_session()
+        return await make_request(bot, method)
@@ -137,6 +137,8 @@ class AnalysisFilterCallback(CallbackData, prefix="hist_filter"):
 
 
 class AnalysisHistoryPagination(CallbackData, prefix="hist_page"):
-    page: int
+    page: int  # номер страницы только для нумерации, выборка идет по cursor
+    cursor: Optional[int] = None  # id крайней записи текущей страницы
+    backward: bool = False
     filter_type: Optional[str] = None
     filter_value: Optional[str] = None
@@ -1,7 +1,7 @@
 import logging
 import os
 
-dirs = ["./data/old_panics", "./data/old_cities", "./data/tmp"]
+dirs = ["./data/old_panics", "./data/old_cities", "./data/tmp", "./data/archive"]
 
 
 def create_dirs():
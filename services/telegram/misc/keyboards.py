@@ -449,10 +449,11 @@ class Keyboards:
         user, 
         analyses: list, 
         page: int, 
-        total_pages: int,
+        has_prev: bool,
+        has_next: bool,
         current_filter: dict | None = None
     ) -> InlineKeyboardMarkup:
-        """Клавиатура списка анализов с пагинацией."""
+        """Клавиатура списка анализов с пагинацией по курсору."""
         builder = InlineKeyboardBuilder()
         
         # Добавляем кнопки для каждого анализа
@@ -475,42 +476,45 @@ class Keyboards:
         # Размещаем анализы по одному в ряду для лучшей читаемости
         builder.adjust(1)
         
-        # Кнопки навигации с циклической логикой в одной строке
+        # Кнопки навигации в одной строке: курсор - крайняя запись текущей страницы
         nav_buttons = []
+        filter_type = current_filter.get("type") if current_filter else None
+        filter_value = current_filter.get("value") if current_filter else None
         
-        # Кнопка "Назад" - циклическая навигация
-        prev_page = page - 1 if page > 0 else total_pages - 1
-        nav_buttons.append(
-            InlineKeyboardButton(
-                text="◀️",
-                callback_data=AnalysisHistoryPagination(
-                    page=prev_page,
-                    filter_type=current_filter.get("type") if current_filter else None,
-                    filter_value=current_filter.get("value") if current_filter else None
-                ).pack()
+        if has_prev and analyses:
+            nav_buttons.append(
+                InlineKeyboardButton(
+                    text="◀️",
+                    callback_data=AnalysisHistoryPagination(
+                        page=max(0, page - 1),
+                        cursor=analyses[0].id,
+                        backward=True,
+                        filter_type=filter_type,
+                        filter_value=filter_value
+                    ).pack()
+                )
             )
-        )
         
         # Индикатор страницы
         nav_buttons.append(
             InlineKeyboardButton(
-                text=f"{page + 1}/{total_pages}" if total_pages > 0 else "1/1",
+                text=f"{page + 1}",
                 callback_data="nothing"
             )
         )
         
-        # Кнопка "Вперед" - циклическая навигация  
-        next_page = page + 1 if page < total_pages - 1 else 0
-        nav_buttons.append(
-            InlineKeyboardButton(
-                text="▶️",
-                callback_data=AnalysisHistoryPagination(
-                    page=next_page,
-                    filter_type=current_filter.get("type") if current_filter else None,
-                    filter_value=current_filter.get("value") if current_filter else None
-                ).pack()
+        if has_next and analyses:
+            nav_buttons.append(
+                InlineKeyboardButton(
+                    text="▶️",
+                    callback_data=AnalysisHistoryPagination(
+                        page=page + 1,
+                        cursor=analyses[-1].id,
+                        filter_type=filter_type,
+                        filter_value=filter_value
+                    ).pack()
+                )
             )
-        )
         
         # Добавляем кнопки навигации в одну строку
         if nav_buttons:
@@ -533,7 +537,7 @@ class Keyboards:
         )
         
         # Корректируем размещение: анализы по одному, навигация в одну строку, управление в три кнопки
-        adjust_args = [1] * len(analyses) + [3, 3]  # анализы по 1, навигация 3 в ряд, управление 3 в ряд
+        adjust_args = [1] * len(analyses) + [len(nav_buttons), 3]  # анализы по 1, навигация в ряд, управление 3 в ряд
         builder.adjust(*adjust_args)
         
         return builder.as_markup()
@@ -0,0 +1,129 @@
+"""
+Сборка альбомов (media group) из отдельных апдейтов.
+
+Telegram присылает каждое фото альбома отдельным апдейтом с общим media_group_id.
+Первое фото ждет короткое окно и забирает остальные, а обработчики остальных
+фото просто выходят: альбом анализируется, оплачивается и попадает в историю
+один раз.
+
+С FSM_STORAGE=redis апдейты одного альбома могут попасть на разные реплики бота,
+поэтому альбом собирается в Redis: каждое фото добавляется в список
+album:<chat_id>:<media_group_id>, а владельцем альбома становится тот, кто первым
+занял ключ владельца (SET NX). Владелец ждет окно и забирает весь список, остальные
+выходят. Ключи живут недолго (MEDIA_GROUP_TTL), поэтому опоздавшее фото не
+запускает второй анализ того же альбома.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Telegram не присылает в альбоме больше 10 элементов
+MEDIA_GROUP_MAX_ITEMS = 10
+MEDIA_GROUP_TTL = 60
+MEDIA_GROUP_KEY = "album:{chat_id}:{media_group_id}"
+MEDIA_GROUP_OWNER_KEY = "album_owner:{chat_id}:{media_group_id}"
+
+
+def _sorted_album(album: List[Message]) -> List[Message]:
+    return sorted(album, key=lambda item: item.message_id)
+
+
+class MemoryMediaGroupCollector:
+    """Альбомы в памяти процесса: годится, только если бот работает одной репликой."""
+
+    def __init__(self):
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            if len(album) < MEDIA_GROUP_MAX_ITEMS:
+                album.append(message)
+            return None
+
+        self._albums[key] = [message]
+        try:
+            await asyncio.sleep(get_settings().media_group_window)
+        finally:
+            album = self._albums.pop(key, [message])
+        return _sorted_album(album)
+
+    async def close(self):
+        self._albums.clear()
+
+
+class RedisMediaGroupCollector:
+    """Альбомы в Redis: общие для всех реплик бота."""
+
+    def __init__(self, url: str):
+        from redis import asyncio as aioredis
+        self._redis = aioredis.from_url(url)
+
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        names = dict(chat_id=message.chat.id, media_group_id=message.media_group_id)
+        album_key = MEDIA_GROUP_KEY.format(**names)
+        owner_key = MEDIA_GROUP_OWNER_KEY.format(**names)
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.rpush(album_key, message.model_dump_json(exclude_none=True))
+            pipe.expire(album_key, MEDIA_GROUP_TTL)
+            pipe.set(owner_key, "1", nx=True, ex=MEDIA_GROUP_TTL)
+            _, _, is_owner = await pipe.execute()
+        if not is_owner:
+            return None
+
+        await asyncio.sleep(get_settings().media_group_window)
+        # Ключ владельца остается до истечения TTL: опоздавшие фото не станут новым альбомом
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(album_key, 0, MEDIA_GROUP_MAX_ITEMS - 1)
+            pipe.delete(album_key)
+            raw_messages, _ = await pipe.execute()
+
+        album = []
+        for raw in raw_messages:
+            try:
+                album.append(Message.model_validate_json(raw).as_(message.bot))
+            except Exception as e:
+                logger.warning(f"Не удалось разобрать сообщение альбома {message.media_group_id}: {e}")
+        if not any(item.message_id == message.message_id for item in album):
+            album.append(message)
+        return _sorted_album(album)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+_collector = None
+
+
+def get_media_group_collector():
+    global _collector
+    if _collector is None:
+        settings = get_settings()
+        if settings.fsm_storage == "redis":
+            _collector = RedisMediaGroupCollector(settings.redis_url)
+        else:
+            _collector = MemoryMediaGroupCollector()
+    return _collector
+
+
+async def close_media_group_collector():
+    global _collector
+    if _collector is not None:
+        await _collector.close()
+        _collector = None
+
+
+async def collect_media_group(message: Message) -> Optional[List[Message]]:
+    """
+    Для первого сообщения альбома возвращает все сообщения альбома по порядку,
+    для остальных - None (их уже забрало первое).
+    """
+    return await get_media_group_collector().collect(message)
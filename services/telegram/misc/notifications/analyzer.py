@@ -7,11 +7,11 @@ from aiogram.types import Message
 from aiogram.utils.i18n import I18n
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from config import Environ
 from database.database import ORM
 from database.models import User
 from services.telegram.misc.utils import send_message_long
 from services.telegram.schemas.analyzer import SolutionAboutError
+from settings import get_settings
 
 
 async def notification_about_analysis_result(
@@ -24,8 +24,7 @@ async def notification_about_analysis_result(
 ) -> None:
     """Обработка и отправка результата анализа"""
 
-    env_config = Environ()
-    channel_id = env_config.channel_id
+    channel_id = get_settings().channel_id
     if not channel_id:
         logging.warning("ADMIN_CHANNEL_ID not set, skipping notification.")
         return
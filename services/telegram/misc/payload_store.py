@@ -0,0 +1,133 @@
+"""
+Хранилище данных, привязанных к сообщениям с результатом анализа.
+
+Полный ответ (для кнопки "Полный ответ") и контекст для обратной связи (текст
+анализа, file_id, id исходного сообщения) раньше складывались в данные FSM
+пользователя и не удалялись, из-за чего данные FSM росли без ограничения и
+копировались при каждом state.get_data(). Теперь они лежат здесь с TTL и
+ограничением размера, а ключ однозначно восстанавливается из callback-данных
+или из сообщения, поэтому в FSM ничего не хранится.
+
+Если FSM хранится в Redis (FSM_STORAGE=redis), эти данные тоже уходят в Redis,
+чтобы их видели все реплики бота.
+"""
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_KEY_PREFIX = "payload:"
+
+
+def full_answer_key(user_id: int, error_code: str, model: str) -> str:
+    return f"full_answer:{user_id}:{error_code}:{model}"
+
+
+def feedback_key(chat_id: int, message_id: int) -> str:
+    return f"feedback:{chat_id}:{message_id}"
+
+
+class MemoryPayloadStore:
+    """
+    LRU в памяти процесса: записи истекают по TTL, лишние вытесняются по давности.
+    Без явных ttl/max_items берутся текущие PAYLOAD_TTL/PAYLOAD_MAX_ITEMS из настроек.
+    """
+
+    def __init__(self, ttl: Optional[int] = None, max_items: Optional[int] = None):
+        self._ttl = ttl
+        self._max_items = max_items
+        self._items: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl if self._ttl is not None else get_settings().payload_ttl
+
+    @property
+    def max_items(self) -> int:
+        return max(1, self._max_items if self._max_items is not None else get_settings().payload_max_items)
+
+    def _evict(self):
+        now = time.monotonic()
+        max_items = self.max_items
+        # Давно не использованные записи в начале: снимаем истекшие и лишние, пока не встретим живую
+        while self._items:
+            key, (expires_at, _) = next(iter(self._items.items()))
+            if expires_at > now and len(self._items) <= max_items:
+                break
+            self._items.popitem(last=False)
+
+    async def put(self, key: str, value: Dict[str, Any]):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        self._evict()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    async def close(self):
+        self._items.clear()
+
+    async def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        value = await self.get(key)
+        self._items.pop(key, None)
+        return value
+
+
+class RedisPayloadStore:
+    def __init__(self, url: str, ttl: Optional[int] = None):
+        from redis import asyncio as aioredis
+        self._ttl = ttl
+        self._redis = aioredis.from_url(url)
+
+    @property
+    def ttl(self) -> int:
+        return self._ttl if self._ttl is not None else get_settings().payload_ttl
+
+    async def put(self, key: str, value: Dict[str, Any]):
+        payload = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        await self._redis.set(PAYLOAD_KEY_PREFIX + key, payload, ex=self.ttl)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = await self._redis.get(PAYLOAD_KEY_PREFIX + key)
+        return json.loads(payload) if payload else None
+
+    async def pop(self, key: str) -> Optional[Dict[str, Any]]:
+        payload = await self._redis.getdel(PAYLOAD_KEY_PREFIX + key)
+        return json.loads(payload) if payload else None
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+_store = None
+
+
+def get_payload_store():
+    global _store
+    if _store is None:
+        settings = get_settings()
+        if settings.fsm_storage == "redis":
+            _store = RedisPayloadStore(settings.redis_url)
+        else:
+            _store = MemoryPayloadStore()
+    return _store
+
+
+async def close_payload_store():
+    global _store
+    if _store is not None:
+        await _store.close()
+        _store = None
@@ -31,6 +31,7 @@ class SolutionAboutError:
     has_full_solution_available: bool = False
     full_descriptions: typing.Optional[list[str]] = None
     full_links: typing.Optional[list[str]] = None
+    prompt_version: typing.Optional[str] = None
 
     def show_solution(self):
         return "\n".join(self.descriptions)
@@ -0,0 +1,77 @@
+"""
+Режим webhook как альтернатива long polling.
+
+Telegram присылает апдейты POST-запросами на aiohttp-сервер, поэтому несколько
+реплик бота без собственного состояния могут стоять за балансировщиком.
+Запросы проверяются по секретному токену (заголовок X-Telegram-Bot-Api-Secret-Token),
+число одновременно обрабатываемых апдейтов ограничено, а /healthz отвечает
+балансировщику.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+HEALTH_PATH = "/healthz"
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обрабатывает апдейты в фоне, но не более max_updates одновременно."""
+
+    def __init__(self, *args, max_updates: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if max_updates is None:
+            max_updates = get_settings().webhook_max_updates
+        self._semaphore = asyncio.Semaphore(max(1, max_updates))
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Регистрирует webhook в Telegram и обслуживает апдейты до остановки процесса."""
+    settings = get_settings()
+    if not settings.webhook_url:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_URL")
+    if not settings.webhook_secret:
+        logger.warning("WEBHOOK_SECRET не задан: запросы к webhook не проверяются")
+
+    app = web.Application()
+    app.router.add_get(HEALTH_PATH, health)
+    BoundedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=settings.webhook_secret or None,
+        max_updates=settings.webhook_max_updates,
+    ).register(app, path=settings.webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    await bot.set_webhook(
+        url=settings.webhook_url.rstrip("/") + settings.webhook_path,
+        secret_token=settings.webhook_secret or None,
+        max_connections=min(100, max(1, settings.webhook_max_updates)),
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.webhook_host, port=settings.webhook_port)
+    await site.start()
+    logger.info(f"Webhook запущен на {settings.webhook_host}:{settings.webhook_port}{settings.webhook_path}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,129 @@
+"""
+Снимок настроек процесса.
+
+Environ() при каждом создании заново читает переменные окружения и .env, а
+создавался он на каждое обновление (DataMiddleware), в каждом уведомлении об
+анализе, в ORM и т.д. Теперь настройки читаются один раз при старте, а дальше
+все берут один и тот же неизменяемый снимок через get_settings().
+
+Перечитать настройки без перезапуска можно сигналом SIGHUP или командой
+администратора /reload_config: создается новый снимок и атомарно подменяет
+старый, уже выданные ссылки на старый снимок остаются согласованными.
+
+В снимок входят и параметры производительности (пулы, очереди, TTL кешей,
+webhook и т.д., см. TUNING): модули читают их через get_settings() в момент
+использования, поэтому /reload_config меняет их для всего, что создается или
+вызывается после перечитывания (размер уже созданного пула БД или порт уже
+запущенного webhook, конечно, не меняются).
+"""
+import logging
+import os
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from config import Environ
+
+logger = logging.getLogger(__name__)
+
+
+def _flag(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+# Атрибут снимка -> (переменная окружения, преобразование, значение по умолчанию)
+TUNING: Dict[str, Tuple[str, Callable[[str], Any], str]] = {
+    # Пул соединений с БД
+    "db_pool_size": ("DB_POOL_SIZE", int, "5"),
+    "db_max_overflow": ("DB_MAX_OVERFLOW", int, "10"),
+    "db_pool_timeout": ("DB_POOL_TIMEOUT", float, "30"),
+    "db_pool_recycle": ("DB_POOL_RECYCLE", int, "1800"),
+    "db_statement_cache_size": ("DB_STATEMENT_CACHE_SIZE", int, "100"),
+    "db_pool_warmup": ("DB_POOL_WARMUP", _flag, "1"),
+    # Анализ логов
+    "analysis_workers": ("ANALYSIS_WORKERS", int, "2"),
+    "analysis_queue_size": ("ANALYSIS_QUEUE_SIZE", int, "20"),
+    "analysis_backend": ("ANALYSIS_BACKEND", str.lower, "inline"),
+    "analysis_processes": ("ANALYSIS_PROCESSES", int, "2"),
+    "analysis_job_timeout": ("ANALYSIS_JOB_TIMEOUT", int, "300"),
+    # Webhook
+    "webhook_url": ("WEBHOOK_URL", str, ""),
+    "webhook_path": ("WEBHOOK_PATH", str, "/webhook"),
+    "webhook_secret": ("WEBHOOK_SECRET", str, ""),
+    "webhook_host": ("WEBHOOK_HOST", str, "0.0.0.0"),
+    "webhook_port": ("WEBHOOK_PORT", int, "8080"),
+    "webhook_max_updates": ("WEBHOOK_MAX_UPDATES", int, "40"),
+    # Redis и FSM
+    "redis_url": ("REDIS_URL", str, "redis://localhost:6379/0"),
+    "fsm_storage": ("FSM_STORAGE", str.lower, "memory"),
+    "fsm_ttl": ("FSM_TTL", int, "0"),
+    "payload_ttl": ("PAYLOAD_TTL", int, str(7 * 24 * 3600)),
+    "payload_max_items": ("PAYLOAD_MAX_ITEMS", int, "5000"),
+    "media_group_window": ("MEDIA_GROUP_WINDOW", float, "1.5"),
+    # Кеши
+    "user_cache_ttl": ("USER_CACHE_TTL", float, "30"),
+    "user_search_cache_ttl": ("USER_SEARCH_CACHE_TTL", float, "15"),
+    "pricing_cache_ttl": ("PRICING_CACHE_TTL", float, "3600"),
+    "pricing_upsert_chunk_size": ("PRICING_UPSERT_CHUNK_SIZE", int, "1000"),
+    # История анализов
+    "history_retention_days": ("HISTORY_RETENTION_DAYS", int, "0"),
+    "history_retention_batch_size": ("HISTORY_RETENTION_BATCH_SIZE", int, "5000"),
+    "history_retention_dry_run": ("HISTORY_RETENTION_DRY_RUN", _flag, "0"),
+    "history_archive": ("HISTORY_ARCHIVE", _flag, "0"),
+    "history_archive_dir": ("HISTORY_ARCHIVE_DIR", str, "data/archive"),
+    "history_archive_batch_size": ("HISTORY_ARCHIVE_BATCH_SIZE", int, "5000"),
+    "history_partition_months_ahead": ("HISTORY_PARTITION_MONTHS_AHEAD", int, "2"),
+}
+
+
+def _read_tuning(environ: Mapping[str, str]) -> Mapping[str, Any]:
+    return MappingProxyType({
+        name: cast(environ.get(variable, default))
+        for name, (variable, cast, default) in TUNING.items()
+    })
+
+
+class SettingsSnapshot:
+    """Неизменяемая обертка над Environ и параметрами TUNING: атрибуты только для чтения."""
+
+    __slots__ = ("_env", "_tuning")
+
+    def __init__(self, env: Environ):
+        object.__setattr__(self, "_env", env)
+        # Параметры читаются после создания Environ: он может подгрузить .env в окружение
+        object.__setattr__(self, "_tuning", _read_tuning(os.environ))
+
+    def __getattr__(self, name):
+        tuning = self._tuning
+        if name in tuning:
+            return tuning[name]
+        return getattr(self._env, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Настройки доступны только для чтения, используйте reload_settings()")
+
+    def __delattr__(self, name):
+        raise AttributeError("Настройки доступны только для чтения, используйте reload_settings()")
+
+
+_settings: Optional[SettingsSnapshot] = None
+
+
+def get_settings() -> SettingsSnapshot:
+    """Текущий снимок настроек (создается при первом обращении)."""
+    global _settings
+    if _settings is None:
+        _settings = SettingsSnapshot(Environ())
+    return _settings
+
+
+def reload_settings() -> SettingsSnapshot:
+    """Перечитывает окружение и подменяет снимок; при ошибке остается прежний."""
+    global _settings
+    try:
+        snapshot = SettingsSnapshot(Environ())
+    except Exception as e:
+        logger.error(f"Не удалось перечитать настройки, остается прежний снимок: {e}")
+        return get_settings()
+    _settings = snapshot
+    logger.info("Настройки перечитаны")
+    return snapshot
@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import logging
 import os
+import signal
 
 import coloredlogs
 from aiogram import Bot, Dispatcher
@@ -11,36 +12,48 @@ from aiogram.client.default import DefaultBotProperties
 
 from config import Environ, DEBUG_MODE
 from database.database import ORM
-from services.analyzer import KNOWN_ERROR_CODES
 from services.telegram.jobs.tasks import check_subscribe_client, grant_monthly_token_bonus
+from services.telegram.jobs.analysis_queue import AnalysisQueue
+from services.telegram.jobs.history_retention import schedule_history_retention, prepare_history_partitions
+from services.analyzer.workers import get_analysis_backend, close_analysis_backend
+from services.telegram.misc.payload_store import close_payload_store
+from services.telegram.misc.media_group import close_media_group_collector
+from services.telegram.middlewares.db_session import DbReleaseRequestMiddleware
 from services.telegram.misc.create_dirs import create_dirs
+from services.telegram.fsm_storage import create_fsm_storage
 from services.telegram.handlers.registration import TgRegister
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from services.exchange_rates import update_database_rates
 from services.regional_pricing_service import load_regional_pricing_to_db
+from settings import SettingsSnapshot, get_settings, reload_settings
 
 
 # Создаем кастомный класс Bot для хранения окружения
 class MyBot(Bot):
-    environment: Environ
+    @property
+    def environment(self) -> SettingsSnapshot:
+        """Текущий снимок настроек (после /reload_config или SIGHUP - уже новый)."""
+        return get_settings()
 
 
-async def start(environment: Environ):
+async def start(environment: Environ, webhook: bool = False):
     orm = ORM()
 
     bot = MyBot(
         token=environment.bot_token,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
-    dp = Dispatcher()
+    # Перед каждым вызовом Telegram API сессия обновления отдает соединение с БД
+    bot.session.middleware(DbReleaseRequestMiddleware())
+    dp = Dispatcher(storage=create_fsm_storage())
 
-    # Добавляем переменные окружения в атрибуты бота
-    bot.environment = environment
     orm.create_tables(with_drop=False, echo=False)
     os.makedirs("data/tmp", exist_ok=True)
     await orm.create_repos()
+    await prepare_history_partitions(orm)
+    await orm.warm_up()
 
     for admin_id in environment.admins:
         try:
@@ -83,20 +96,45 @@ async def start(environment: Environ):
         CronTrigger(day=1, hour=0, minute=5),
         args=(orm, bot, i18n)
     )
+    schedule_history_retention(scheduler, orm)
     scheduler.start()
 
+    # Пул воркеров анализа, обработчик получает очередь через данные диспетчера
+    analysis_queue = AnalysisQueue()
+    await analysis_queue.start()
+    dp["analysis_queue"] = analysis_queue
+    get_analysis_backend()
+
+    # SIGHUP перечитывает настройки без перезапуска бота (на Windows сигнала нет)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    except (AttributeError, NotImplementedError):
+        pass
+
     try:
-        await dp.start_polling(bot)
+        if webhook:
+            from services.telegram.webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            # После запуска с --webhook Telegram отвечает на getUpdates 409, пока webhook не снят
+            await bot.delete_webhook(drop_pending_updates=False)
+            await dp.start_polling(bot)
     finally:
+        await analysis_queue.stop()
+        await close_analysis_backend()
+        await close_payload_store()
+        await close_media_group_collector()
         scheduler.shutdown()
+        await dp.storage.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-r", "--recreate-db", action="store_true", help="Recreate database tables")
+    parser.add_argument("-w", "--webhook", action="store_true", help="Serve updates via webhook instead of long polling")
     args = parser.parse_args()
 
-    env = Environ()
+    env = get_settings()
     logging.basicConfig(level=env.logging_level)
     coloredlogs.install()
 
@@ -105,4 +143,4 @@ if __name__ == "__main__":
         orm_sync = ORM()
         orm_sync.create_tables(with_drop=True)
 
-    asyncio.run(start(env))
+    asyncio.run(start(env, webhook=args.webhook))
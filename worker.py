@@ -0,0 +1,41 @@
+import argparse
+import logging
+import multiprocessing
+
+import coloredlogs
+
+from services.analyzer.workers import serve_redis_worker
+from settings import get_settings
+
+
+def run_worker(url: str, logging_level):
+    logging.basicConfig(level=logging_level)
+    coloredlogs.install()
+    try:
+        serve_redis_worker(url)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    # Процессы анализа для режима ANALYSIS_BACKEND=redis: бот только принимает
+    # апдейты и отвечает, а разбор файлов выполняется здесь.
+    env = get_settings()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--processes", type=int, default=env.analysis_processes, help="Number of worker processes")
+    parser.add_argument("--redis-url", default=env.redis_url, help="Redis broker URL")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=run_worker, args=(args.redis_url, env.logging_level), name=f"analysis-worker-{number}")
+        for number in range(1, max(1, args.processes) + 1)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()